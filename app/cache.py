@@ -0,0 +1,284 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.db import in_array
+from app.models import UserPreference
+
+logger = logging.getLogger(__name__)
+
+# Caches a row only if the user's version (KEYS[2]) is still the one read
+# before the row was loaded (ARGV[1], '' for none): otherwise the row was
+# invalidated meanwhile and may be stale
+SET_IF_CURRENT_SCRIPT = """
+local version = redis.call('GET', KEYS[2]) or ''
+if version ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class CachedPreference:
+    """Immutable snapshot of a user's delivery preferences."""
+
+    user_id: str
+    email_enabled: bool
+    sms_enabled: bool
+    email: Optional[str]
+    phone_number: Optional[str]
+    # Delivery rules; defaults keep entries cached by earlier releases readable
+    timezone: Optional[str] = None
+    quiet_hours_start: Optional[str] = None  # "HH:MM:SS", local time
+    quiet_hours_end: Optional[str] = None
+    max_per_window: Optional[int] = None
+    frequency_window_seconds: Optional[int] = None
+    digest_on_overflow: bool = False
+
+    @classmethod
+    def from_model(cls, preference: UserPreference) -> "CachedPreference":
+        return cls(
+            user_id=preference.user_id,
+            email_enabled=preference.email_enabled,
+            sms_enabled=preference.sms_enabled,
+            email=preference.email,
+            phone_number=preference.phone_number,
+            timezone=preference.timezone,
+            quiet_hours_start=(
+                preference.quiet_hours_start.isoformat()
+                if preference.quiet_hours_start
+                else None
+            ),
+            quiet_hours_end=(
+                preference.quiet_hours_end.isoformat()
+                if preference.quiet_hours_end
+                else None
+            ),
+            max_per_window=preference.max_per_window,
+            frequency_window_seconds=preference.frequency_window_seconds,
+            digest_on_overflow=bool(preference.digest_on_overflow),
+        )
+
+
+class PreferencesCache:
+    """Read-through cache in front of UserPreference lookups.
+
+    The first tier is an in-process LRU with a short TTL. The optional second
+    tier is Redis, shared by every replica. Writes invalidate both tiers for
+    the writing process; other replicas' local entries expire within the
+    local TTL.
+
+    A read that loaded a row before a write committed must not cache it after
+    the write's invalidation. Invalidations are counted in the process and
+    versioned per user in Redis, and a loaded row is only cached if neither
+    changed while it was being read.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: float = 30,
+        redis_url: Optional[str] = None,
+        redis_ttl: int = 300,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+        self._redis = redis.from_url(redis_url) if redis_url else None
+        self._set_if_current = (
+            self._redis.register_script(SET_IF_CURRENT_SCRIPT) if self._redis else None
+        )
+        self._local = OrderedDict()  # user_id -> (expires_at, CachedPreference)
+        self._invalidations = 0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"preferences:{user_id}"
+
+    @staticmethod
+    def _version_key(user_id: str) -> str:
+        return f"preferences:{user_id}:version"
+
+    def _get_local(self, user_id: str) -> Optional[CachedPreference]:
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        expires_at, preference = entry
+        if expires_at < time.monotonic():
+            del self._local[user_id]
+            return None
+        self._local.move_to_end(user_id)
+        return preference
+
+    def _set_local(self, preference: CachedPreference, invalidations: int):
+        if invalidations != self._invalidations:
+            return  # something was invalidated since it was read
+        self._local[preference.user_id] = (time.monotonic() + self.ttl, preference)
+        self._local.move_to_end(preference.user_id)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def _get_shared(
+        self, user_ids: list[str]
+    ) -> tuple[dict[str, CachedPreference], dict[str, str]]:
+        """Return the cached preferences, and the versions of the others."""
+        if self._redis is None or not user_ids:
+            return {}, {}
+        keys = [self._key(u) for u in user_ids] + [
+            self._version_key(u) for u in user_ids
+        ]
+        try:
+            values = await self._redis.mget(keys)
+        except RedisError as e:
+            logger.warning("Preferences cache unavailable: %s", e)
+            return {}, {}
+        found = {}
+        versions = {}
+        for user_id, value, version in zip(
+            user_ids, values[: len(user_ids)], values[len(user_ids) :]
+        ):
+            if value is not None:
+                found[user_id] = CachedPreference(**json.loads(value))
+            else:
+                versions[user_id] = version.decode() if version else ""
+        return found, versions
+
+    async def _set_shared(
+        self, preferences: list[CachedPreference], versions: dict[str, str]
+    ):
+        if self._redis is None or not preferences:
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for preference in preferences:
+                    await self._set_if_current(
+                        keys=[
+                            self._key(preference.user_id),
+                            self._version_key(preference.user_id),
+                        ],
+                        args=[
+                            versions.get(preference.user_id, ""),
+                            json.dumps(asdict(preference)),
+                            self.redis_ttl,
+                        ],
+                        client=pipe,
+                    )
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Preferences cache unavailable: %s", e)
+
+    async def get(self, db, user_id: str) -> Optional[CachedPreference]:
+        """Return a user's preferences, or None if they have none."""
+        preference = self._get_local(user_id)
+        if preference is not None:
+            self.hits += 1
+            return preference
+
+        invalidations = self._invalidations
+        shared, versions = await self._get_shared([user_id])
+        preference = shared.get(user_id)
+        if preference is not None:
+            self.redis_hits += 1
+            self._set_local(preference, invalidations)
+            return preference
+
+        self.misses += 1
+        result = await db.execute(
+            select(UserPreference).where(UserPreference.user_id == user_id)
+        )
+        row = result.scalar_one_or_none()
+        if row is None:
+            return None
+        preference = CachedPreference.from_model(row)
+        self._set_local(preference, invalidations)
+        await self._set_shared([preference], versions)
+        return preference
+
+    async def get_many(self, db, user_ids) -> dict[str, CachedPreference]:
+        """Return preferences for many users, querying only the cache misses."""
+        found = {}
+        remaining = []
+        for user_id in user_ids:
+            preference = self._get_local(user_id)
+            if preference is not None:
+                found[user_id] = preference
+            else:
+                remaining.append(user_id)
+        self.hits += len(found)
+
+        invalidations = self._invalidations
+        shared, versions = await self._get_shared(remaining)
+        for preference in shared.values():
+            self._set_local(preference, invalidations)
+        found.update(shared)
+        self.redis_hits += len(shared)
+        remaining = [user_id for user_id in remaining if user_id not in shared]
+
+        if remaining:
+            self.misses += len(remaining)
+            result = await db.execute(
+                select(UserPreference).where(
+                    in_array(UserPreference.user_id, remaining)
+                )
+            )
+            loaded = [
+                CachedPreference.from_model(row) for row in result.scalars().all()
+            ]
+            for preference in loaded:
+                self._set_local(preference, invalidations)
+                found[preference.user_id] = preference
+            await self._set_shared(loaded, versions)
+        return found
+
+    async def invalidate(self, user_id: str):
+        await self.invalidate_many([user_id])
+
+    async def invalidate_many(self, user_ids: list[str]):
+        self._invalidations += 1
+        for user_id in user_ids:
+            self._local.pop(user_id, None)
+        if self._redis is None or not user_ids:
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.delete(*[self._key(user_id) for user_id in user_ids])
+                for user_id in user_ids:
+                    # Outlives any read that started before it
+                    pipe.incr(self._version_key(user_id))
+                    pipe.expire(self._version_key(user_id), self.redis_ttl)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Preferences cache unavailable: %s", e)
+
+    def clear(self):
+        self._local.clear()
+        self.hits = self.redis_hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._local),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
+
+
+preferences_cache = PreferencesCache(
+    max_size=settings.preferences_cache_size,
+    ttl=settings.preferences_cache_ttl,
+    redis_url=settings.preferences_cache_redis_url,
+    redis_ttl=settings.preferences_cache_redis_ttl,
+)
@@ -1,6 +1,8 @@
 from celery import Celery
+from celery.signals import setup_logging
 
 from app.config import settings
+from app.utils.logger import setup_logger
 
 celery_app = Celery(
     "property_alerts",
@@ -8,7 +10,45 @@ celery_app = Celery(
     backend=settings.celery_result_backend,
 )
 
-celery_app.conf.task_routes = {"app.tasks.*": {"queue": "alerts"}}
+
+def queue_name(channel: str, priority: str = "high") -> str:
+    """Return the queue of a channel's priority lane, e.g. "sms.low".
+
+    Every lane has its own queue so each can get its own worker pool.
+    """
+    return f"{channel}.{priority}"
+
+
+# The relay picks the queue for every outbox message; these routes only
+# apply to tasks sent directly
+celery_app.conf.task_routes = {
+    "app.tasks.send_email_task": {"queue": queue_name("email")},
+    "app.tasks.send_sms_task": {"queue": queue_name("sms")},
+    "app.tasks.*": {"queue": queue_name("email")},
+}
+# Messages carry only notification ids, packed with msgpack. JSON stays
+# accepted for messages queued before the serializer was switched.
+celery_app.conf.task_serializer = settings.task_serializer
+celery_app.conf.accept_content = ["msgpack", "json"]
+# Acknowledge messages once processed, and have the broker redeliver those
+# a worker took but never acknowledged. Rows whose message is lost anyway
+# are queued again by the scheduler when their lease expires.
+celery_app.conf.task_acks_late = True
+celery_app.conf.task_reject_on_worker_lost = True
+celery_app.conf.broker_transport_options = {
+    "visibility_timeout": settings.queue_lease_seconds
+}
+# Batch tasks can only fill a batch with messages the worker has prefetched
+celery_app.conf.worker_prefetch_multiplier = (
+    settings.worker_prefetch_multiplier or settings.batch_flush_every
+)
+
+
+@setup_logging.connect
+def configure_logging(**kwargs):  # pylint: disable=unused-argument
+    # Connecting this signal stops Celery from installing its own handlers
+    setup_logger()
+
 
 # Force task discovery
 import app.tasks.notification_tasks  # pylint: disable=unused-import
@@ -15,21 +15,111 @@ class Settings(BaseSettings):
     environment: str = "development"
     version: str = "1.0.0"
 
+    # Logging
+    log_level: str = "INFO"
+    log_levels: dict[str, str] = {}  # per-logger overrides, e.g. {"app.relay": "DEBUG"}
+    log_format: str = "json"  # 'json' or 'text'
+    # Per-logger-prefix limits for records below WARNING: keep this fraction...
+    log_sample_rates: dict[str, float] = {}
+    # ...and at most this many records per second
+    log_rate_limits: dict[str, float] = {"app.notifiers": 100, "app.tasks": 100}
+
     # Email
     smtp_host: str
     smtp_port: int
     smtp_user: str
     smtp_password: str
     sender_email: EmailStr
+    email_backend: str = "mock"  # 'mock' or 'smtp'
+    smtp_pool_size: int = 4  # persistent connections per worker process
+    smtp_use_tls: bool = False
+    smtp_start_tls: Optional[bool] = None  # None: use STARTTLS if offered
+    smtp_timeout: float = 30
 
     # SMS
     twilio_account_sid: Optional[str] = None
     twilio_auth_token: Optional[str] = None
     twilio_from_number: Optional[str] = None
+    twilio_base_url: str = "https://api.twilio.com"
+    sms_backend: str = "mock"  # 'mock' or 'twilio'
+    sms_rate_limit_per_second: float = 1.0  # provider messages-per-second cap
+    sms_rate_limit_redis_url: Optional[str] = None  # shares the cap across workers
+    sms_max_connections: int = 10  # keep-alive connections per worker process
+    sms_timeout: float = 10
 
     # Celery
     celery_broker_url: str
     celery_result_backend: Optional[str] = None
+    worker_metrics_port: int = 9100  # Prometheus exporter in the Celery worker
+    batch_flush_every: int = 100  # max notifications per worker batch
+    batch_flush_interval_ms: int = 100  # max wait before flushing a batch
+    # Messages reserved per worker process; defaults to batch_flush_every.
+    # Lower values trade batch size for latency on urgent lanes.
+    worker_prefetch_multiplier: Optional[int] = None
+    task_serializer: str = "msgpack"  # JSON messages are still accepted
+    task_max_ids: int = 100  # notification ids per task message
+    # Messages whose kwargs encode larger than this are compressed
+    broker_compression: Optional[str] = "zlib"  # None disables compression
+    broker_compression_threshold: int = 1024  # bytes
+
+    # Preferences cache
+    preferences_cache_size: int = 10_000  # in-process LRU entries
+    preferences_cache_ttl: float = 30  # seconds, bounds staleness across replicas
+    preferences_cache_redis_url: Optional[str] = None  # enables the shared tier
+    preferences_cache_redis_ttl: int = 300
+
+    # Preferences import/export
+    preferences_import_max_errors: int = 100  # invalid rows reported per import
+    preferences_import_chunk_size: int = 1_000  # rows checked as one column
+    preferences_export_chunk_size: int = 1_000  # rows fetched per cursor round trip
+
+    # Quiet hours and frequency caps
+    rules_redis_url: Optional[str] = None  # shares frequency windows across workers
+
+    # Digests: notifications for the same user and channel are sent as one
+    digest_max_items: int = 20  # notifications per digest; 1 disables digests
+    digest_window_seconds: float = 0  # also pull in those due this much later
+    digest_lookback_seconds: float = 86400  # and those scheduled this much earlier
+
+    # Message templates
+    template_cache_size: int = 1_000  # compiled template versions per process
+
+    # Retries: exponential backoff with full jitter, then the dead letter queue
+    email_max_attempts: int = 5
+    email_retry_base_delay: float = 30  # seconds, doubled every attempt
+    email_retry_max_delay: float = 3600
+    sms_max_attempts: int = 5
+    sms_retry_base_delay: float = 30
+    sms_retry_max_delay: float = 3600
+    redrive_spread_seconds: float = 300  # re-driven retries are spread over this
+
+    # Circuit breaker and adaptive concurrency, per channel
+    circuit_breaker_redis_url: Optional[str] = None  # shares state across workers
+    circuit_failure_threshold: float = 0.5  # failure ratio that opens the circuit...
+    circuit_min_calls: int = 20  # ...once a window has this many sends
+    circuit_window_seconds: int = 30
+    circuit_open_seconds: float = 30  # before a trial batch is let through
+    send_concurrency_min: int = 1
+    send_concurrency_max: int = 50  # in-flight sends per channel and process
+    send_latency_target: float = 1.0  # seconds; slower sends shrink the limit
+
+    # Outbox relay
+    relay_batch_size: int = 1000  # max outbox messages published per round
+    relay_poll_interval: float = 0.1  # seconds between polls when idle
+    relay_metrics_port: int = 9101
+
+    # Scheduler
+    scheduler_batch_size: int = 500  # max notifications claimed per poll
+    scheduler_poll_interval: float = 1.0  # seconds between polls when idle
+    # Leases: the scheduler queues a row again when its holder takes longer
+    queue_lease_seconds: float = 3600  # queued, e.g. its task message was lost
+    send_lease_seconds: float = 600  # claimed by a worker, e.g. it crashed
+
+    # Notification partitions
+    partition_months_ahead: int = 3  # monthly partitions created in advance
+    notifications_retention_months: int = 12  # older partitions are dropped
+    notifications_archive_dir: Optional[str] = None  # export before dropping
+    partition_maintenance_interval: float = 3600  # seconds between runs
 
     # Database
     db_host: str
@@ -37,9 +127,13 @@ class Settings(BaseSettings):
     db_user: str
     db_password: str
     db_name: str
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    sql_echo: bool = False  # log every SQL statement
 
     # Security
     api_key: str
+    idempotency_key_ttl: int = 86_400  # seconds a stored response is replayed
 
     class Config:
         env_file_encoding = "utf-8"
@@ -1,3 +1,5 @@
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 
@@ -8,7 +10,7 @@ DATABASE_URL = (
     f"@{settings.db_host}:{settings.db_port}/{settings.db_name}"
 )
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, echo=settings.sql_echo)
 AsyncSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 
 Base = declarative_base()
@@ -17,3 +19,22 @@ Base = declarative_base()
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+
+def in_array(column, values):
+    """Build `column = ANY(:values)` with the values bound as a single array.
+
+    Unlike an expanded IN list this stays one bind parameter, so it works for
+    batches larger than the driver's parameter limit.
+    """
+    return column == any_(bindparam(None, list(values), type_=ARRAY(column.type)))
+
+
+def in_range(column, values):
+    """Build `column BETWEEN min AND max` of the values.
+
+    Next to an id filter on the notifications table it bounds the partition
+    key, so Postgres only scans the partitions in the range.
+    """
+    values = list(values)
+    return column.between(min(values), max(values))
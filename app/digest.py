@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+from typing import Union
+
+from sqlalchemy import tuple_, update
+
+from app.config import settings
+from app.models import Notification, NotificationStatus
+
+DIGEST_SEPARATOR = "\n\n---\n\n"
+
+
+def claim_companions(
+    notifications, now: datetime, window_seconds: float, lookback_seconds: float
+):
+    """Build the UPDATE that claims notifications to send along with a batch.
+
+    These are the rows of the batch's users and channels that are not queued
+    in it: pending or queued ones due within `window_seconds`, and every one
+    held for a digest. Only rows scheduled in the last `lookback_seconds`
+    are looked at, so just the recent partitions are scanned; older ones are
+    left to the scheduler. Rows already claimed elsewhere are not `pending`,
+    `queued` or `held` any more, so each is sent once. Like the batch, they
+    are leased for SEND_LEASE_SECONDS.
+    """
+    pairs = {
+        (notification.user_id, notification.channel) for notification in notifications
+    }
+    return (
+        update(Notification)
+        .where(
+            tuple_(Notification.user_id, Notification.channel).in_(list(pairs)),
+            Notification.status.in_(
+                [
+                    NotificationStatus.pending,
+                    NotificationStatus.queued,
+                    NotificationStatus.held,
+                ]
+            ),
+            Notification.send_at.between(
+                now - timedelta(seconds=lookback_seconds),
+                now + timedelta(seconds=window_seconds),
+            ),
+        )
+        .values(
+            status=NotificationStatus.sending,
+            next_attempt_at=now + timedelta(seconds=settings.send_lease_seconds),
+        )
+        .returning(Notification)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def digest_content(channel: str, contents: list[tuple[str, str]]) -> tuple[str, str]:
+    """Combine rendered (subject, message) pairs into one message."""
+    subject = f"{contents[0][0]} (+{len(contents) - 1} more)"
+    if channel == "sms":
+        return subject, DIGEST_SEPARATOR.join(message for _, message in contents)
+    return subject, DIGEST_SEPARATOR.join(
+        f"{item_subject}\n\n{message}" for item_subject, message in contents
+    )
+
+
+def coalesce(
+    notifications: list[Notification],
+    contents: dict[int, Union[tuple[str, str], Exception]],
+    max_items: int,
+) -> tuple[list[Notification], dict[int, list[Notification]]]:
+    """Group notifications into the sends that deliver them.
+
+    Rendered notifications for the same user, channel and recipient are
+    merged, `max_items` at a time, into one send led by the earliest of
+    them; the lead's entry in `contents` becomes the combined message.
+    Returns the leads and, for each lead id, the notifications it delivers.
+    Notifications that failed to render are leads of their own.
+    """
+    leads = []
+    members = {}
+    groups = {}
+    for notification in sorted(notifications, key=lambda n: n.id):
+        if isinstance(contents[notification.id], Exception):
+            leads.append(notification)
+            members[notification.id] = [notification]
+            continue
+        key = (notification.user_id, notification.channel, notification.recipient)
+        groups.setdefault(key, []).append(notification)
+
+    for group in groups.values():
+        for start in range(0, len(group), max_items):
+            chunk = group[start : start + max_items]
+            lead = chunk[0]
+            leads.append(lead)
+            members[lead.id] = chunk
+            if len(chunk) > 1:
+                contents[lead.id] = digest_content(
+                    lead.channel, [contents[member.id] for member in chunk]
+                )
+    return leads, members
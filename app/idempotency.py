@@ -0,0 +1,65 @@
+import hashlib
+from datetime import timedelta
+from typing import Optional
+
+from pydantic import BaseModel
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.models import IdempotencyKey
+
+
+def request_hash(payload: BaseModel) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+
+def expiry_cutoff():
+    return func.now() - timedelta(seconds=settings.idempotency_key_ttl)
+
+
+async def claim_key(db, key: str, payload_hash: str) -> bool:
+    """Record `key` in the current transaction, taking over an expired entry.
+
+    Returns False when a live entry exists. A concurrent request with the same
+    key blocks on the row until the first one commits or rolls back, so only
+    one of them ever does the work.
+    """
+    statement = insert(IdempotencyKey).values(key=key, request_hash=payload_hash)
+    statement = statement.on_conflict_do_update(
+        index_elements=[IdempotencyKey.key],
+        set_={
+            "request_hash": statement.excluded.request_hash,
+            "response": None,
+            "created_at": func.now(),
+        },
+        where=IdempotencyKey.created_at < expiry_cutoff(),
+    ).returning(IdempotencyKey.key)
+    result = await db.execute(statement)
+    return result.scalar_one_or_none() is not None
+
+
+async def get_key(db, key: str) -> Optional[IdempotencyKey]:
+    result = await db.execute(select(IdempotencyKey).where(IdempotencyKey.key == key))
+    return result.scalar_one_or_none()
+
+
+async def save_response(db, key: str, response: dict):
+    """Store the response to replay; commits with the request's own writes."""
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key)
+        .values(response=response)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def purge_expired_keys(db) -> int:
+    result = await db.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.created_at < expiry_cutoff())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
@@ -1,13 +1,21 @@
 import logging
 from contextlib import asynccontextmanager
 
-from fastapi import Depends, FastAPI, HTTPException, Security
+from fastapi import Depends, FastAPI, HTTPException, Response, Security
 from fastapi.security.api_key import APIKeyHeader
+from prometheus_client import REGISTRY
 
+from app.cache import preferences_cache
 from app.config import settings
 from app.db import engine
-from app.models import Base
-from app.routes import notifications, preferences
+from app.metrics import (
+    MetricsMiddleware,
+    PreferencesCacheCollector,
+    instrument_engine,
+    render_metrics,
+)
+from app.routes import notifications, preferences, templates
+from app.schema import check_schema_version
 from app.utils.logger import setup_logger
 
 setup_logger()
@@ -25,17 +33,20 @@ def validate_api_key(api_key: str = Security(api_key_header)):
 async def lifespan(
     app: FastAPI,
 ):  # pylint: disable=redefined-outer-name,unused-argument
-    # Startup: create tables
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    logger.info("Tables created")
+    # Startup: migrations run as a separate step (`python -m app.schema`), so
+    # replicas only check that the database is at the expected revision
+    async with engine.connect() as conn:
+        await check_schema_version(conn)
+    logger.info("Database schema is up to date")
 
     yield  # allows the app to start serving
 
 
 app = FastAPI(title=settings.app_name, version="1.0.0", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+REGISTRY.register(PreferencesCacheCollector(preferences_cache))
 
-setup_logger()
 app.include_router(
     preferences.router,
     prefix="/preferences",
@@ -48,6 +59,12 @@ app.include_router(
     tags=["Notifications"],
     dependencies=[Depends(validate_api_key)],
 )
+app.include_router(
+    templates.router,
+    prefix="/templates",
+    tags=["Templates"],
+    dependencies=[Depends(validate_api_key)],
+)
 
 
 @app.get("/health", tags=["Health"])
@@ -60,6 +77,17 @@ def health_check():
     }
 
 
+@app.get("/health/cache", tags=["Health"])
+def cache_stats():
+    return {"preferences": preferences_cache.stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/")
 async def root():
     return {
@@ -0,0 +1,185 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+from sqlalchemy import event
+
+from app.models import NotificationStatus
+
+CHANNELS = ("email", "sms")
+
+# Sub-millisecond resolution for the API and database, seconds to hours for
+# queue lag so scheduled and delayed sends both land in a useful bucket
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by route.",
+    ["method", "route", "status"],
+    buckets=FAST_BUCKETS,
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing SQL statements.",
+    buckets=FAST_BUCKETS,
+)
+BROKER_PUBLISH_LATENCY = Histogram(
+    "broker_publish_duration_seconds",
+    "Time spent publishing notification tasks to the broker.",
+    buckets=FAST_BUCKETS,
+)
+QUEUE_LAG = Histogram(
+    "notification_queue_lag_seconds",
+    "Delay between a notification's send_at and its sent_at.",
+    ["channel"],
+    buckets=LAG_BUCKETS,
+)
+SEND_LATENCY = Histogram(
+    "notification_send_duration_seconds",
+    "Provider send latency by channel.",
+    ["channel"],
+    buckets=FAST_BUCKETS,
+)
+NOTIFICATIONS_PROCESSED = Counter(
+    "notifications_processed_total",
+    "Notifications processed by channel and resulting status.",
+    ["channel", "status"],
+)
+CIRCUIT_OPENED = Counter(
+    "circuit_breaker_opened_total",
+    "Times a channel's circuit breaker opened.",
+    ["channel"],
+)
+SEND_CONCURRENCY = Gauge(
+    "notification_send_concurrency_limit",
+    "Adaptive limit on in-flight sends per channel and worker process.",
+    ["channel"],
+    multiprocess_mode="liveall",
+)
+
+# Pre-bound label children, so hot paths do a dict lookup instead of
+# building a label set on every call
+QUEUE_LAG_BY_CHANNEL = {channel: QUEUE_LAG.labels(channel) for channel in CHANNELS}
+SEND_LATENCY_BY_CHANNEL = {
+    channel: SEND_LATENCY.labels(channel) for channel in CHANNELS
+}
+NOTIFICATIONS_BY_OUTCOME = {
+    (channel, status): NOTIFICATIONS_PROCESSED.labels(channel, status.name)
+    for channel in CHANNELS
+    for status in NotificationStatus
+}
+CIRCUIT_OPENED_BY_CHANNEL = {
+    channel: CIRCUIT_OPENED.labels(channel) for channel in CHANNELS
+}
+SEND_CONCURRENCY_BY_CHANNEL = {
+    channel: SEND_CONCURRENCY.labels(channel) for channel in CHANNELS
+}
+_REQUEST_LATENCY_CHILDREN = {}
+
+
+def record_notification(channel, status, send_at=None, sent_at=None):
+    """Count a processed notification and, once sent, observe its queue lag."""
+    NOTIFICATIONS_BY_OUTCOME[(channel, status)].inc()
+    if send_at is not None and sent_at is not None:
+        QUEUE_LAG_BY_CHANNEL[channel].observe((sent_at - send_at).total_seconds())
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing request latency per matched route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            key = (scope["method"], route.path if route else "<unmatched>", status)
+            child = _REQUEST_LATENCY_CHILDREN.get(key)
+            if child is None:
+                child = _REQUEST_LATENCY_CHILDREN[key] = REQUEST_LATENCY.labels(*key)
+            child.observe(time.perf_counter() - start)
+
+
+def instrument_engine(engine):
+    """Observe the execution time of every statement run through `engine`."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):  # pylint: disable=unused-argument,too-many-arguments
+        context.query_started_at = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):  # pylint: disable=unused-argument,too-many-arguments
+        DB_QUERY_LATENCY.observe(time.perf_counter() - context.query_started_at)
+
+
+class PreferencesCacheCollector:
+    """Exposes the preferences cache counters at scrape time."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.stats()
+        requests = CounterMetricFamily(
+            "preferences_cache_requests",
+            "Preference lookups by the tier that served them.",
+            labels=["result"],
+        )
+        requests.add_metric(["hit"], stats["hits"])
+        requests.add_metric(["redis_hit"], stats["redis_hits"])
+        requests.add_metric(["miss"], stats["misses"])
+        yield requests
+        yield GaugeMetricFamily(
+            "preferences_cache_size",
+            "Entries in the in-process preferences cache.",
+            value=stats["size"],
+        )
+
+
+def metrics_registry():
+    """Return the registry to expose, aggregating worker processes if needed."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics():
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int):
+    start_http_server(port, registry=metrics_registry())
@@ -1,15 +1,24 @@
 from enum import Enum as PyEnum
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
+    CheckConstraint,
     Column,
     DateTime,
     Enum,
     ForeignKey,
+    ForeignKeyConstraint,
+    Index,
     Integer,
     String,
     Text,
+    Time,
+    false,
+    func,
+    true,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
 from app.db import Base
@@ -17,8 +26,14 @@ from app.db import Base
 
 class NotificationStatus(PyEnum):
     pending = "pending"
+    queued = "queued"
+    sending = "sending"  # claimed by a worker
+    retrying = "retrying"  # waiting for next_attempt_at
+    held = "held"  # over the user's frequency cap, kept for their digest
     sent = "sent"
-    failed = "failed"
+    failed = "failed"  # permanent error
+    dead = "dead"  # retries exhausted, see POST /notifications/dead-letter/redrive
+    suppressed = "suppressed"  # over the user's frequency cap, not sent
 
 
 class UserPreference(Base):
@@ -30,6 +45,13 @@ class UserPreference(Base):
     sms_enabled = Column(Boolean, default=True)
     email = Column(String, nullable=True)
     phone_number = Column(String, nullable=True)
+    # Delivery rules, checked by the workers before every send
+    timezone = Column(String, nullable=True)  # IANA name, UTC when unset
+    quiet_hours_start = Column(Time, nullable=True)  # local time
+    quiet_hours_end = Column(Time, nullable=True)
+    max_per_window = Column(Integer, nullable=True)  # sends per channel...
+    frequency_window_seconds = Column(Integer, nullable=True)  # ...in this window
+    digest_on_overflow = Column(Boolean, nullable=False, server_default=false())
 
     notifications = relationship("Notification", back_populates="user")
 
@@ -37,14 +59,113 @@ class UserPreference(Base):
 class Notification(Base):
     __tablename__ = "notifications"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Partitioned by send_at, so the partition key is part of the primary key
+    id = Column(BigInteger, primary_key=True, autoincrement=True, index=True)
     user_id = Column(String, ForeignKey("user_preferences.user_id"))
-    subject = Column(String, nullable=False)
-    message = Column(Text, nullable=False)
-    send_at = Column(DateTime(timezone=True), nullable=True)
+    # Either the text itself or a template rendered by the worker
+    subject = Column(String, nullable=True)
+    message = Column(Text, nullable=True)
+    template_id = Column(String, nullable=True)
+    template_version = Column(Integer, nullable=True)
+    variables = Column(JSONB, nullable=True)
+    send_at = Column(DateTime(timezone=True), primary_key=True)
     sent_at = Column(DateTime(timezone=True), nullable=True)
     status = Column(Enum(NotificationStatus), default=NotificationStatus.pending)
     channel = Column(String)  # 'email' or 'sms'
+    priority = Column(String, nullable=False, server_default="high")  # or 'low'
     recipient = Column(String, nullable=True)  # email or phone number
+    # False when the recipient failed validation at ingest; such rows are
+    # stored as failed and never queued
+    recipient_valid = Column(Boolean, nullable=False, server_default=true())
+    attempts = Column(Integer, nullable=False, server_default="0")
+    # When to retry, release a held row, or, while queued or sending, when the
+    # lease expires and the scheduler queues it again
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String, nullable=True)
 
     user = relationship("UserPreference", back_populates="notifications")
+
+    __table_args__ = (
+        # Keeps the scheduler's due-notification scan proportional to the
+        # number of pending rows rather than the size of the table
+        Index(
+            "ix_notifications_pending_send_at",
+            "send_at",
+            postgresql_where=(status == NotificationStatus.pending.name),
+        ),
+        # Same for the retries the scheduler re-enqueues
+        Index(
+            "ix_notifications_retrying_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=(status == NotificationStatus.retrying.name),
+        ),
+        # And the held notifications it releases once the cap has room
+        Index(
+            "ix_notifications_held_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=(status == NotificationStatus.held.name),
+        ),
+        # And the queued or claimed ones whose lease has expired
+        Index(
+            "ix_notifications_leased_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=status.in_(
+                [NotificationStatus.queued.name, NotificationStatus.sending.name]
+            ),
+        ),
+        # Back the history API's filters and its (send_at, id) keyset order
+        Index("ix_notifications_user_id_send_at_id", "user_id", "send_at", "id"),
+        Index("ix_notifications_status_send_at_id", "status", "send_at", "id"),
+        ForeignKeyConstraint(
+            ["template_id", "template_version"],
+            ["message_templates.id", "message_templates.version"],
+        ),
+        CheckConstraint(
+            "message IS NOT NULL OR template_id IS NOT NULL",
+            name="ck_notifications_content",
+        ),
+        # Monthly partitions are managed by app.partitions
+        {"postgresql_partition_by": "RANGE (send_at)"},
+    )
+
+
+class MessageTemplate(Base):
+    """One version of a message template. Versions are never changed.
+
+    `subject` and `body` use `$name` placeholders, filled in from each
+    notification's `variables` when it is sent.
+    """
+
+    __tablename__ = "message_templates"
+
+    id = Column(String, primary_key=True)
+    version = Column(Integer, primary_key=True)
+    subject = Column(Text, nullable=False)
+    body = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class OutboxMessage(Base):
+    """A task message written in the same transaction as the rows it refers to.
+
+    The relay process publishes these to the broker and deletes them.
+    """
+
+    __tablename__ = "outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    task_name = Column(String, nullable=False)
+    queue = Column(String, nullable=True)  # None uses the task's default route
+    kwargs = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class IdempotencyKey(Base):
+    """The stored response of a request made with an `Idempotency-Key` header."""
+
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    response = Column(JSONB, nullable=True)  # set in the request's transaction
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
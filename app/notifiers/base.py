@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 
@@ -15,3 +16,7 @@ class Notifier(ABC):
     @abstractmethod
     def send(self) -> bool:
         """Send the notification."""
+
+    async def asend(self) -> bool:
+        """Send the notification without blocking the event loop."""
+        return await asyncio.to_thread(self.send)
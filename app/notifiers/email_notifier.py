@@ -1,26 +1,73 @@
 import logging
-import re
+from email.message import EmailMessage
 
+from app.config import settings
 from app.notifiers.base import Notifier
+from app.notifiers.smtp_pool import SMTPConnectionPool
+from app.recipients import is_valid_email
 
 logger = logging.getLogger(__name__)
 
+_smtp_pool = None
+
+
+def get_smtp_pool() -> SMTPConnectionPool:
+    """Return the SMTP pool for this worker process, creating it on first use."""
+    global _smtp_pool  # pylint: disable=global-statement
+    if _smtp_pool is None:
+        _smtp_pool = SMTPConnectionPool(
+            hostname=settings.smtp_host,
+            port=settings.smtp_port,
+            username=settings.smtp_user,
+            password=settings.smtp_password,
+            size=settings.smtp_pool_size,
+            use_tls=settings.smtp_use_tls,
+            start_tls=settings.smtp_start_tls,
+            timeout=settings.smtp_timeout,
+        )
+    return _smtp_pool
+
+
+async def close_smtp_pool():
+    global _smtp_pool  # pylint: disable=global-statement
+    if _smtp_pool is not None:
+        await _smtp_pool.close()
+        _smtp_pool = None
+
 
 class EmailNotifier(Notifier):
     def validate_recipient(self) -> bool:
         """Validate the email address."""
-        email_regex = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-        return re.match(email_regex, self.recipient) is not None
+        return is_valid_email(self.recipient)
+
+    def build_message(self) -> EmailMessage:
+        """Build the MIME message for this notification."""
+        message = EmailMessage()
+        message["From"] = settings.sender_email
+        message["To"] = self.recipient
+        message["Subject"] = self.subject
+        message.set_content(self.body)
+        return message
 
     def send(self) -> bool:
         """Mock sending an email."""
         if not self.validate_recipient():
             raise ValueError(f"Invalid email address: {self.recipient}")
         logger.info(
-            "[MOCK EMAIL] To: %s (ID: %s) | Subject: %s | Body: %s",
+            "[MOCK EMAIL] To: %s (ID: %s) | Subject: %s | Body: %s chars",
             self.recipient,
             self.user_id,
             self.subject,
-            self.body,
+            len(self.body),
         )
         return True
+
+    async def asend(self) -> bool:
+        """Send the email through the pooled SMTP backend when enabled."""
+        if settings.email_backend != "smtp":
+            return await super().asend()
+        if not self.validate_recipient():
+            raise ValueError(f"Invalid email address: {self.recipient}")
+        await get_smtp_pool().send_message(self.build_message())
+        logger.info("Email sent to %s (ID: %s)", self.recipient, self.user_id)
+        return True
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Refills the bucket for the time since the last call (ARGV[1], in ms) and
+# takes a token. Returns 0 when one was taken, otherwise the milliseconds to
+# wait for one, or for a pause (KEYS[2]) to end.
+TAKE_SCRIPT = """
+local paused = redis.call('PTTL', KEYS[2])
+if paused > 0 then
+    return paused
+end
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) / 1000 * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return wait
+"""
+
+
+class SMSProviderError(Exception):
+    """Raised when the SMS provider rejects or keeps throttling a message."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        """Throttling and server errors may succeed later, rejections won't."""
+        return self.status_code == 429 or (self.status_code or 0) >= 500
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second.
+
+    `pause` blocks every caller until a deadline, so one throttled response
+    slows down every sender instead of each retrying on its own.
+
+    With `redis_url` the bucket is shared by every worker process, so the
+    provider sees `rate` in total; without it each process has its own.
+    If Redis is unavailable, each process falls back to its own bucket.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        name: str = "sms",
+        redis_url: Optional[str] = None,
+    ):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.name = name
+        self._redis = redis.from_url(redis_url) if redis_url else None
+        self._script = self._redis.register_script(TAKE_SCRIPT) if self._redis else None
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _key(self, suffix: str) -> str:
+        return f"ratelimit:{self.name}:{suffix}"
+
+    async def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(
+                self._key("paused"), 1, px=max(int(seconds * 1000), 1)
+            )
+        except RedisError as e:
+            logger.warning("Shared SMS rate limit unavailable: %s", e)
+
+    async def acquire(self):
+        if self._redis is not None:
+            try:
+                await self._acquire_shared()
+                return
+            except RedisError as e:
+                logger.warning("Shared SMS rate limit unavailable: %s", e)
+        await self._acquire_local()
+
+    async def _acquire_shared(self):
+        while True:
+            wait = await self._script(
+                keys=[self._key("bucket"), self._key("paused")],
+                args=[int(time.time() * 1000), self.rate, self.capacity],
+            )
+            if not wait:
+                return
+            await asyncio.sleep(int(wait) / 1000)
+
+    async def _acquire_local(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TwilioClient:
+    """Twilio Messages API client on a shared keep-alive connection pool.
+
+    Each call makes one request. Throttled and failed ones raise
+    SMSProviderError and are retried by the notification's retry policy.
+    """
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        from_number: str,
+        base_url: str = "https://api.twilio.com",
+        rate_limit: float = 1.0,
+        rate_limit_redis_url: Optional[str] = None,
+        max_connections: int = 10,
+        default_retry_after: float = 1.0,
+        timeout: float = 10,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.account_sid = account_sid
+        self.from_number = from_number
+        self.default_retry_after = default_retry_after  # for a 429 without one
+        self.bucket = TokenBucket(rate_limit, redis_url=rate_limit_redis_url)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            auth=(account_sid, auth_token),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+            transport=transport,
+        )
+
+    async def send_sms(self, to: str, body: str) -> str:
+        """Send one message and return the provider's message sid."""
+        path = f"/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+        data = {"To": to, "From": self.from_number, "Body": body}
+        await self.bucket.acquire()
+        response = await self._client.post(path, data=data)
+        if response.status_code == 429:
+            # Slow every sender down, not just the notification that was hit
+            delay = retry_after_seconds(response)
+            await self.bucket.pause(
+                self.default_retry_after if delay is None else delay
+            )
+        if response.is_error:
+            raise SMSProviderError(
+                f"SMS provider returned {response.status_code}: {response.text}",
+                status_code=response.status_code,
+            )
+        return response.json().get("sid")
+
+    async def aclose(self):
+        await self._client.aclose()
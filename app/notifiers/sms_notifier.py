@@ -1,26 +1,66 @@
 import logging
-import re
 
+from app.config import settings
 from app.notifiers.base import Notifier
+from app.notifiers.sms_client import TwilioClient
+from app.recipients import is_valid_phone
 
 logger = logging.getLogger(__name__)
 
+_sms_client = None
+
+
+def get_sms_client() -> TwilioClient:
+    """Return the SMS client for this worker process, creating it on first use."""
+    global _sms_client  # pylint: disable=global-statement
+    if _sms_client is None:
+        _sms_client = TwilioClient(
+            account_sid=settings.twilio_account_sid,
+            auth_token=settings.twilio_auth_token,
+            from_number=settings.twilio_from_number,
+            base_url=settings.twilio_base_url,
+            rate_limit=settings.sms_rate_limit_per_second,
+            rate_limit_redis_url=settings.sms_rate_limit_redis_url,
+            max_connections=settings.sms_max_connections,
+            timeout=settings.sms_timeout,
+        )
+    return _sms_client
+
+
+async def close_sms_client():
+    global _sms_client  # pylint: disable=global-statement
+    if _sms_client is not None:
+        await _sms_client.aclose()
+        _sms_client = None
+
 
 class SMSNotifier(Notifier):
     def validate_recipient(self) -> bool:
         """Validate the phone number."""
-        phone_regex = r"^\+\d{10,15}$"  # Example: +1234567890
-        return re.match(phone_regex, self.recipient) is not None
+        return is_valid_phone(self.recipient)
 
     def send(self) -> bool:
         """Mock sending an SMS."""
         if not self.validate_recipient():
             raise ValueError(f"Invalid phone number: {self.recipient}")
         logger.info(
-            "[MOCK SMS] To: %s (ID: %s) | Message: %s - %s",
+            "[MOCK SMS] To: %s (ID: %s) | Message: %s chars",
             self.recipient,
             self.user_id,
-            self.subject,
-            self.body,
+            len(self.subject) + len(self.body) + 3,
+        )
+        return True
+
+    async def asend(self) -> bool:
+        """Send the SMS through the provider client when enabled."""
+        if settings.sms_backend != "twilio":
+            return await super().asend()
+        if not self.validate_recipient():
+            raise ValueError(f"Invalid phone number: {self.recipient}")
+        sid = await get_sms_client().send_sms(
+            self.recipient, f"{self.subject} - {self.body}"
+        )
+        logger.info(
+            "SMS sent to %s (ID: %s, sid: %s)", self.recipient, self.user_id, sid
         )
         return True
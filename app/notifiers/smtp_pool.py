@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from email.message import EmailMessage
+from typing import Optional
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a connection can no longer be trusted
+CONNECTION_ERRORS = (
+    aiosmtplib.SMTPServerDisconnected,
+    aiosmtplib.SMTPConnectError,
+    aiosmtplib.SMTPTimeoutError,
+    ConnectionError,
+)
+
+
+class SMTPConnectionPool:
+    """Bounded pool of authenticated, persistent SMTP connections.
+
+    Connections are opened lazily, reused for many messages and replaced when
+    they drop. At most `size` messages are in flight at any time.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        size: int = 4,
+        use_tls: bool = False,
+        start_tls: Optional[bool] = None,
+        timeout: float = 30,
+        max_messages_per_connection: int = 1000,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.timeout = timeout
+        self.max_messages_per_connection = max_messages_per_connection
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle = []  # (client, messages sent) pairs, most recent last
+        self.connections_opened = 0
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+            timeout=self.timeout,
+        )
+        await client.connect()  # also authenticates when credentials are set
+        self.connections_opened += 1
+        return client
+
+    async def _acquire(self):
+        while self._idle:
+            client, sent = self._idle.pop()
+            if client.is_connected:
+                return client, sent
+        return await self._connect(), 0
+
+    async def _release(self, client: aiosmtplib.SMTP, sent: int):
+        if client.is_connected and sent < self.max_messages_per_connection:
+            self._idle.append((client, sent))
+        else:
+            await self._quit(client)
+
+    @staticmethod
+    async def _quit(client: aiosmtplib.SMTP):
+        try:
+            if client.is_connected:
+                await client.quit()
+        except aiosmtplib.SMTPException:
+            client.close()
+
+    async def send_message(self, message: EmailMessage):
+        """Send a message, reconnecting once if the connection has dropped."""
+        async with self._semaphore:
+            client, sent = await self._acquire()
+            try:
+                try:
+                    await client.send_message(message)
+                except CONNECTION_ERRORS as e:
+                    logger.warning("SMTP connection lost, reconnecting: %s", e)
+                    client.close()
+                    client, sent = await self._connect(), 0
+                    await client.send_message(message)
+                sent += 1
+            finally:
+                await self._release(client, sent)
+
+    async def close(self):
+        while self._idle:
+            client, _ = self._idle.pop()
+            await self._quit(client)
@@ -0,0 +1,72 @@
+from datetime import datetime
+from itertools import groupby
+from typing import Iterable, Optional
+
+
+def id_ranges(ids: Iterable[int]) -> list[list[int]]:
+    """Collapse ids into sorted, inclusive [first, last] runs."""
+    ranges = []
+    for notification_id in sorted(set(ids)):
+        if ranges and ranges[-1][1] == notification_id - 1:
+            ranges[-1][1] = notification_id
+        else:
+            ranges.append([notification_id, notification_id])
+    return ranges
+
+
+def expand_id_ranges(ranges: Iterable[list[int]]) -> list[int]:
+    return [
+        notification_id
+        for first, last in ranges
+        for notification_id in range(first, last + 1)
+    ]
+
+
+def batch_messages(
+    task_name: str, queued: Iterable[tuple[int, str, datetime]], max_ids: int
+) -> list[dict]:
+    """Return outbox rows for (notification_id, queue, send_at) triples.
+
+    Ids bound for the same queue share a message, up to `max_ids` per
+    message, and travel as ranges: rows inserted together usually have
+    consecutive ids, so a message stays a few bytes however many it covers.
+    Each message also carries the earliest and latest send_at of its rows,
+    so the worker's statements only scan the partitions holding them.
+    """
+    messages = []
+    by_queue = sorted(queued, key=lambda row: (row[1], row[0]))
+    for queue, rows in groupby(by_queue, key=lambda row: row[1]):
+        rows = list(rows)
+        for start in range(0, len(rows), max_ids):
+            chunk = rows[start : start + max_ids]
+            send_ats = [send_at for _, _, send_at in chunk]
+            messages.append(
+                {
+                    "task_name": task_name,
+                    "queue": queue,
+                    "kwargs": {
+                        "ids": id_ranges(
+                            notification_id for notification_id, _, _ in chunk
+                        ),
+                        "send_at": [
+                            min(send_ats).isoformat(),
+                            max(send_ats).isoformat(),
+                        ],
+                    },
+                }
+            )
+    return messages
+
+
+def send_at_range(kwargs: Iterable[dict]) -> Optional[tuple[datetime, datetime]]:
+    """Return the send_at range covering every message, None if one has none.
+
+    Messages queued by earlier releases carry only ids.
+    """
+    bounds = [message.get("send_at") for message in kwargs]
+    if not bounds or not all(bounds):
+        return None
+    return (
+        min(datetime.fromisoformat(first) for first, _ in bounds),
+        max(datetime.fromisoformat(last) for _, last in bounds),
+    )
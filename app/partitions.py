@@ -0,0 +1,249 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.db import AsyncSessionLocal, engine
+from app.idempotency import purge_expired_keys
+from app.utils.logger import setup_logger
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "notifications"
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{PARENT_TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[datetime]:
+    """Return the month a partition covers, or None for other tables."""
+    match = PARTITION_NAME.match(name)
+    if not match:
+        return None
+    return datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)
+
+
+async def attached_partitions(conn) -> list[str]:
+    result = await conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits"
+            " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+            " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+            " WHERE parent.relname = :parent"
+        ),
+        {"parent": PARENT_TABLE},
+    )
+    return list(result.scalars())
+
+
+async def detached_partitions(conn) -> list[str]:
+    """Monthly tables detached by an earlier run that were never dropped."""
+    result = await conn.execute(
+        text(
+            "SELECT relname FROM pg_class"
+            " WHERE relkind = 'r' AND NOT relispartition AND relname LIKE :pattern"
+        ),
+        {"pattern": f"{PARENT_TABLE}\\_y%m%"},
+    )
+    return [name for name in result.scalars() if partition_month(name)]
+
+
+async def create_partition(conn, month: datetime):
+    """Create the partition for `month`, moving any rows the default holds.
+
+    Postgres refuses to attach a range that rows in the default partition
+    already fall into, so those rows are moved in the same transaction.
+    """
+    name = partition_name(month)
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    bounds = {"lower": month, "upper": add_months(month, 1)}
+
+    overflow = await conn.execute(
+        text(
+            f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION}"
+            " WHERE send_at >= :lower AND send_at < :upper)"
+        ),
+        bounds,
+    )
+    if not overflow.scalar():
+        await conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE}"
+                f" FOR VALUES FROM ('{lower}') TO ('{upper}')"
+            )
+        )
+        return
+
+    await conn.execute(
+        text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}")
+    )
+    await conn.execute(
+        text(
+            f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE}"
+            f" FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        )
+    )
+    await conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION}"
+            " WHERE send_at >= :lower AND send_at < :upper RETURNING *)"
+            f" INSERT INTO {name} SELECT * FROM moved"
+        ),
+        bounds,
+    )
+    await conn.execute(
+        text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+    )
+    logger.warning("Moved rows from %s into new partition %s", DEFAULT_PARTITION, name)
+
+
+async def ensure_partitions(
+    conn, months_ahead: Optional[int] = None, now: Optional[datetime] = None
+) -> list[str]:
+    """Create the default partition and monthly partitions up to `months_ahead`.
+
+    The default partition only catches rows scheduled beyond the horizon.
+    Returns the names of the partitions created.
+    """
+    if months_ahead is None:
+        months_ahead = settings.partition_months_ahead
+    current = month_start(now or datetime.now(timezone.utc))
+
+    await conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION}"
+            f" PARTITION OF {PARENT_TABLE} DEFAULT"
+        )
+    )
+    existing = set(await attached_partitions(conn))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if partition_name(month) not in existing:
+            await create_partition(conn, month)
+            created.append(partition_name(month))
+    return created
+
+
+async def export_partition(conn, name: str, archive_dir: str) -> str:
+    """Copy a detached partition to `<archive_dir>/<name>.csv.gz`."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    partial = f"{path}.part"
+
+    raw = await conn.get_raw_connection()
+    with gzip.open(partial, "wb") as archive:
+
+        async def write(chunk):
+            archive.write(chunk)
+
+        await raw.driver_connection.copy_from_table(
+            name, output=write, format="csv", header=True
+        )
+    # Only a complete export gets the final name
+    os.replace(partial, path)
+    return path
+
+
+async def apply_retention(
+    retention_months: Optional[int] = None,
+    archive_dir: Optional[str] = None,
+    now: Optional[datetime] = None,
+) -> list[str]:
+    """Detach, optionally archive, and drop partitions past retention.
+
+    Each step commits on its own, so a partition whose export fails stays
+    detached and is picked up again by the next run. Returns the names of
+    the partitions dropped.
+    """
+    if retention_months is None:
+        retention_months = settings.notifications_retention_months
+    if archive_dir is None:
+        archive_dir = settings.notifications_archive_dir
+    cutoff = add_months(
+        month_start(now or datetime.now(timezone.utc)), -retention_months
+    )
+
+    async with engine.begin() as conn:
+        expired = [
+            name
+            for name in await attached_partitions(conn)
+            if partition_month(name) and partition_month(name) < cutoff
+        ]
+        for name in expired:
+            # Removes the partition from every query plan right away
+            await conn.execute(
+                text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+            )
+            logger.info("Detached partition %s", name)
+
+    async with engine.connect() as conn:
+        pending = sorted(
+            name
+            for name in await detached_partitions(conn)
+            if partition_month(name) < cutoff
+        )
+
+    dropped = []
+    for name in pending:
+        async with engine.begin() as conn:
+            if archive_dir:
+                path = await export_partition(conn, name, archive_dir)
+                logger.info("Archived partition %s to %s", name, path)
+            await conn.execute(text(f"DROP TABLE {name}"))
+        logger.info("Dropped partition %s", name)
+        dropped.append(name)
+    return dropped
+
+
+async def run_maintenance():
+    async with engine.begin() as conn:
+        created = await ensure_partitions(conn)
+    if created:
+        logger.info("Created partitions %s", ", ".join(created))
+    await apply_retention()
+
+    # Expired idempotency keys are housekeeping of the same kind
+    async with AsyncSessionLocal() as session:
+        purged = await purge_expired_keys(session)
+    if purged:
+        logger.info("Purged %s expired idempotency keys", purged)
+
+
+async def run_partition_maintenance():
+    logger.info(
+        "Partition maintenance started (%s months ahead, %s months retention)",
+        settings.partition_months_ahead,
+        settings.notifications_retention_months,
+    )
+    while True:
+        try:
+            await run_maintenance()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Error during partition maintenance: %s", e)
+        await asyncio.sleep(settings.partition_maintenance_interval)
+
+
+if __name__ == "__main__":
+    setup_logger()
+    asyncio.run(run_partition_maintenance())
@@ -0,0 +1,191 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Union
+
+from sqlalchemy import column, func, table, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+
+from app.cache import preferences_cache
+from app.config import settings
+from app.db import AsyncSessionLocal
+from app.models import UserPreference
+
+COLUMNS = (
+    "user_id",
+    "email_enabled",
+    "sms_enabled",
+    "email",
+    "phone_number",
+    "timezone",
+    "quiet_hours_start",
+    "quiet_hours_end",
+    "max_per_window",
+    "frequency_window_seconds",
+    "digest_on_overflow",
+)
+STAGING_TABLE = "preferences_import"
+
+# Session-local table the import is copied into before the merge
+staging = table(STAGING_TABLE, column("line"), *(column(name) for name in COLUMNS))
+
+
+def upsert(statement):
+    """Turn an INSERT into user_preferences into an upsert on user_id.
+
+    A NULL email or phone number keeps the stored one, as a partial update.
+    Every other column, delivery rules included, is replaced.
+    """
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=[UserPreference.user_id],
+        set_={
+            **{name: excluded[name] for name in COLUMNS[1:]},
+            "email": func.coalesce(excluded.email, UserPreference.email),
+            "phone_number": func.coalesce(
+                excluded.phone_number, UserPreference.phone_number
+            ),
+        },
+    )
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a stream of byte chunks into lines, without buffering the whole body."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+
+async def read_rows(
+    chunks: AsyncIterator[bytes], fmt: str
+) -> AsyncIterator[tuple[int, Union[dict, ValueError]]]:
+    """Yield (line number, row) for every NDJSON or CSV record in the stream.
+
+    A line that cannot be parsed yields the error instead of a row, so the
+    caller can report it and carry on. CSV input starts with a header line.
+    """
+    header = None
+    line_number = 0
+    async for line in read_lines(chunks):
+        line_number += 1
+        try:
+            decoded = line.decode("utf-8")
+        except UnicodeDecodeError as e:
+            yield line_number, ValueError(f"Invalid UTF-8: {e}")
+            continue
+        if not decoded.strip():
+            continue
+
+        if fmt == "ndjson":
+            try:
+                row = json.loads(decoded)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f"Invalid JSON: {e}")
+                continue
+            if isinstance(row, dict):
+                yield line_number, row
+            else:
+                yield line_number, ValueError("Expected a JSON object")
+            continue
+
+        values = next(csv.reader([decoded]))
+        if header is None:
+            header = [name.strip().lstrip("\ufeff") for name in values]
+        elif len(values) != len(header):
+            yield line_number, ValueError(
+                f"Expected {len(header)} fields, got {len(values)}"
+            )
+        else:
+            # Empty CSV fields are missing values
+            yield line_number, {
+                name: value for name, value in zip(header, values) if value
+            }
+
+
+async def load_preferences(db, records: AsyncIterator[tuple]) -> int:
+    """COPY (line, *COLUMNS) records into a staging table and merge them.
+
+    The merge is a single `INSERT ... ON CONFLICT (user_id) DO UPDATE`; when a
+    user appears more than once, their last line wins. Commits, invalidates
+    the cached preferences of every imported user, and returns the number of
+    users inserted or updated.
+    """
+    await db.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE}"))
+    await db.execute(
+        text(
+            f"CREATE TEMPORARY TABLE {STAGING_TABLE} (line integer,"
+            " user_id text, email_enabled boolean, sms_enabled boolean,"
+            " email text, phone_number text, timezone text,"
+            " quiet_hours_start time, quiet_hours_end time,"
+            " max_per_window integer, frequency_window_seconds integer,"
+            " digest_on_overflow boolean)"
+        )
+    )
+    raw = await (await db.connection()).get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        STAGING_TABLE, records=records, columns=["line", *COLUMNS]
+    )
+
+    latest = (
+        select(*(staging.c[name] for name in COLUMNS))
+        .distinct(staging.c.user_id)
+        .order_by(staging.c.user_id, staging.c.line.desc())
+    )
+    result = await db.execute(
+        upsert(insert(UserPreference).from_select(list(COLUMNS), latest))
+    )
+    await db.commit()
+
+    # The staging table outlives the commit, so cached entries can be dropped
+    # in chunks once the new values are visible
+    try:
+        user_ids = await db.stream_scalars(
+            select(staging.c.user_id)
+            .distinct()
+            .execution_options(yield_per=settings.preferences_export_chunk_size)
+        )
+        async for chunk in user_ids.partitions():
+            await preferences_cache.invalidate_many(list(chunk))
+    finally:
+        await db.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE}"))
+        await db.commit()
+    return result.rowcount
+
+
+def format_rows(rows, fmt: str) -> str:
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(COLUMNS, row)), default=str) + "\n" for row in rows
+        )
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    for row in rows:
+        writer.writerow(
+            [str(value).lower() if isinstance(value, bool) else value for value in row]
+        )
+    return output.getvalue()
+
+
+async def dump_preferences(fmt: str) -> AsyncIterator[str]:
+    """Yield every user's preferences as NDJSON or CSV, one chunk at a time.
+
+    Rows come from a server-side cursor, so memory stays flat however many
+    there are. The generator owns its session: it runs after the request's
+    dependencies have been closed.
+    """
+    if fmt == "csv":
+        yield ",".join(COLUMNS) + "\n"
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(
+            select(*(getattr(UserPreference, name) for name in COLUMNS))
+            .order_by(UserPreference.id)
+            .execution_options(yield_per=settings.preferences_export_chunk_size)
+        )
+        async for rows in result.partitions():
+            yield format_rows(rows, fmt)
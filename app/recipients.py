@@ -0,0 +1,58 @@
+import re
+from typing import Optional, Sequence
+
+# Compiled once: notifiers, payloads and ingest all match against these
+EMAIL_PATTERN = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9.-]+")
+PHONE_PATTERN = re.compile(r"\+\d{10,15}")  # E.164, e.g. +1234567890
+
+# Characters people write phone numbers with that are not part of them
+PHONE_SEPARATORS = str.maketrans("", "", " \t-.()/")
+
+
+def is_valid_email(value: str) -> bool:
+    return EMAIL_PATTERN.fullmatch(value) is not None
+
+
+def is_valid_phone(value: str) -> bool:
+    return PHONE_PATTERN.fullmatch(value) is not None
+
+
+def normalize_email(value: str) -> Optional[str]:
+    """Return the address without surrounding whitespace, None if invalid."""
+    value = value.strip()
+    return value if is_valid_email(value) else None
+
+
+def normalize_phone(value: str) -> Optional[str]:
+    """Return the number in E.164 form, None if it cannot be.
+
+    Spaces, dashes, dots, slashes and parentheses are dropped, and a
+    leading 00 international prefix becomes +. Numbers without a country
+    code are invalid.
+    """
+    value = value.translate(PHONE_SEPARATORS)
+    if value.startswith("00"):
+        value = "+" + value[2:]
+    return value if is_valid_phone(value) else None
+
+
+NORMALIZERS = {"email": normalize_email, "sms": normalize_phone}
+
+
+def normalize_recipients(
+    channels: Sequence[str], recipients: Sequence[Optional[str]]
+) -> list[Optional[str]]:
+    """Normalize a column of recipients, each for the channel beside it.
+
+    Returns the normalized recipients in order, None for those that cannot
+    be delivered to. Batches repeat the same recipients many times, so each
+    distinct (channel, recipient) pair is matched once.
+    """
+    checked = {}
+    normalized = []
+    for key in zip(channels, recipients):
+        if key not in checked:
+            channel, recipient = key
+            checked[key] = NORMALIZERS[channel](recipient) if recipient else None
+        normalized.append(checked[key])
+    return normalized
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+
+import msgpack
+from sqlalchemy import delete
+from sqlalchemy.future import select
+
+from app.celery_worker import celery_app
+from app.config import settings
+from app.db import AsyncSessionLocal, in_array
+from app.metrics import BROKER_PUBLISH_LATENCY, start_metrics_server
+from app.models import OutboxMessage
+from app.utils.logger import setup_logger
+
+logger = logging.getLogger(__name__)
+
+
+def compression_options(kwargs: dict) -> dict:
+    """Compress large messages, and keep an uncompressed copy out of headers."""
+    if not settings.broker_compression:
+        return {}
+    size = len(msgpack.packb(kwargs))
+    if size <= settings.broker_compression_threshold:
+        return {}
+    return {"compression": settings.broker_compression, "kwargsrepr": f"<{size} bytes>"}
+
+
+def publish_messages(messages):
+    """Publish outbox messages to the broker over a single connection."""
+    started = time.perf_counter()
+    with celery_app.producer_or_acquire() as producer:
+        for message in messages:
+            celery_app.send_task(
+                message.task_name,
+                kwargs=message.kwargs,
+                queue=message.queue,
+                producer=producer,
+                **compression_options(message.kwargs),
+            )
+    BROKER_PUBLISH_LATENCY.observe(time.perf_counter() - started)
+
+
+async def relay_outbox(session, limit: int) -> int:
+    """Publish and delete up to `limit` outbox messages, oldest first.
+
+    Messages are locked with SKIP LOCKED so several relays can drain the
+    outbox concurrently. They are deleted only after publishing succeeds,
+    so delivery to the broker is at-least-once.
+    """
+    result = await session.execute(
+        select(OutboxMessage)
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    messages = result.scalars().all()
+    if not messages:
+        return 0
+
+    publish_messages(messages)
+    await session.execute(
+        delete(OutboxMessage)
+        .where(in_array(OutboxMessage.id, [message.id for message in messages]))
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return len(messages)
+
+
+async def run_relay():
+    logger.info(
+        "Outbox relay started (batch size %s, poll interval %ss)",
+        settings.relay_batch_size,
+        settings.relay_poll_interval,
+    )
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                count = await relay_outbox(session, settings.relay_batch_size)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Error while relaying outbox messages: %s", e)
+            count = 0
+
+        # Keep draining while there is a backlog, otherwise wait for the next poll
+        if count < settings.relay_batch_size:
+            await asyncio.sleep(settings.relay_poll_interval)
+
+
+if __name__ == "__main__":
+    setup_logger()
+    start_metrics_server(settings.relay_metrics_port)
+    asyncio.run(run_relay())
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from app.config import settings
+from app.metrics import CIRCUIT_OPENED_BY_CHANNEL, SEND_CONCURRENCY_BY_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending while a channel's circuit is open."""
+
+    def __init__(self, channel: str, retry_after: float):
+        super().__init__(f"{channel.upper()} circuit open")
+        self.channel = channel
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops sends through a channel while its provider is failing.
+
+    Sends are counted in fixed windows. Once at least `min_calls` sends in a
+    window failed at a rate of `failure_threshold` or more, the circuit opens
+    for `open_seconds`. After that one worker gets to send a trial batch:
+    the circuit closes if it succeeds and opens again if it does not.
+
+    With `redis_url` the state is shared by every worker process; without it
+    each process keeps its own. Redis errors let sends through.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: float = 0.5,
+        min_calls: int = 20,
+        window_seconds: int = 30,
+        open_seconds: float = 30,
+        redis_url: Optional[str] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self._redis = redis.from_url(redis_url) if redis_url else None
+        self._probing = False
+        # Local state, used without Redis
+        self._tripped = False
+        self._open_until = 0.0
+        self._probe_until = 0.0
+        self._window = None
+        self._calls = 0
+        self._failures = 0
+
+    def _key(self, suffix: str) -> str:
+        return f"circuit:{self.name}:{suffix}"
+
+    def _current_window(self) -> int:
+        return int(time.time() // self.window_seconds)
+
+    async def allow(self) -> bool:
+        """Return whether sends may go through right now."""
+        try:
+            return await self._allow()
+        except RedisError as e:
+            logger.warning("Circuit breaker state unavailable: %s", e)
+            return True
+
+    async def _allow(self) -> bool:
+        if self._redis is None:
+            now = time.monotonic()
+            if not self._tripped:
+                return True
+            if now < self._open_until or now < self._probe_until:
+                return False
+            self._probe_until = now + self.open_seconds
+            self._probing = True
+            return True
+
+        tripped, opened = await self._redis.mget(
+            [self._key("tripped"), self._key("open")]
+        )
+        if not tripped:
+            return True
+        if opened:
+            return False
+        # Half-open: only the worker that takes the probe sends
+        self._probing = bool(
+            await self._redis.set(
+                self._key("probe"), 1, nx=True, px=int(self.open_seconds * 1000)
+            )
+        )
+        return self._probing
+
+    async def record(self, successes: int, failures: int):
+        """Count the outcome of sends let through by `allow`."""
+        try:
+            await self._record(successes, failures)
+        except RedisError as e:
+            logger.warning("Circuit breaker state unavailable: %s", e)
+
+    async def _record(self, successes: int, failures: int):
+        if self._probing:
+            self._probing = False
+            if failures:
+                await self._trip()
+            else:
+                await self._close()
+            return
+
+        calls = successes + failures
+        if not calls:
+            return
+        window = self._current_window()
+        if self._redis is None:
+            if window != self._window:
+                self._window, self._calls, self._failures = window, 0, 0
+            self._calls += calls
+            self._failures += failures
+            total_calls, total_failures = self._calls, self._failures
+        else:
+            calls_key = self._key(f"calls:{window}")
+            failures_key = self._key(f"failures:{window}")
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.incrby(calls_key, calls)
+                pipe.incrby(failures_key, failures)
+                pipe.expire(calls_key, self.window_seconds * 2)
+                pipe.expire(failures_key, self.window_seconds * 2)
+                total_calls, total_failures, _, _ = await pipe.execute()
+
+        if (
+            total_calls >= self.min_calls
+            and total_failures / total_calls >= self.failure_threshold
+        ):
+            await self._trip()
+
+    async def _trip(self):
+        logger.warning("Circuit %s opened for %ss", self.name, self.open_seconds)
+        CIRCUIT_OPENED_BY_CHANNEL[self.name].inc()
+        if self._redis is None:
+            self._tripped = True
+            self._open_until = time.monotonic() + self.open_seconds
+            self._probe_until = 0.0
+            self._window = None
+            return
+        window = self._current_window()
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key("tripped"), 1)
+            pipe.set(self._key("open"), 1, px=int(self.open_seconds * 1000))
+            pipe.delete(
+                self._key("probe"),
+                self._key(f"calls:{window}"),
+                self._key(f"failures:{window}"),
+            )
+            await pipe.execute()
+
+    async def _close(self):
+        logger.info("Circuit %s closed", self.name)
+        if self._redis is None:
+            self._tripped = False
+            self._probe_until = 0.0
+            return
+        await self._redis.delete(self._key("tripped"), self._key("probe"))
+
+
+class AdaptiveLimiter:
+    """Caps concurrent sends, adjusting the cap with AIMD on observed latency.
+
+    Every send faster than `latency_target` raises the limit by 1/limit, so
+    about one per round of sends. A slower send, or an overload error, cuts
+    it by `backoff`. Sends that started before the last cut do not cut it
+    again, so one slow round halves the limit once rather than per send.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_limit: int = 1,
+        max_limit: int = 50,
+        latency_target: float = 1.0,
+        backoff: float = 0.5,
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._decreased_at = 0.0
+        self._condition = None  # created on the worker's event loop
+
+    async def __aenter__(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, started: float, overloaded: bool = False):
+        """Adjust the limit for a send that started at `started` (perf_counter)."""
+        now = time.perf_counter()
+        if overloaded or now - started > self.latency_target:
+            if started >= self._decreased_at:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._decreased_at = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        SEND_CONCURRENCY_BY_CHANNEL[self.name].set(int(self.limit))
+
+
+_breakers = {}
+_limiters = {}
+
+
+def get_breaker(channel: str) -> CircuitBreaker:
+    """Return the circuit breaker of `channel`, creating it on first use."""
+    if channel not in _breakers:
+        _breakers[channel] = CircuitBreaker(
+            channel,
+            failure_threshold=settings.circuit_failure_threshold,
+            min_calls=settings.circuit_min_calls,
+            window_seconds=settings.circuit_window_seconds,
+            open_seconds=settings.circuit_open_seconds,
+            redis_url=settings.circuit_breaker_redis_url,
+        )
+    return _breakers[channel]
+
+
+def get_limiter(channel: str) -> AdaptiveLimiter:
+    """Return this process's concurrency limiter for `channel`."""
+    if channel not in _limiters:
+        _limiters[channel] = AdaptiveLimiter(
+            channel,
+            min_limit=settings.send_concurrency_min,
+            max_limit=settings.send_concurrency_max,
+            latency_target=settings.send_latency_target,
+        )
+    return _limiters[channel]
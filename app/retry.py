@@ -0,0 +1,157 @@
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+import aiosmtplib
+import httpx
+
+from app.config import settings
+from app.models import Notification, NotificationStatus
+from app.notifiers.sms_client import SMSProviderError
+from app.resilience import CircuitOpenError
+from app.rules import FrequencyCapError, QuietHoursError
+
+MAX_ERROR_LENGTH = 500
+
+
+def smtp_error_is_transient(error: BaseException) -> bool:
+    # 4xx replies are temporary failures, 5xx replies are permanent
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return 400 <= error.code < 500
+    return True
+
+
+def sms_error_is_transient(error: BaseException) -> bool:
+    if isinstance(error, SMSProviderError):
+        return error.retryable
+    return True
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often and how fast failed sends of one channel are retried."""
+
+    max_attempts: int
+    base_delay: float  # seconds before the first retry, doubled every attempt
+    max_delay: float
+    retryable: tuple[type[BaseException], ...]
+    is_transient: Callable[[BaseException], bool] = lambda error: True
+
+    def is_retryable(self, error: BaseException) -> bool:
+        return isinstance(error, self.retryable) and self.is_transient(error)
+
+    def next_delay(self, attempts: int) -> float:
+        """Full-jitter exponential backoff after `attempts` failed attempts.
+
+        The random spread keeps notifications that failed together during an
+        outage from all being retried at the same moment.
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return random.uniform(0, ceiling)
+
+
+RETRY_POLICIES = {
+    "email": RetryPolicy(
+        max_attempts=settings.email_max_attempts,
+        base_delay=settings.email_retry_base_delay,
+        max_delay=settings.email_retry_max_delay,
+        retryable=(aiosmtplib.SMTPException, ConnectionError, TimeoutError),
+        is_transient=smtp_error_is_transient,
+    ),
+    "sms": RetryPolicy(
+        max_attempts=settings.sms_max_attempts,
+        base_delay=settings.sms_retry_base_delay,
+        max_delay=settings.sms_retry_max_delay,
+        retryable=(SMSProviderError, httpx.TransportError, TimeoutError),
+        is_transient=sms_error_is_transient,
+    ),
+}
+
+
+def error_text(error: BaseException) -> str:
+    """Describe an error for the last_error column, within its length limit."""
+    return f"{type(error).__name__}: {error}"[:MAX_ERROR_LENGTH]
+
+
+def next_state(
+    notification: Notification, error: Optional[BaseException], now: datetime
+) -> dict:
+    """Return the column values recording one delivery attempt.
+
+    Retryable errors schedule another attempt until the channel's policy is
+    exhausted, then the notification is dead-lettered. Other errors fail it
+    right away. A send skipped by an open circuit or the user's quiet hours
+    is not an attempt: it is rescheduled for after them. One over the user's
+    frequency cap is held for their digest, or suppressed.
+    """
+    if isinstance(error, FrequencyCapError):
+        return {
+            "status": (
+                NotificationStatus.held
+                if error.digest
+                else NotificationStatus.suppressed
+            ),
+            "sent_at": None,
+            "attempts": notification.attempts or 0,
+            "next_attempt_at": (
+                now + timedelta(seconds=error.retry_after) if error.digest else None
+            ),
+            "last_error": error_text(error),
+        }
+    if isinstance(error, (CircuitOpenError, QuietHoursError)):
+        policy = RETRY_POLICIES[notification.channel]
+        delay = error.retry_after + random.uniform(0, policy.base_delay)
+        return {
+            "status": NotificationStatus.retrying,
+            "sent_at": None,
+            "attempts": notification.attempts or 0,
+            "next_attempt_at": now + timedelta(seconds=delay),
+            "last_error": error_text(error),
+        }
+
+    attempts = (notification.attempts or 0) + 1
+    state = {
+        "status": NotificationStatus.sent,
+        "sent_at": now,
+        "attempts": attempts,
+        "next_attempt_at": None,
+        "last_error": None,
+    }
+    if error is None:
+        return state
+
+    policy = RETRY_POLICIES[notification.channel]
+    state["sent_at"] = None
+    state["last_error"] = error_text(error)
+    if not policy.is_retryable(error):
+        state["status"] = NotificationStatus.failed
+    elif attempts >= policy.max_attempts:
+        state["status"] = NotificationStatus.dead
+    else:
+        state["status"] = NotificationStatus.retrying
+        state["next_attempt_at"] = now + timedelta(seconds=policy.next_delay(attempts))
+    return state
+
+
+def interrupted_state(
+    notification: Notification, error: BaseException, now: datetime
+) -> dict:
+    """Return the column values for a claimed notification whose batch broke.
+
+    An unexpected error after the claim leaves unknown whether it was sent,
+    so it is retried like a transient failure, which counts an attempt.
+    """
+    policy = RETRY_POLICIES[notification.channel]
+    attempts = (notification.attempts or 0) + 1
+    state = {
+        "status": NotificationStatus.retrying,
+        "sent_at": None,
+        "attempts": attempts,
+        "next_attempt_at": now + timedelta(seconds=policy.next_delay(attempts)),
+        "last_error": error_text(error),
+    }
+    if attempts >= policy.max_attempts:
+        state["status"] = NotificationStatus.dead
+        state["next_attempt_at"] = None
+    return state
@@ -1,89 +1,636 @@
+import base64
+import json
 import logging
-from datetime import datetime, timezone
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Any, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, EmailStr  # pylint: disable=unused-import
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
+from pydantic import (  # pylint: disable=unused-import
+    BaseModel,
+    EmailStr,
+    Field,
+    model_validator,
+)
+from sqlalchemy import Interval, cast, func, insert, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from app.db import get_db
-from app.models import Notification, NotificationStatus, UserPreference
-from app.tasks.notification_tasks import send_email_task, send_sms_task
+from app.cache import CachedPreference, preferences_cache
+from app.celery_worker import queue_name
+from app.config import settings
+from app.db import get_db, in_array, in_range
+from app.idempotency import claim_key, get_key, request_hash, save_response
+from app.models import Notification, NotificationStatus, OutboxMessage
+from app.outbox import batch_messages
+from app.recipients import normalize_recipients
+from app.tasks.notification_tasks import send_notification_batch
+from app.templates import CompiledTemplate, template_cache
 
 router = APIRouter()
 
+IdempotencyKeyHeader = Annotated[
+    Optional[str], Header(alias="Idempotency-Key", max_length=255)
+]
+
 logger = logging.getLogger(__name__)
 
 
-class NotificationPayload(BaseModel):
+Priority = Literal["high", "low"]
+
+
+class MessageContent(BaseModel):
+    # Either the text itself...
+    subject: Optional[str] = None
+    message: Optional[str] = None
+    # ...or a stored template and the variables to render it with
+    template_id: Optional[str] = None
+    template_version: Optional[int] = None  # if None, the latest version
+    variables: dict[str, Any] = {}
+
+    @model_validator(mode="after")
+    def check_text_or_template(self):
+        has_text = self.subject is not None or self.message is not None
+        if self.template_id is not None and has_text:
+            raise ValueError(
+                "Provide either 'subject' and 'message' or 'template_id', not both"
+            )
+        if has_text and (self.subject is None or self.message is None):
+            raise ValueError("'subject' and 'message' must be provided together")
+        return self
+
+    @property
+    def has_content(self) -> bool:
+        return self.template_id is not None or self.message is not None
+
+
+class NotificationPayload(MessageContent):
     user_id: str
-    subject: str
-    message: str
     send_at: Optional[datetime] = None  # if None, send immediately
+    priority: Priority = "high"
+
+    @model_validator(mode="after")
+    def check_content(self):
+        if not self.has_content:
+            raise ValueError("Provide 'subject' and 'message', or 'template_id'")
+        return self
+
+
+MAX_BATCH_ITEMS = 50_000
+
+
+class BatchNotificationItem(MessageContent):
+    # Items without content use the batch's; variables are merged over it
+    user_id: str
+    send_at: Optional[datetime] = None
+    priority: Optional[Priority] = None  # if None, the batch's priority
+
+
+class BatchNotificationPayload(MessageContent):
+    # Either a list of items...
+    items: list[BatchNotificationItem] = Field(default=[], max_length=MAX_BATCH_ITEMS)
+    # ...or one message fanned out to a list of users
+    user_ids: list[str] = Field(default=[], max_length=MAX_BATCH_ITEMS)
+    send_at: Optional[datetime] = None
+    # Batches are usually bulk sends, so they default to the low lane
+    priority: Priority = "low"
+
+    @model_validator(mode="after")
+    def check_items_or_fan_out(self):
+        if self.items and self.user_ids:
+            raise ValueError("Provide either 'items' or 'user_ids', not both")
+        if not self.items and not self.user_ids:
+            raise ValueError("Provide 'items' or 'user_ids'")
+        if self.user_ids and not self.has_content:
+            raise ValueError(
+                "'subject' and 'message', or 'template_id', are required with"
+                " 'user_ids'"
+            )
+        if not self.has_content and not all(item.has_content for item in self.items):
+            raise ValueError(
+                "Items without 'subject' and 'message' or 'template_id' need the"
+                " batch's"
+            )
+        return self
+
+    def expand(self) -> list[BatchNotificationItem]:
+        """Return the payload as a flat list of items with their content."""
+        if self.items:
+            return [
+                (
+                    item
+                    if item.has_content
+                    else item.model_copy(
+                        update={
+                            "subject": self.subject,
+                            "message": self.message,
+                            "template_id": self.template_id,
+                            "template_version": self.template_version,
+                            "variables": {**self.variables, **item.variables},
+                        }
+                    )
+                )
+                for item in self.items
+            ]
+        return [
+            BatchNotificationItem(
+                user_id=user_id,
+                subject=self.subject,
+                message=self.message,
+                template_id=self.template_id,
+                template_version=self.template_version,
+                variables=self.variables,
+                send_at=self.send_at,
+                priority=self.priority,
+            )
+            for user_id in self.user_ids
+        ]
+
+
+class NotificationSummary(BaseModel):
+    id: int
+    user_id: str
+    channel: str
+    status: NotificationStatus
+    send_at: Optional[datetime] = None
+    sent_at: Optional[datetime] = None
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+
+class NotificationPage(BaseModel):
+    items: list[NotificationSummary]
+    next_cursor: Optional[str] = None  # pass back as `cursor` for the next page
+
+
+class RedrivePayload(BaseModel):
+    # Specific dead notifications, or every one matching the filters
+    ids: list[int] = Field(default=[], max_length=MAX_BATCH_ITEMS)
+    channel: Optional[Literal["email", "sms"]] = None
+    user_id: Optional[str] = None
+    limit: int = Field(default=10_000, ge=1, le=MAX_BATCH_ITEMS)
+    # Retries are spread randomly over this window; defaults to the setting
+    spread_seconds: Optional[float] = Field(default=None, ge=0)
+
+
+def encode_cursor(send_at: datetime, notification_id: int) -> str:
+    raw = json.dumps({"send_at": send_at.isoformat(), "id": notification_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(raw["send_at"]), int(raw["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+async def replay_or_claim(
+    db: AsyncSession, idempotency_key: str, payload: BaseModel
+) -> Optional[JSONResponse]:
+    """Claim the key for this request, or return the response stored for it."""
+    payload_hash = request_hash(payload)
+    if await claim_key(db, idempotency_key, payload_hash):
+        return None
+
+    await db.rollback()
+    stored = await get_key(db, idempotency_key)
+    if stored is None or stored.response is None:
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is in progress",
+        )
+    if stored.request_hash != payload_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used with a different payload",
+        )
+    logger.info("Replaying response for Idempotency-Key %s", idempotency_key)
+    return JSONResponse(stored.response, headers={"Idempotent-Replayed": "true"})
+
+
+async def resolve_template(
+    db: AsyncSession, content: MessageContent
+) -> CompiledTemplate:
+    """Return the template version to store for `content`.
+
+    Raises a 404 if it does not exist and a 422 if variables are missing.
+    """
+    template = await template_cache.get(
+        db, content.template_id, content.template_version
+    )
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    missing = template.missing(content.variables)
+    if missing:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Missing template variables: {', '.join(sorted(missing))}",
+        )
+    return template
+
+
+def enabled_channels(preferences: CachedPreference):
+    """Return the (channel, recipient) pairs enabled for a user."""
+    channels = []
+    if preferences.email_enabled and preferences.email:
+        channels.append(("email", preferences.email))
+    if preferences.sms_enabled and preferences.phone_number:
+        channels.append(("sms", preferences.phone_number))
+    return channels
+
+
+def check_recipients(rows: list[dict]) -> int:
+    """Normalize the recipients of notification rows about to be inserted.
+
+    The whole column is validated at once. Rows nobody can deliver to are
+    stored as failed with `recipient_valid` false, so they are never queued
+    for a worker. Returns how many there are.
+    """
+    recipients = normalize_recipients(
+        [row["channel"] for row in rows], [row["recipient"] for row in rows]
+    )
+    invalid = 0
+    for row, recipient in zip(rows, recipients):
+        # Every row gets the same keys, as the batch insert requires
+        row["recipient_valid"] = recipient is not None
+        row["last_error"] = None
+        if recipient is None:
+            invalid += 1
+            row["status"] = NotificationStatus.failed
+            row["next_attempt_at"] = None
+            row["last_error"] = invalid_recipient_detail([row["channel"]])
+        else:
+            row["recipient"] = recipient
+    return invalid
+
+
+def invalid_recipient_detail(channels: list[str]) -> str:
+    return "Invalid recipient for " + ", ".join(c.upper() for c in channels)
+
+
+@router.get("", response_model=NotificationPage)
+async def list_notifications(
+    user_id: Optional[str] = None,
+    status: Optional[NotificationStatus] = None,
+    channel: Optional[Literal["email", "sms"]] = None,
+    send_at_from: Optional[datetime] = None,
+    send_at_to: Optional[datetime] = None,
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    # Every query must be able to use one of the composite indexes
+    if user_id is None and status is None:
+        raise HTTPException(
+            status_code=400, detail="Filter by at least user_id or status"
+        )
+
+    # Newest first. Pages continue from the last (send_at, id) seen instead
+    # of using OFFSET, so every page costs the same regardless of depth.
+    query = select(
+        Notification.id,
+        Notification.user_id,
+        Notification.channel,
+        Notification.status,
+        Notification.send_at,
+        Notification.sent_at,
+        Notification.attempts,
+        Notification.last_error,
+    ).order_by(Notification.send_at.desc(), Notification.id.desc())
+    if user_id is not None:
+        query = query.where(Notification.user_id == user_id)
+    if status is not None:
+        query = query.where(Notification.status == status)
+    if channel is not None:
+        query = query.where(Notification.channel == channel)
+    if send_at_from is not None:
+        query = query.where(Notification.send_at >= send_at_from)
+    if send_at_to is not None:
+        query = query.where(Notification.send_at < send_at_to)
+    if cursor is not None:
+        query = query.where(
+            tuple_(Notification.send_at, Notification.id)
+            < tuple_(*decode_cursor(cursor))
+        )
+
+    # Fetch one extra row to know whether there is a next page
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.all()
+    items = [NotificationSummary.model_validate(row._asdict()) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(items[-1].send_at, items[-1].id)
+    return NotificationPage(items=items, next_cursor=next_cursor)
 
 
 @router.post("")
 async def create_notification(
-    payload: NotificationPayload, db: AsyncSession = Depends(get_db)
+    payload: NotificationPayload,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: IdempotencyKeyHeader = None,
 ):
+    # A retried request gets the original response instead of new rows
+    if idempotency_key:
+        replay = await replay_or_claim(db, idempotency_key, payload)
+        if replay:
+            return replay
+
     # Get user preferences
-    result = await db.execute(
-        select(UserPreference).where(UserPreference.user_id == payload.user_id)
-    )
-    preferences = result.scalar_one_or_none()
+    preferences = await preferences_cache.get(db, payload.user_id)
     if not preferences:
         logger.warning("User preferences not found for user_id: %s", payload.user_id)
         raise HTTPException(status_code=404, detail="User preferences not found")
 
+    # Templated notifications store the version and variables, not the text
+    template = None
+    if payload.template_id is not None:
+        template = await resolve_template(db, payload)
+
     now = datetime.now(timezone.utc)
     send_at = payload.send_at or now
+    # Due notifications are queued in the outbox right away, leased like the
+    # ones the scheduler queues. Future ones stay pending and the scheduler
+    # queues them once they come due.
+    is_due = send_at <= now
+    lease = now + timedelta(seconds=settings.queue_lease_seconds)
 
-    notification_records = []
+    # Schedule one notification per enabled channel
+    rows = [
+        {
+            "user_id": payload.user_id,
+            "subject": payload.subject,
+            "message": payload.message,
+            "send_at": send_at,
+            "status": (
+                NotificationStatus.queued if is_due else NotificationStatus.pending
+            ),
+            "next_attempt_at": lease if is_due else None,
+            "channel": channel,
+            "priority": payload.priority,
+            "recipient": recipient,
+            "template_id": template.id if template else None,
+            "template_version": template.version if template else None,
+            "variables": payload.variables if template else None,
+        }
+        for channel, recipient in enabled_channels(preferences)
+    ]
+    check_recipients(rows)
+    invalid = [row["channel"] for row in rows if not row["recipient_valid"]]
+    if invalid:
+        logger.warning("Invalid recipients for user_id: %s", payload.user_id)
 
-    # Schedule email if enabled
-    if preferences.email_enabled and preferences.email:
-        notification = Notification(
-            user_id=payload.user_id,
-            subject=payload.subject,
-            message=payload.message,
-            send_at=send_at,
-            status=NotificationStatus.pending,
-            channel="email",
-            recipient=preferences.email,
-        )
+    notifications = []
+    for row in rows:
+        notification = Notification(**row)
         db.add(notification)
-        notification_records.append((notification, send_email_task))
+        if notification.status == NotificationStatus.queued:
+            notifications.append(notification)
 
-    # Schedule SMS if enabled
-    if preferences.sms_enabled and preferences.phone_number:
-        notification = Notification(
-            user_id=payload.user_id,
-            subject=payload.subject,
-            message=payload.message,
-            send_at=send_at,
-            status=NotificationStatus.pending,
-            channel="sms",
-            recipient=preferences.phone_number,
-        )
-        db.add(notification)
-        notification_records.append((notification, send_sms_task))
+    if notifications:
+        # Flush to get the notification ids, then write the task messages in
+        # the same transaction. The relay publishes them to the broker. They
+        # carry only ids and their send_at range: the worker loads the rows.
+        await db.flush()
+        for message in batch_messages(
+            send_notification_batch.name,
+            [
+                (
+                    notification.id,
+                    queue_name(notification.channel, payload.priority),
+                    notification.send_at,
+                )
+                for notification in notifications
+            ],
+            settings.task_max_ids,
+        ):
+            db.add(OutboxMessage(**message))
 
+    response = {"status": "queued", "send_at": send_at.isoformat()}
+    if invalid:
+        # Stored, but never sent
+        response["detail"] = invalid_recipient_detail(invalid)
+        if len(invalid) == len(rows):
+            response["status"] = "failed"
+    if idempotency_key:
+        await save_response(db, idempotency_key, response)
     await db.commit()
 
-    # Trigger tasks via Celery
-    for notification, task in notification_records:
-        task_args = {
-            "user_id": notification.user_id,
-            "subject": notification.subject,
-            "message": notification.message,
-            "notification_id": notification.id,
-            "recipient": notification.recipient,
+    logger.info("Notification queued for user_id: %s", payload.user_id)
+
+    return response
+
+
+@router.post("/batch")
+async def create_notifications_batch(
+    payload: BatchNotificationPayload,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: IdempotencyKeyHeader = None,
+):
+    if idempotency_key:
+        replay = await replay_or_claim(db, idempotency_key, payload)
+        if replay:
+            return replay
+
+    items = payload.expand()
+
+    # Resolve every user's preferences, querying the database only once for
+    # the users that are not cached
+    preferences_by_user = await preferences_cache.get_many(
+        db, {item.user_id for item in items}
+    )
+
+    # Look up every template version used once, not once per item
+    templates = {}
+    for item in items:
+        key = (item.template_id, item.template_version)
+        if item.template_id is not None and key not in templates:
+            templates[key] = await template_cache.get(db, *key)
+
+    now = datetime.now(timezone.utc)
+    lease = now + timedelta(seconds=settings.queue_lease_seconds)
+    results = []
+    rows = []
+    row_results = []  # item result for each row, in insert order
+
+    for index, item in enumerate(items):
+        preferences = preferences_by_user.get(item.user_id)
+        template = templates.get((item.template_id, item.template_version))
+        detail = None
+        if not preferences:
+            detail = "User preferences not found"
+        elif item.template_id is not None and template is None:
+            detail = "Template not found"
+        elif template is not None and template.missing(item.variables):
+            missing = ", ".join(sorted(template.missing(item.variables)))
+            detail = f"Missing template variables: {missing}"
+        if detail:
+            results.append(
+                {
+                    "index": index,
+                    "user_id": item.user_id,
+                    "status": "failed",
+                    "detail": detail,
+                    "notification_ids": [],
+                }
+            )
+            continue
+
+        send_at = item.send_at or now
+        priority = item.priority or payload.priority
+        item_result = {
+            "index": index,
+            "user_id": item.user_id,
+            "status": "queued",
+            "send_at": send_at.isoformat(),
+            "notification_ids": [],
         }
+        results.append(item_result)
 
-        eta = notification.send_at if notification.send_at > now else None
-        task.apply_async(kwargs=task_args, eta=eta)
+        for channel, recipient in enabled_channels(preferences):
+            rows.append(
+                {
+                    "user_id": item.user_id,
+                    "subject": item.subject,
+                    "message": item.message,
+                    "template_id": template.id if template else None,
+                    "template_version": template.version if template else None,
+                    "variables": item.variables if template else None,
+                    "send_at": send_at,
+                    "status": (
+                        NotificationStatus.queued
+                        if send_at <= now
+                        else NotificationStatus.pending
+                    ),
+                    "next_attempt_at": lease if send_at <= now else None,
+                    "channel": channel,
+                    "priority": priority,
+                    "recipient": recipient,
+                }
+            )
+            row_results.append(item_result)
 
-    logger.info("Notification queued for user_id: %s", payload.user_id)
+    # Validate every recipient at once. An item none of whose recipients can
+    # be delivered to has failed; one with some has its detail say which.
+    invalid = check_recipients(rows)
+    if invalid:
+        invalid_channels = {}
+        delivered = set()
+        for row, item_result in zip(rows, row_results):
+            if row["recipient_valid"]:
+                delivered.add(item_result["index"])
+            else:
+                invalid_channels.setdefault(item_result["index"], []).append(
+                    row["channel"]
+                )
+        for item_result in results:
+            channels = invalid_channels.get(item_result["index"])
+            if channels:
+                item_result["detail"] = invalid_recipient_detail(channels)
+                if item_result["index"] not in delivered:
+                    item_result["status"] = "failed"
+
+    # Bulk insert every row in one transaction, getting ids back in row order
+    if rows:
+        inserted = await db.scalars(
+            insert(Notification).returning(
+                Notification.id, sort_by_parameter_order=True
+            ),
+            rows,
+        )
+        queued = []
+        for row, notification_id, item_result in zip(rows, inserted.all(), row_results):
+            item_result["notification_ids"].append(notification_id)
+            # Due rows are queued for the relay, the scheduler handles the rest
+            if row["status"] == NotificationStatus.queued:
+                queued.append(
+                    (
+                        notification_id,
+                        queue_name(row["channel"], row["priority"]),
+                        row["send_at"],
+                    )
+                )
+        if queued:
+            # One message per queue and task_max_ids ids, not per notification
+            await db.execute(
+                insert(OutboxMessage),
+                batch_messages(
+                    send_notification_batch.name, queued, settings.task_max_ids
+                ),
+            )
+
+    failed = sum(1 for item_result in results if item_result["status"] == "failed")
+    response = {
+        "status": "queued" if not failed else "partial",
+        "queued": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    }
+    if idempotency_key:
+        await save_response(db, idempotency_key, response)
+    await db.commit()
+
+    logger.info(
+        "Batch notification queued for %s users (%s failed, %s invalid recipients)",
+        len(results) - failed,
+        failed,
+        invalid,
+    )
+
+    return response
+
+
+@router.post("/dead-letter/redrive")
+async def redrive_dead_letters(
+    payload: RedrivePayload, db: AsyncSession = Depends(get_db)
+):
+    spread = payload.spread_seconds
+    if spread is None:
+        spread = settings.redrive_spread_seconds
+
+    dead = select(Notification.id, Notification.send_at).where(
+        Notification.status == NotificationStatus.dead
+    )
+    if payload.ids:
+        dead = dead.where(in_array(Notification.id, payload.ids))
+    if payload.channel is not None:
+        dead = dead.where(Notification.channel == payload.channel)
+    if payload.user_id is not None:
+        dead = dead.where(Notification.user_id == payload.user_id)
+    result = await db.execute(
+        dead.order_by(Notification.send_at)
+        .limit(payload.limit)
+        .with_for_update(skip_locked=True)
+    )
+    locked = result.all()
+    if not locked:
+        await db.commit()
+        return {"redriven": 0, "notification_ids": []}
+
+    # Hand the notifications back to the scheduler as fresh retries, each at
+    # a random point of the window so the providers are not hit all at once.
+    # The send_at range keeps the UPDATE to the partitions holding them.
+    result = await db.execute(
+        update(Notification)
+        .where(
+            in_array(
+                Notification.id, [notification_id for notification_id, _ in locked]
+            ),
+            in_range(Notification.send_at, [send_at for _, send_at in locked]),
+        )
+        .values(
+            status=NotificationStatus.retrying,
+            attempts=0,
+            next_attempt_at=func.now()
+            + func.random() * cast(timedelta(seconds=spread), Interval),
+        )
+        .returning(Notification.id)
+        .execution_options(synchronize_session=False)
+    )
+    notification_ids = result.scalars().all()
+    await db.commit()
+
+    logger.info("Re-drove %s dead notifications", len(notification_ids))
 
-    return {"status": "queued", "send_at": send_at.isoformat()}
+    return {"redriven": len(notification_ids), "notification_ids": notification_ids}
@@ -1,80 +1,281 @@
 import logging
+from datetime import time
 from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, EmailStr
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import (
+    BaseModel,
+    EmailStr,
+    Field,
+    ValidationError,
+    field_validator,
+    model_validator,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
+from app.cache import preferences_cache
+from app.config import settings
 from app.db import get_db
 from app.models import UserPreference
+from app.preferences_bulk import (
+    COLUMNS,
+    dump_preferences,
+    load_preferences,
+    read_rows,
+    upsert,
+)
+from app.recipients import is_valid_email, normalize_phone, normalize_recipients
 
 router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
 
-class PreferencesPayload(BaseModel):
+class Preferences(BaseModel):
+    """Stored preferences, as returned. Rows written before a validation rule
+    existed may not satisfy it, so responses do not re-run input validation.
+    """
+
     email_enabled: bool
     sms_enabled: bool
-    email: Optional[EmailStr] = None
+    email: Optional[str] = None
     phone_number: Optional[str] = None
+    # Delivery rules, replaced on every write
+    timezone: Optional[str] = None  # IANA name for the quiet hours, UTC if unset
+    quiet_hours_start: Optional[time] = None  # local time, may wrap midnight
+    quiet_hours_end: Optional[time] = None
+    max_per_window: Optional[int] = None  # sends per channel...
+    frequency_window_seconds: Optional[int] = None  # ...in this window
+    digest_on_overflow: bool = False  # hold capped notifications for a digest
 
 
-@router.get("/{user_id}", response_model=PreferencesPayload)
-async def get_preferences(user_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(UserPreference).where(UserPreference.user_id == user_id)
+def invalid_email(email: str) -> str:
+    return f"Unsupported email address '{email}'"
+
+
+def invalid_phone_number(phone_number: str) -> str:
+    return (
+        f"Invalid phone number '{phone_number}', expected E.164 with a"
+        " country code, e.g. +34600123456"
     )
-    preference = result.scalar_one_or_none()
-    if not preference:
-        logger.warning(
-            "Preferences not found for user_id: %s", user_id
+
+
+class PreferencesRules(Preferences):
+    """Preferences as written, with every check but the recipients'."""
+
+    max_per_window: Optional[int] = Field(None, ge=1)
+    frequency_window_seconds: Optional[int] = Field(None, ge=1)
+
+    @field_validator("timezone")
+    @classmethod
+    def check_timezone(cls, timezone: Optional[str]) -> Optional[str]:
+        if timezone is not None:
+            try:
+                ZoneInfo(timezone)
+            except (ZoneInfoNotFoundError, ValueError) as e:
+                raise ValueError(f"Unknown timezone '{timezone}'") from e
+        return timezone
+
+    @model_validator(mode="after")
+    def check_rules(self):
+        if (self.quiet_hours_start is None) != (self.quiet_hours_end is None):
+            raise ValueError(
+                "'quiet_hours_start' and 'quiet_hours_end' must be provided together"
+            )
+        if (self.max_per_window is None) != (self.frequency_window_seconds is None):
+            raise ValueError(
+                "'max_per_window' and 'frequency_window_seconds' must be provided"
+                " together"
+            )
+        return self
+
+
+class PreferencesPayload(PreferencesRules):
+    email: Optional[EmailStr] = None
+
+    @field_validator("email")
+    @classmethod
+    def check_email(cls, email: Optional[str]) -> Optional[str]:
+        # Stricter than EmailStr: only addresses the email notifier accepts
+        if email is not None and not is_valid_email(email):
+            raise ValueError(invalid_email(email))
+        return email
+
+    @field_validator("phone_number")
+    @classmethod
+    def check_phone_number(cls, phone_number: Optional[str]) -> Optional[str]:
+        if not phone_number:
+            return None
+        normalized = normalize_phone(phone_number)
+        if normalized is None:
+            raise ValueError(invalid_phone_number(phone_number))
+        return normalized
+
+
+class PreferencesImportRow(PreferencesRules):
+    # Recipients are checked a chunk of rows at a time, by normalize_import_rows
+    user_id: str = Field(min_length=1)
+
+
+def normalize_import_rows(rows: list[PreferencesImportRow]) -> list[Optional[str]]:
+    """Normalize the email and phone number columns of a chunk of import rows.
+
+    Returns each row's error, None for the rows whose recipients are valid;
+    those are replaced by their normalized form. Imports repeat the same
+    addresses and numbers, so each distinct one is matched once.
+    """
+    emails = normalize_recipients(["email"] * len(rows), [row.email for row in rows])
+    phone_numbers = normalize_recipients(
+        ["sms"] * len(rows), [row.phone_number for row in rows]
+    )
+    errors = []
+    for row, email, phone_number in zip(rows, emails, phone_numbers):
+        if row.email and email is None:
+            errors.append(f"email: {invalid_email(row.email)}")
+        elif row.phone_number and phone_number is None:
+            errors.append(f"phone_number: {invalid_phone_number(row.phone_number)}")
+        else:
+            row.email, row.phone_number = email, phone_number
+            errors.append(None)
+    return errors
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportResult(BaseModel):
+    imported: int  # users inserted or updated
+    invalid: int  # rows skipped
+    errors: list[ImportRowError]  # the first PREFERENCES_IMPORT_MAX_ERRORS
+
+
+IMPORT_FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "text/csv": "csv",
+}
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def describe(error: ValueError) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}"
+            for e in error.errors()
+        )
+    return str(error)
+
+
+# Declared before /{user_id} so "import" and "export" are not taken as user ids
+@router.post("/import", response_model=ImportResult)
+async def import_preferences(request: Request, db: AsyncSession = Depends(get_db)):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    fmt = IMPORT_FORMATS.get(content_type)
+    if fmt is None:
+        raise HTTPException(
+            status_code=415,
+            detail="Content-Type must be application/x-ndjson or text/csv",
         )
+    result = ImportResult(imported=0, invalid=0, errors=[])
+
+    def validate(chunk):
+        errors = {}
+        preferences = {}
+        for line, row in chunk:
+            if isinstance(row, ValueError):
+                errors[line] = describe(row)
+                continue
+            try:
+                preferences[line] = PreferencesImportRow.model_validate(row)
+            except ValidationError as e:
+                errors[line] = describe(e)
+        for line, error in zip(
+            list(preferences), normalize_import_rows(list(preferences.values()))
+        ):
+            if error is not None:
+                errors[line] = error
+        for line, _ in chunk:
+            if line in errors:
+                result.invalid += 1
+                if len(result.errors) < settings.preferences_import_max_errors:
+                    result.errors.append(ImportRowError(line=line, error=errors[line]))
+                continue
+            preference = preferences[line]
+            yield (line, *(getattr(preference, name) for name in COLUMNS))
+
+    async def records():
+        # Rows are validated as the body streams in and handed to COPY a chunk
+        # at a time, once the chunk's recipients are normalized together
+        chunk = []
+        async for line, row in read_rows(request.stream(), fmt):
+            chunk.append((line, row))
+            if len(chunk) == settings.preferences_import_chunk_size:
+                for record in validate(chunk):
+                    yield record
+                chunk = []
+        for record in validate(chunk):
+            yield record
+
+    result.imported = await load_preferences(db, records())
+    logger.info(
+        "Imported preferences for %d users, %d invalid rows",
+        result.imported,
+        result.invalid,
+    )
+    return result
+
+
+@router.get("/export")
+async def export_preferences(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$")
+):
+    return StreamingResponse(dump_preferences(fmt), media_type=EXPORT_MEDIA_TYPES[fmt])
+
+
+@router.get("/{user_id}", response_model=Preferences)
+async def get_preferences(user_id: str, db: AsyncSession = Depends(get_db)):
+    preference = await preferences_cache.get(db, user_id)
+    if not preference:
+        logger.warning("Preferences not found for user_id: %s", user_id)
         raise HTTPException(status_code=404, detail="User preferences not found")
-    return PreferencesPayload(
+    return Preferences(
         email_enabled=preference.email_enabled,
         sms_enabled=preference.sms_enabled,
         email=preference.email if preference.email else None,  # Handle optional email
         phone_number=(
             preference.phone_number if preference.phone_number else None
         ),  # Handle optional phone number
+        timezone=preference.timezone,
+        quiet_hours_start=preference.quiet_hours_start,
+        quiet_hours_end=preference.quiet_hours_end,
+        max_per_window=preference.max_per_window,
+        frequency_window_seconds=preference.frequency_window_seconds,
+        digest_on_overflow=preference.digest_on_overflow,
     )
 
 
-@router.post("/{user_id}", response_model=PreferencesPayload)
+@router.post("/{user_id}", response_model=Preferences)
 async def create_or_replace_preferences(
     user_id: str, payload: PreferencesPayload, db: AsyncSession = Depends(get_db)
 ):
+    # One atomic statement: concurrent writes for a new user cannot race into
+    # a unique violation on user_id. Omitted email and phone_number values
+    # (NULL) keep the stored ones, which allows partial updates.
+    values = payload.model_dump()
+    values["email"] = payload.email or None
+    values["phone_number"] = payload.phone_number or None
     result = await db.execute(
-        select(UserPreference).where(UserPreference.user_id == user_id)
-    )
-    existing = result.scalar_one_or_none()
-
-    if existing:
-        # Overwrite
-        existing.email_enabled = payload.email_enabled
-        existing.sms_enabled = payload.sms_enabled
-        # Note: existing values for email and phone_number will be retained if not provided in payload
-        # This allows for partial updates where only some fields are updated
-        existing.email = payload.email if payload.email else existing.email
-        existing.phone_number = (
-            payload.phone_number if payload.phone_number else existing.phone_number
-        )
-    else:
-        # Create new
-        preference = UserPreference(
-            user_id=user_id,
-            email_enabled=payload.email_enabled,
-            sms_enabled=payload.sms_enabled,
-            # Note: email and phone_number can be None if not provided in the payload
-            # This allows for flexibility in creating a new user preference without requiring all fields
-            email=payload.email if payload.email else None,  # Handle optional email
-            phone_number=(
-                payload.phone_number if payload.phone_number else None
-            ),  # Handle optional phone number
+        upsert(insert(UserPreference).values(user_id=user_id, **values)).returning(
+            *(getattr(UserPreference, field) for field in Preferences.model_fields)
         )
-        db.add(preference)
+    )
+    stored = result.one()
 
     await db.commit()
-    return payload
+    await preferences_cache.invalidate(user_id)
+    return Preferences.model_validate(stored, from_attributes=True)
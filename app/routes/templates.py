@@ -0,0 +1,111 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field, field_validator
+from sqlalchemy import func, insert, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.db import get_db
+from app.models import MessageTemplate
+from app.templates import TemplateError, compile_text
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+class TemplatePayload(BaseModel):
+    subject: str = Field(min_length=1)
+    body: str = Field(min_length=1)
+
+    @field_validator("subject", "body")
+    @classmethod
+    def check_placeholders(cls, text: str) -> str:
+        try:
+            compile_text(text)
+        except TemplateError as e:
+            raise ValueError(str(e)) from e
+        return text
+
+
+class TemplateResponse(BaseModel):
+    id: str
+    version: int
+    subject: str
+    body: str
+    variables: list[str]
+    created_at: Optional[datetime] = None
+
+
+def to_response(template: MessageTemplate) -> TemplateResponse:
+    variables = {
+        name
+        for _, name in compile_text(template.subject) + compile_text(template.body)
+        if name is not None
+    }
+    return TemplateResponse(
+        id=template.id,
+        version=template.version,
+        subject=template.subject,
+        body=template.body,
+        variables=sorted(variables),
+        created_at=template.created_at,
+    )
+
+
+@router.post("/{template_id}", response_model=TemplateResponse)
+async def create_template_version(
+    template_id: str, payload: TemplatePayload, db: AsyncSession = Depends(get_db)
+):
+    # Existing versions are never changed: notifications already queued keep
+    # rendering the version they were created with
+    next_version = (
+        select(func.coalesce(func.max(MessageTemplate.version), 0) + 1)
+        .where(MessageTemplate.id == template_id)
+        .scalar_subquery()
+    )
+    try:
+        result = await db.execute(
+            insert(MessageTemplate)
+            .from_select(
+                ["id", "version", "subject", "body"],
+                select(
+                    literal(template_id),
+                    next_version,
+                    literal(payload.subject),
+                    literal(payload.body),
+                ),
+            )
+            .returning(MessageTemplate)
+        )
+        template = result.scalar_one()
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="Another version of this template was created concurrently",
+        ) from e
+
+    logger.info("Created template %s version %s", template_id, template.version)
+    return to_response(template)
+
+
+@router.get("/{template_id}", response_model=TemplateResponse)
+async def get_template(
+    template_id: str,
+    version: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    query = select(MessageTemplate).where(MessageTemplate.id == template_id)
+    if version is not None:
+        query = query.where(MessageTemplate.version == version)
+    result = await db.execute(query.order_by(MessageTemplate.version.desc()).limit(1))
+    template = result.scalar_one_or_none()
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return to_response(template)
@@ -0,0 +1,274 @@
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import time as clock_time
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from app.cache import CachedPreference, preferences_cache
+from app.config import settings
+from app.models import Notification
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 24 * 3600
+
+# Drops the sends that left the window, then admits as many of the new ones
+# (ARGV[4:]) as the limit allows. Returns how many were admitted and the
+# time of the oldest send still in the window.
+ADMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local admitted = 0
+for i = 4, #ARGV do
+    if count + admitted >= limit then
+        break
+    end
+    redis.call('ZADD', KEYS[1], now, ARGV[i])
+    admitted = admitted + 1
+end
+redis.call('PEXPIRE', KEYS[1], window)
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {admitted, oldest[2] or tostring(now)}
+"""
+
+
+class QuietHoursError(Exception):
+    """Raised instead of sending during the user's quiet hours."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Quiet hours")
+        self.retry_after = retry_after
+
+
+class FrequencyCapError(Exception):
+    """Raised instead of sending once the user's frequency cap is reached."""
+
+    def __init__(
+        self, limit: int, window_seconds: int, retry_after: float, digest: bool
+    ):
+        super().__init__(f"Frequency cap of {limit} per {window_seconds}s reached")
+        self.retry_after = retry_after
+        self.digest = digest
+
+
+@dataclass(frozen=True)
+class DeliveryRules:
+    """A user's quiet hours and frequency cap, parsed once, cheap to check."""
+
+    timezone: ZoneInfo
+    quiet_start: Optional[int]  # seconds after local midnight
+    quiet_end: Optional[int]
+    max_per_window: Optional[int]
+    window_seconds: Optional[int]
+    digest_on_overflow: bool
+
+    def quiet_for(self, now: datetime) -> float:
+        """Seconds until the quiet hours around `now` end, 0 outside them."""
+        if self.quiet_start is None:
+            return 0.0
+        local = now.astimezone(self.timezone)
+        second = (
+            local.hour * 3600
+            + local.minute * 60
+            + local.second
+            + local.microsecond / 1e6
+        )
+        if self.quiet_start <= self.quiet_end:
+            quiet = self.quiet_start <= second < self.quiet_end
+        else:  # spans midnight, e.g. 22:00 to 07:00
+            quiet = second >= self.quiet_start or second < self.quiet_end
+        return (self.quiet_end - second) % DAY_SECONDS if quiet else 0.0
+
+
+def seconds_of_day(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    parsed = clock_time.fromisoformat(value)
+    return parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+
+@lru_cache(maxsize=1024)
+def compile_rules(  # pylint: disable=too-many-arguments
+    timezone: Optional[str],
+    quiet_hours_start: Optional[str],
+    quiet_hours_end: Optional[str],
+    max_per_window: Optional[int],
+    frequency_window_seconds: Optional[int],
+    digest_on_overflow: bool,
+) -> Optional[DeliveryRules]:
+    """Compile a rule set, or return None when it restricts nothing.
+
+    Many users share the same rules, so compiled rules are cached by value.
+    """
+    has_quiet_hours = quiet_hours_start is not None and quiet_hours_end is not None
+    has_cap = max_per_window is not None and frequency_window_seconds is not None
+    if not has_quiet_hours and not has_cap:
+        return None
+    return DeliveryRules(
+        timezone=ZoneInfo(timezone or "UTC"),
+        quiet_start=seconds_of_day(quiet_hours_start) if has_quiet_hours else None,
+        quiet_end=seconds_of_day(quiet_hours_end) if has_quiet_hours else None,
+        max_per_window=max_per_window if has_cap else None,
+        window_seconds=frequency_window_seconds if has_cap else None,
+        digest_on_overflow=digest_on_overflow,
+    )
+
+
+def rules_for(preference: CachedPreference) -> Optional[DeliveryRules]:
+    return compile_rules(
+        preference.timezone,
+        preference.quiet_hours_start,
+        preference.quiet_hours_end,
+        preference.max_per_window,
+        preference.frequency_window_seconds,
+        preference.digest_on_overflow,
+    )
+
+
+async def load_rules(db, notifications) -> dict[str, DeliveryRules]:
+    """Return the rules of the batch's users that have any.
+
+    Preferences come from the preferences cache, so a warm worker checks
+    rules without a query.
+    """
+    preferences = await preferences_cache.get_many(
+        db, {notification.user_id for notification in notifications}
+    )
+    rules = {}
+    for user_id, preference in preferences.items():
+        compiled = rules_for(preference)
+        if compiled is not None:
+            rules[user_id] = compiled
+    return rules
+
+
+class FrequencyWindows:
+    """Sliding-window send counters, one per user and channel.
+
+    With `redis_url` the windows are shared by every worker process, as
+    sorted sets of send times; without it each process keeps its own.
+    Redis errors let sends through.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self._redis = redis.from_url(redis_url) if redis_url else None
+        self._script = (
+            self._redis.register_script(ADMIT_SCRIPT) if self._redis else None
+        )
+        self._local = {}  # key -> deque of send times
+
+    @staticmethod
+    def key(user_id: str, channel: str) -> str:
+        return f"frequency:{user_id}:{channel}"
+
+    async def admit_many(
+        self, requests: list[tuple[str, int, int, list[str]]]
+    ) -> list[tuple[int, float]]:
+        """Admit sends into windows, in one round trip for the whole batch.
+
+        `requests` holds (key, limit, window_seconds, send ids). Returns, for
+        each, how many of its sends fit, in order, and the seconds until the
+        window has room again.
+        """
+        now = time.time()
+        if self._redis is None:
+            return [self._admit_local(now, *request) for request in requests]
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key, limit, window_seconds, send_ids in requests:
+                    await self._script(
+                        keys=[key],
+                        args=[int(now * 1000), window_seconds * 1000, limit, *send_ids],
+                        client=pipe,
+                    )
+                replies = await pipe.execute()
+        except RedisError as e:
+            logger.warning("Frequency windows unavailable: %s", e)
+            return [(len(send_ids), 0.0) for _, _, _, send_ids in requests]
+        return [
+            (
+                int(admitted),
+                max(0.0, float(oldest) / 1000 + window_seconds - now),
+            )
+            for (_, _, window_seconds, _), (admitted, oldest) in zip(requests, replies)
+        ]
+
+    def _admit_local(self, now, key, limit, window_seconds, send_ids):
+        sends = self._local.setdefault(key, deque())
+        while sends and sends[0] <= now - window_seconds:
+            sends.popleft()
+        admitted = max(0, min(len(send_ids), limit - len(sends)))
+        sends.extend([now] * admitted)
+        oldest = sends[0] if sends else now
+        return admitted, max(0.0, oldest + window_seconds - now)
+
+
+_windows = None
+
+
+def get_windows() -> FrequencyWindows:
+    """Return this process's frequency windows, creating them on first use."""
+    global _windows  # pylint: disable=global-statement
+    if _windows is None:
+        _windows = FrequencyWindows(redis_url=settings.rules_redis_url)
+    return _windows
+
+
+async def check_rules(
+    notifications: list[Notification], rules: dict[str, DeliveryRules], now: datetime
+) -> dict[int, Exception]:
+    """Return why each notification that may not be sent now is held back.
+
+    Quiet hours are checked in memory. Frequency caps count the rest in the
+    sliding windows, a batch's sends per user and channel admitted at once,
+    earliest ids first.
+    """
+    held = {}
+    capped = {}
+    for notification in notifications:
+        user_rules = rules.get(notification.user_id)
+        if user_rules is None:
+            continue
+        quiet_for = user_rules.quiet_for(now)
+        if quiet_for:
+            held[notification.id] = QuietHoursError(quiet_for)
+        elif user_rules.max_per_window is not None:
+            capped.setdefault((notification.user_id, notification.channel), []).append(
+                notification.id
+            )
+    if not capped:
+        return held
+
+    groups = [
+        (user_id, channel, sorted(ids)) for (user_id, channel), ids in capped.items()
+    ]
+    requests = [
+        (
+            FrequencyWindows.key(user_id, channel),
+            rules[user_id].max_per_window,
+            rules[user_id].window_seconds,
+            [str(notification_id) for notification_id in ids],
+        )
+        for user_id, channel, ids in groups
+    ]
+    results = await get_windows().admit_many(requests)
+    for (user_id, _, ids), (admitted, retry_after) in zip(groups, results):
+        user_rules = rules[user_id]
+        for notification_id in ids[admitted:]:
+            held[notification_id] = FrequencyCapError(
+                user_rules.max_per_window,
+                user_rules.window_seconds,
+                retry_after,
+                digest=user_rules.digest_on_overflow,
+            )
+    return held
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from sqlalchemy import case, func, insert, update
+from sqlalchemy.future import select
+
+from app.celery_worker import queue_name
+from app.config import settings
+from app.db import AsyncSessionLocal
+from app.models import Notification, NotificationStatus, OutboxMessage
+from app.outbox import batch_messages
+from app.retry import RETRY_POLICIES
+from app.tasks.notification_tasks import send_notification_batch
+from app.utils.logger import setup_logger
+
+logger = logging.getLogger(__name__)
+
+
+async def claim_due(session, condition, order_by, limit: int, **values):
+    """Move up to `limit` rows matching `condition` to queued.
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so several schedulers can
+    poll concurrently without enqueueing the same notification twice. Each
+    gets a lease: if no worker has claimed it within QUEUE_LEASE_SECONDS,
+    its task message is assumed lost and it is queued again. `values` sets
+    other columns as well.
+    """
+    due = (
+        select(Notification.id)
+        .where(condition)
+        .order_by(order_by)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(Notification)
+        .where(Notification.id.in_(due.scalar_subquery()))
+        .values(
+            status=NotificationStatus.queued,
+            next_attempt_at=func.now()
+            + timedelta(seconds=settings.queue_lease_seconds),
+            **values,
+        )
+        .returning(
+            Notification.id,
+            Notification.channel,
+            Notification.priority,
+            Notification.send_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.all()
+
+
+def dead_letter_expired():
+    """Build the UPDATE that dead-letters rows whose last attempt never ended.
+
+    These are claimed rows whose lease expired on their channel's final
+    attempt, most likely because sending them kills the worker.
+    """
+    return (
+        update(Notification)
+        .where(
+            Notification.status == NotificationStatus.sending,
+            Notification.next_attempt_at <= func.now(),
+            Notification.attempts + 1
+            >= case(
+                {
+                    channel: policy.max_attempts
+                    for channel, policy in RETRY_POLICIES.items()
+                },
+                value=Notification.channel,
+            ),
+        )
+        .values(
+            status=NotificationStatus.dead,
+            attempts=Notification.attempts + 1,
+            next_attempt_at=None,
+            last_error="Lease expired while sending",
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def enqueue_due_notifications(session, limit: int) -> int:
+    """Claim up to `limit` due notifications and queue them in the outbox.
+
+    Scheduled notifications come first, then retries whose backoff has
+    elapsed, then notifications held by a frequency cap that has room again,
+    then queued or claimed notifications whose lease expired: their task
+    message was lost or their worker died. Those that were claimed count an
+    attempt, so one that keeps killing its worker is dead-lettered in the
+    end. The claims and the outbox messages commit together.
+    """
+    claimed = await claim_due(
+        session,
+        (Notification.status == NotificationStatus.pending)
+        & (Notification.send_at <= func.now()),
+        Notification.send_at,
+        limit,
+    )
+    if len(claimed) < limit:
+        claimed += await claim_due(
+            session,
+            (Notification.status == NotificationStatus.retrying)
+            & (Notification.next_attempt_at <= func.now()),
+            Notification.next_attempt_at,
+            limit - len(claimed),
+        )
+    if len(claimed) < limit:
+        claimed += await claim_due(
+            session,
+            (Notification.status == NotificationStatus.held)
+            & (Notification.next_attempt_at <= func.now()),
+            Notification.next_attempt_at,
+            limit - len(claimed),
+        )
+    if len(claimed) < limit:
+        result = await session.execute(dead_letter_expired())
+        if result.rowcount:
+            logger.error(
+                "Leases expired on the last attempt, %s notifications are dead",
+                result.rowcount,
+            )
+        expired = await claim_due(
+            session,
+            Notification.status.in_(
+                [NotificationStatus.queued, NotificationStatus.sending]
+            )
+            & (Notification.next_attempt_at <= func.now()),
+            Notification.next_attempt_at,
+            limit - len(claimed),
+            attempts=case(
+                (
+                    Notification.status == NotificationStatus.sending,
+                    Notification.attempts + 1,
+                ),
+                else_=Notification.attempts,
+            ),
+        )
+        if expired:
+            logger.warning(
+                "Leases expired, queueing %s notifications again", len(expired)
+            )
+        claimed += expired
+
+    if claimed:
+        await session.execute(
+            insert(OutboxMessage),
+            batch_messages(
+                send_notification_batch.name,
+                [
+                    (notification_id, queue_name(channel, priority), send_at)
+                    for notification_id, channel, priority, send_at in claimed
+                ],
+                settings.task_max_ids,
+            ),
+        )
+    await session.commit()
+    return len(claimed)
+
+
+async def run_scheduler():
+    logger.info(
+        "Scheduler started (batch size %s, poll interval %ss)",
+        settings.scheduler_batch_size,
+        settings.scheduler_poll_interval,
+    )
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                count = await enqueue_due_notifications(
+                    session, settings.scheduler_batch_size
+                )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Error while enqueueing due notifications: %s", e)
+            count = 0
+
+        if count:
+            logger.info("Enqueued %s due notifications and retries", count)
+        # Keep draining while there is a backlog, otherwise wait for the next poll
+        if count < settings.scheduler_batch_size:
+            await asyncio.sleep(settings.scheduler_poll_interval)
+
+
+if __name__ == "__main__":
+    setup_logger()
+    asyncio.run(run_scheduler())
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+from functools import lru_cache
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from app.db import engine
+from app.partitions import ensure_partitions
+from app.utils.logger import setup_logger
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(__file__)), "alembic.ini")
+
+
+class SchemaVersionError(RuntimeError):
+    pass
+
+
+def alembic_config() -> Config:
+    config = Config(ALEMBIC_INI)
+    config.set_main_option(
+        "script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations")
+    )
+    return config
+
+
+@lru_cache
+def head_revision() -> str:
+    """The newest migration shipped with this build, read from disk."""
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+async def check_schema_version(conn):
+    """Fail fast unless the database is migrated to this build's head.
+
+    This is a single-row read, so replicas can call it on every start.
+    """
+    try:
+        result = await conn.execute(text("SELECT version_num FROM alembic_version"))
+        current = result.scalar_one_or_none()
+    except ProgrammingError:
+        current = None
+    if current != head_revision():
+        raise SchemaVersionError(
+            f"Database schema is at revision {current}, expected {head_revision()}."
+            " Run `python -m app.schema` to migrate."
+        )
+
+
+async def create_partitions():
+    async with engine.begin() as conn:
+        created = await ensure_partitions(conn)
+    await engine.dispose()
+    if created:
+        logger.info("Created partitions %s", ", ".join(created))
+
+
+def migrate():
+    """Upgrade to the latest revision and create the upcoming partitions."""
+    command.upgrade(alembic_config(), "head")
+    asyncio.run(create_partitions())
+
+
+if __name__ == "__main__":
+    setup_logger()
+    migrate()
@@ -1,40 +1,47 @@
-import nest_asyncio
-
-nest_asyncio.apply()
-
 import asyncio
 import logging
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 from celery import shared_task
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.future import select
+from celery_batches import Batches
+from sqlalchemy import case, func, literal, update
 
-from app.db import AsyncSessionLocal
+from app.config import settings
+from app.db import in_array, in_range
+from app.digest import claim_companions, coalesce
+from app.metrics import SEND_LATENCY_BY_CHANNEL, record_notification
 from app.models import Notification, NotificationStatus
 from app.notifiers.email_notifier import EmailNotifier
 from app.notifiers.sms_notifier import SMSNotifier
+from app.outbox import expand_id_ranges, send_at_range
+from app.resilience import CircuitOpenError, get_breaker, get_limiter
+from app.retry import RETRY_POLICIES, interrupted_state, next_state
+from app.rules import check_rules, load_rules
+from app.tasks.runtime import runtime
+from app.templates import render_notifications
 
 logger = logging.getLogger(__name__)
 
 
 def mock_send_email(user_id: str, email: str, subject: str, body: str):
     logger.info(
-        "[MOCK EMAIL] To: %s | Email: %s | Subject: %s | Body: %s",
+        "[MOCK EMAIL] To: %s | Email: %s | Subject: %s | Body: %s chars",
         user_id,
         email,
         subject,
-        body,
+        len(body),
     )
     return True
 
 
 def mock_send_sms(user_id: str, phone_number: str, message: str):
     logger.info(
-        "[MOCK SMS] To: %s | Phone number: %s | Message: %s",
+        "[MOCK SMS] To: %s | Phone number: %s | Message: %s chars",
         user_id,
         phone_number,
-        message,
+        len(message),
     )
     return True
 
@@ -43,7 +50,7 @@ def mock_send_sms(user_id: str, phone_number: str, message: str):
 def send_email_task(
     user_id: str, subject: str, message: str, recipient: str, notification_id: int
 ):
-    asyncio.run(
+    runtime.run(
         process_notification(
             notification_id, user_id, subject, message, "email", recipient
         )
@@ -54,57 +61,339 @@ def send_email_task(
 def send_sms_task(
     user_id: str, subject: str, message: str, recipient: str, notification_id: int
 ):
-    asyncio.run(
+    runtime.run(
         process_notification(
             notification_id, user_id, subject, message, "sms", recipient
         )
     )
 
 
-async def process_notification(
+@shared_task(
+    name="app.tasks.send_notification_batch",
+    base=Batches,
+    flush_every=settings.batch_flush_every,
+    flush_interval=settings.batch_flush_interval_ms / 1000,
+)
+def send_notification_batch(requests):
+    # Buffered by celery-batches: runs once per flush_every messages or
+    # flush_interval, whichever comes first
+    notification_ids = []
+    for request in requests:
+        if "ids" in request.kwargs:
+            notification_ids += expand_id_ranges(request.kwargs["ids"])
+        else:  # one id per message, as queued by earlier releases
+            notification_ids.append(request.kwargs["notification_id"])
+    send_ats = send_at_range(request.kwargs for request in requests)
+    for start in range(0, len(notification_ids), settings.batch_flush_every):
+        runtime.run(
+            process_notification_batch(
+                notification_ids[start : start + settings.batch_flush_every],
+                send_ats,
+            )
+        )
+
+
+def build_notifier(channel, user_id, recipient, subject, message):
+    if channel == "email":
+        return EmailNotifier(user_id, recipient, subject, message)
+    return SMSNotifier(user_id, recipient, subject, message)
+
+
+def claim_notifications(notification_ids, send_ats=None):
+    """Build the UPDATE that moves queued notifications to `sending`.
+
+    It returns only the rows this worker won, so a redelivered task or a
+    row that is already sent is skipped without sending twice. The claim is
+    a lease: if the worker dies before recording the outcome, the scheduler
+    queues the row again once SEND_LEASE_SECONDS have passed. `send_ats`,
+    the range of the rows' send_at, limits it to their partitions.
+    """
+    statement = update(Notification).where(
+        in_array(Notification.id, notification_ids),
+        Notification.status == NotificationStatus.queued,
+    )
+    if send_ats:
+        statement = statement.where(in_range(Notification.send_at, send_ats))
+    return (
+        statement.values(
+            status=NotificationStatus.sending,
+            next_attempt_at=func.now() + timedelta(seconds=settings.send_lease_seconds),
+        )
+        .returning(Notification)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def process_notification(  # pylint: disable=unused-argument
     notification_id, user_id, subject, message, channel, recipient
 ):
-    async with AsyncSessionLocal() as session:
+    async with runtime.session_factory() as session:
+        # Commit the claim before sending, so no transaction stays open while
+        # the provider is called
+        result = await session.execute(claim_notifications([notification_id]))
+        notification = result.scalar_one_or_none()
+        if not notification:
+            await session.commit()
+            logger.info(
+                "Notification %s already claimed or not found, skipping",
+                notification_id,
+            )
+            return
+        contents = await render_notifications(session, [notification])
+        rules = await load_rules(session, [notification])
+        await session.commit()
+
         try:
-            result = await session.execute(
-                select(Notification).where(Notification.id == notification_id)
+            (error,) = await deliver_all([notification], contents, rules)
+
+            # Record the attempt: sent, scheduled for a retry, failed or dead
+            state = next_state(notification, error, datetime.now(timezone.utc))
+            await session.execute(
+                update_states([notification], {notification.id: state})
             )
-            notification = result.scalar_one_or_none()
-            if not notification:
-                logger.error(
-                    "Notification %s not found", notification_id
+            await session.commit()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            await release_claims(session, [notification], e)
+            return
+        record_notification(
+            channel, state["status"], notification.send_at, state["sent_at"]
+        )
+        logger.info(
+            "%s notification %s: %s",
+            channel.upper(),
+            notification_id,
+            state["status"].name,
+        )
+
+
+def is_provider_failure(channel: str, error: Optional[Exception]) -> bool:
+    """Whether `error` says the provider is struggling, not the notification."""
+    return error is not None and RETRY_POLICIES[channel].is_retryable(error)
+
+
+async def deliver(
+    notification: Notification, subject: str, message: str
+) -> Optional[Exception]:
+    """Send one loaded notification, returning the error if it failed."""
+    notifier = build_notifier(
+        notification.channel,
+        notification.user_id,
+        notification.recipient,
+        subject,
+        message,
+    )
+    try:
+        if not notifier.validate_recipient():
+            raise ValueError(f"Invalid recipient for {notification.channel.upper()}")
+        limiter = get_limiter(notification.channel)
+        async with limiter:
+            started = time.perf_counter()
+            try:
+                await notifier.asend()
+            except Exception as e:
+                limiter.record(
+                    started, overloaded=is_provider_failure(notification.channel, e)
                 )
-                return
+                raise
+            limiter.record(started)
+        SEND_LATENCY_BY_CHANNEL[notification.channel].observe(
+            time.perf_counter() - started
+        )
+        return None
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.error(
+            "Error while sending %s notification %s: %s",
+            notification.channel.upper(),
+            notification.id,
+            e,
+        )
+        return e
 
-            # Use the appropriate Notifier implementation
-            notifier = (
-                EmailNotifier(user_id, recipient, subject, message)
-                if channel == "email"
-                else SMSNotifier(user_id, recipient, subject, message)
+
+async def deliver_all(notifications, contents, rules=None) -> list[Optional[Exception]]:
+    """Send notifications concurrently, each channel behind its circuit breaker.
+
+    `contents` maps ids to the rendered (subject, message), or to the error
+    that kept a notification from being rendered. Notifications of a channel
+    whose circuit is open are not sent and get a CircuitOpenError instead.
+    Those held back by their user's `rules` get a QuietHoursError or a
+    FrequencyCapError. The provider failures of the others are reported to
+    the breaker, once per channel.
+    """
+    blocked = {}
+    for channel in {notification.channel for notification in notifications}:
+        breaker = get_breaker(channel)
+        if not await breaker.allow():
+            blocked[channel] = CircuitOpenError(channel, breaker.open_seconds)
+    if blocked:
+        logger.warning("Circuit open, not sending %s", sorted(blocked))
+    held = {}
+    if rules:
+        held = await check_rules(
+            [
+                notification
+                for notification in notifications
+                if notification.channel not in blocked
+                and not isinstance(contents[notification.id], Exception)
+            ],
+            rules,
+            datetime.now(timezone.utc),
+        )
+
+    async def attempt(notification):
+        if notification.channel in blocked:
+            return blocked[notification.channel]
+        if notification.id in held:
+            return held[notification.id]
+        content = contents[notification.id]
+        if isinstance(content, Exception):
+            logger.error(
+                "Error while rendering notification %s: %s", notification.id, content
             )
+            return content
+        return await deliver(notification, *content)
 
-            # Validate and send
-            if notifier.validate_recipient():
-                notifier.send()
-            else:
-                raise ValueError(f"Invalid recipient for {channel.upper()}")
+    errors = await asyncio.gather(*(attempt(n) for n in notifications))
 
-            # Update status and sent_at
-            notification.status = NotificationStatus.sent
-            notification.sent_at = datetime.now(timezone.utc)
-            await session.commit()
+    outcomes = {}
+    for notification, error in zip(notifications, errors):
+        if notification.channel in blocked:
+            continue
+        successes, failures = outcomes.get(notification.channel, (0, 0))
+        if error is None:
+            successes += 1
+        elif is_provider_failure(notification.channel, error):
+            failures += 1
+        outcomes[notification.channel] = (successes, failures)
+    for channel, (successes, failures) in outcomes.items():
+        await get_breaker(channel).record(successes, failures)
+    return list(errors)
+
+
+def per_notification(column, values: dict):
+    """CASE expression setting `column` to a different value for each id."""
+    return case(
+        {
+            notification_id: literal(value, column.type)
+            for notification_id, value in values.items()
+        },
+        value=Notification.id,
+        else_=column,
+    )
+
+
+def update_states(notifications, states: dict[int, dict]):
+    """Build the single UPDATE writing each notification's new column values."""
+    return (
+        update(Notification)
+        .where(
+            in_array(Notification.id, list(states)),
+            in_range(
+                Notification.send_at,
+                (notification.send_at for notification in notifications),
+            ),
+        )
+        .values(
+            {
+                column: per_notification(
+                    getattr(Notification, column),
+                    {
+                        notification_id: state[column]
+                        for notification_id, state in states.items()
+                    },
+                )
+                for column in next(iter(states.values()))
+            }
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def release_claims(session, notifications, error: Exception):
+    """Schedule claimed notifications for a retry after an unexpected error.
+
+    If this fails too, the claims' leases expire and the scheduler queues
+    the notifications again.
+    """
+    logger.exception(
+        "Error while processing notifications %s, retrying them",
+        [notification.id for notification in notifications],
+    )
+    now = datetime.now(timezone.utc)
+    states = {
+        notification.id: interrupted_state(notification, error, now)
+        for notification in notifications
+    }
+    await session.rollback()
+    await session.execute(update_states(notifications, states))
+    await session.commit()
+
+
+async def process_notification_batch(notification_ids, send_ats=None):
+    async with runtime.session_factory() as session:
+        # Claim and load the whole batch in one statement, and the templates
+        # it uses in one more, before the claim is committed
+        result = await session.execute(claim_notifications(notification_ids, send_ats))
+        notifications = list(result.scalars().all())
+        if len(notifications) < len(set(notification_ids)):
+            claimed = {notification.id for notification in notifications}
             logger.info(
-                "%s notification sent successfully", channel.upper()
+                "Notifications %s already claimed or not found, skipping",
+                sorted(set(notification_ids) - claimed),
             )
-        except SQLAlchemyError as e:
-            logger.error(
-                "Database error while sending %s notification: %s", channel.upper(), e
+        if not notifications:
+            await session.commit()
+            return
+        if settings.digest_max_items > 1:
+            # Claim the other notifications of the batch's users that are due
+            # or held, so each user gets one digest per channel
+            result = await session.execute(
+                claim_companions(
+                    notifications,
+                    datetime.now(timezone.utc),
+                    settings.digest_window_seconds,
+                    settings.digest_lookback_seconds,
+                )
             )
-            notification.status = NotificationStatus.failed
+            notifications += result.scalars().all()
+        contents = await render_notifications(session, notifications)
+        rules = await load_rules(session, notifications)
+        await session.commit()
+
+        try:
+            # Dispatch concurrently through the notifiers, one send per digest
+            leads, members = coalesce(
+                notifications, contents, settings.digest_max_items
+            )
+            if len(leads) < len(notifications):
+                logger.info(
+                    "Coalesced %d notifications into %d sends",
+                    len(notifications),
+                    len(leads),
+                )
+            errors = await deliver_all(leads, contents, rules)
+
+            # Write every notification's outcome, its digest's, in one UPDATE
+            now = datetime.now(timezone.utc)
+            states = {
+                member.id: next_state(member, error, now)
+                for lead, error in zip(leads, errors)
+                for member in members[lead.id]
+            }
+            await session.execute(update_states(notifications, states))
             await session.commit()
         except Exception as e:  # pylint: disable=broad-exception-caught
-            logger.error(
-                "Unexpected error while sending %s notification: %s", channel.upper(), e
+            await release_claims(session, notifications, e)
+            return
+
+        counts = {}
+        for notification in notifications:
+            state = states[notification.id]
+            record_notification(
+                notification.channel,
+                state["status"],
+                notification.send_at,
+                state["sent_at"],
             )
-            notification.status = NotificationStatus.failed
-            await session.commit()
+            counts[state["status"].name] = counts.get(state["status"].name, 0) + 1
+        logger.info("Notification batch processed: %s", counts)
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from prometheus_client import multiprocess
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.config import settings
+from app.db import DATABASE_URL
+from app.metrics import instrument_engine, start_metrics_server
+from app.notifiers.email_notifier import close_smtp_pool
+from app.notifiers.sms_notifier import close_sms_client
+from app.utils.logger import stop_logger
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerRuntime:
+    """Long-lived event loop and database pool for one worker process.
+
+    Tasks run their coroutines on the same loop, so pooled asyncpg
+    connections stay bound to a loop that outlives any single task.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.engine = None
+        self.session_factory = None
+
+    @property
+    def started(self) -> bool:
+        return self.loop is not None
+
+    def start(self):
+        if self.started:
+            return
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.engine = create_async_engine(
+            DATABASE_URL,
+            echo=settings.sql_echo,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_pre_ping=True,
+        )
+        instrument_engine(self.engine)
+        self.session_factory = async_sessionmaker(
+            bind=self.engine, expire_on_commit=False
+        )
+        logger.info("Worker runtime started")
+
+    def stop(self):
+        if not self.started:
+            return
+        self.loop.run_until_complete(close_smtp_pool())
+        self.loop.run_until_complete(close_sms_client())
+        self.loop.run_until_complete(self.engine.dispose())
+        self.loop.close()
+        self.loop = None
+        self.engine = None
+        self.session_factory = None
+        logger.info("Worker runtime stopped")
+
+    def run(self, coro):
+        """Run a coroutine to completion on the worker's event loop."""
+        self.start()
+        return self.loop.run_until_complete(coro)
+
+
+runtime = WorkerRuntime()
+
+
+@worker_init.connect
+def start_worker_metrics(**kwargs):  # pylint: disable=unused-argument
+    # Runs once in the parent process. With PROMETHEUS_MULTIPROC_DIR set, the
+    # exporter aggregates the metrics written by every pool process.
+    start_metrics_server(settings.worker_metrics_port)
+    logger.info("Worker metrics exporter on port %s", settings.worker_metrics_port)
+
+
+@worker_process_init.connect
+def start_runtime(**kwargs):  # pylint: disable=unused-argument
+    runtime.start()
+
+
+@worker_process_shutdown.connect
+def stop_runtime(**kwargs):  # pylint: disable=unused-argument
+    runtime.stop()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+    # Pool processes may exit without running atexit hooks
+    stop_logger()
@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from string import Template
+from typing import Optional, Union
+
+from sqlalchemy import tuple_
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.models import MessageTemplate, Notification
+
+# A compiled text: literal chunks, each followed by the variable to insert
+# after it (None for the last chunk)
+Parts = tuple[tuple[str, Optional[str]], ...]
+
+
+class TemplateError(ValueError):
+    """A template cannot be compiled, or rendered with the given variables."""
+
+
+def compile_text(text: str) -> Parts:
+    """Split `text` into literal chunks and `$name`/`${name}` placeholders."""
+    parts = []
+    literal = []
+    position = 0
+    for match in Template.pattern.finditer(text):
+        literal.append(text[position : match.start()])
+        position = match.end()
+        if match["escaped"] is not None:
+            literal.append(Template.delimiter)
+        elif match["named"] or match["braced"]:
+            parts.append(("".join(literal), match["named"] or match["braced"]))
+            literal = []
+        else:
+            raise TemplateError(f"Invalid placeholder at position {match.start()}")
+    literal.append(text[position:])
+    parts.append(("".join(literal), None))
+    return tuple(parts)
+
+
+def render_parts(parts: Parts, variables: dict) -> str:
+    try:
+        return "".join(
+            literal if name is None else literal + str(variables[name])
+            for literal, name in parts
+        )
+    except KeyError as e:
+        raise TemplateError(f"Missing template variable {e}") from e
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """A template version parsed once, ready to render many times."""
+
+    id: str
+    version: int
+    subject: Parts
+    body: Parts
+
+    @classmethod
+    def from_model(cls, template: MessageTemplate) -> "CompiledTemplate":
+        return cls(
+            id=template.id,
+            version=template.version,
+            subject=compile_text(template.subject),
+            body=compile_text(template.body),
+        )
+
+    @property
+    def variables(self) -> set[str]:
+        return {name for _, name in self.subject + self.body if name is not None}
+
+    def missing(self, variables: dict) -> set[str]:
+        return self.variables - set(variables)
+
+    def render(self, variables: dict) -> tuple[str, str]:
+        """Return the rendered (subject, body)."""
+        return render_parts(self.subject, variables), render_parts(self.body, variables)
+
+
+class TemplateCache:
+    """In-process LRU of compiled templates keyed by (template_id, version).
+
+    Versions never change once created, so entries need no expiry.
+    """
+
+    def __init__(self, max_size: int = 1_000):
+        self.max_size = max_size
+        self._templates = OrderedDict()
+
+    def _set(self, template: CompiledTemplate):
+        key = (template.id, template.version)
+        self._templates[key] = template
+        self._templates.move_to_end(key)
+        while len(self._templates) > self.max_size:
+            self._templates.popitem(last=False)
+
+    async def get_many(self, db, keys) -> dict[tuple[str, int], CompiledTemplate]:
+        """Return compiled templates, loading the missing ones in one query."""
+        found = {}
+        missing = []
+        for key in set(keys):
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                found[key] = template
+            else:
+                missing.append(key)
+        if missing:
+            result = await db.execute(
+                select(MessageTemplate).where(
+                    tuple_(MessageTemplate.id, MessageTemplate.version).in_(missing)
+                )
+            )
+            for row in result.scalars().all():
+                template = CompiledTemplate.from_model(row)
+                self._set(template)
+                found[(template.id, template.version)] = template
+        return found
+
+    async def get(
+        self, db, template_id: str, version: Optional[int] = None
+    ) -> Optional[CompiledTemplate]:
+        """Return one version of a template, or its latest when `version` is None."""
+        if version is not None:
+            return (await self.get_many(db, [(template_id, version)])).get(
+                (template_id, version)
+            )
+        # The latest version can change, so it is always looked up
+        result = await db.execute(
+            select(MessageTemplate)
+            .where(MessageTemplate.id == template_id)
+            .order_by(MessageTemplate.version.desc())
+            .limit(1)
+        )
+        row = result.scalar_one_or_none()
+        if row is None:
+            return None
+        template = CompiledTemplate.from_model(row)
+        self._set(template)
+        return template
+
+    def clear(self):
+        self._templates.clear()
+
+
+template_cache = TemplateCache(max_size=settings.template_cache_size)
+
+
+async def render_notifications(
+    db, notifications: list[Notification]
+) -> dict[int, Union[tuple[str, str], TemplateError]]:
+    """Return each notification's (subject, message), or why it cannot be rendered."""
+    templates = await template_cache.get_many(
+        db,
+        [
+            (notification.template_id, notification.template_version)
+            for notification in notifications
+            if notification.template_id is not None
+        ],
+    )
+    contents = {}
+    for notification in notifications:
+        if notification.template_id is None:
+            contents[notification.id] = (notification.subject, notification.message)
+            continue
+        template = templates.get(
+            (notification.template_id, notification.template_version)
+        )
+        try:
+            if template is None:
+                raise TemplateError(
+                    f"Template {notification.template_id}"
+                    f" version {notification.template_version} not found"
+                )
+            contents[notification.id] = template.render(notification.variables or {})
+        except TemplateError as e:
+            contents[notification.id] = e
+    return contents
@@ -1,10 +1,166 @@
 # app/utils/logger.py
 
+import atexit
+import json
 import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app.config import settings
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+_queue_handler = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Sample and rate-limit records below WARNING, per logger.
+
+    Rules are keyed by logger name prefix ("app.notifiers" also covers
+    "app.notifiers.email_notifier") and the longest match wins. The first
+    record let through after some were dropped carries their count in
+    `record.suppressed`.
+    """
+
+    def __init__(
+        self,
+        sample_rates: dict[str, float],
+        rate_limits: dict[str, float],
+        clock=time.monotonic,
+    ):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}  # logger name -> (tokens, updated)
+        self._suppressed = {}  # logger name -> dropped since last record
+        self._rules = {}  # logger name -> (sample rate, rate limit)
+
+    @staticmethod
+    def _lookup(rules, name):
+        while name:
+            if name in rules:
+                return rules[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def _rules_for(self, name):
+        rules = self._rules.get(name)
+        if rules is None:
+            rules = (
+                self._lookup(self.sample_rates, name),
+                self._lookup(self.rate_limits, name),
+            )
+            self._rules[name] = rules
+        return rules
+
+    def _take_token(self, name, per_second):
+        now = self.clock()
+        tokens, updated = self._buckets.get(name, (per_second, now))
+        tokens = min(per_second, tokens + (now - updated) * per_second)
+        if tokens < 1:
+            self._buckets[name] = (tokens, now)
+            return False
+        self._buckets[name] = (tokens - 1, now)
+        return True
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        sample_rate, rate_limit = self._rules_for(record.name)
+        if sample_rate is None and rate_limit is None:
+            return True
+
+        with self._lock:
+            keep = sample_rate is None or random.random() < sample_rate
+            if keep and rate_limit is not None:
+                keep = self._take_token(record.name, rate_limit)
+            if not keep:
+                self._suppressed[record.name] = self._suppressed.get(record.name, 0) + 1
+                return False
+            record.suppressed = self._suppressed.pop(record.name, 0)
+        return True
+
+
+def build_formatter() -> logging.Formatter:
+    if settings.log_format == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def _start_listener():
+    global _listener  # pylint: disable=global-statement
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(build_formatter())
+    _listener = QueueListener(_queue_handler.queue, output)
+    _listener.start()
+
+
+def _restart_listener_after_fork():
+    # The listener thread does not survive fork (e.g. Celery prefork), so
+    # each child gets its own queue and thread
+    _queue_handler.queue = queue.SimpleQueue()
+    _start_listener()
+
+
+def stop_logger():
+    """Flush queued records and stop the listener thread."""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
 def setup_logger():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+    """Configure logging from settings.
+
+    Callers only enqueue records; a listener thread formats and writes them,
+    so request and task code never blocks on log I/O. Safe to call more than
+    once.
+    """
+    global _queue_handler  # pylint: disable=global-statement
+    if _queue_handler is not None:
+        return
+
+    _queue_handler = QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(
+        SamplingFilter(settings.log_sample_rates, settings.log_rate_limits)
     )
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.log_level.upper())
+    for name, level in settings.log_levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _start_listener()
+    atexit.register(stop_logger)
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
@@ -0,0 +1,185 @@
+"""Broker bytes and throughput per notification: JSON text messages vs. msgpack id ranges.
+
+Usage:
+    poetry run python -m benchmarks.bench_broker [--notifications N] [--broker-url URL]
+
+"before" publishes one JSON message per notification carrying its user id,
+recipient, subject and message, as `create_notification` used to. "after"
+publishes what the outbox holds now: one msgpack message per queue and
+TASK_MAX_IDS notification ids, sent as ranges with their send_at range.
+
+The default broker is kombu's in-memory transport. Message size is then the
+length of the JSON envelope that the Redis transport would store for each
+message. With a redis:// --broker-url, the used_memory growth of the Redis
+server is reported as well, and throughput includes the network round trips.
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from celery import Celery
+from kombu.serialization import prepare_accept_content
+
+from app.config import settings
+from app.outbox import batch_messages, expand_id_ranges
+from app.relay import compression_options
+from benchmarks.results import metric, write_results
+
+TASK_NAME = "app.tasks.send_notification_batch"
+SUBJECT = "New listings matching your saved search"
+MESSAGE = "Here are some new listings that match your preferences. " * 10
+ACCEPT = prepare_accept_content(["msgpack", "json"])
+SEND_AT = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def legacy_messages(count):
+    return [
+        (
+            "bench.before",
+            {
+                "user_id": f"user-{i}",
+                "subject": SUBJECT,
+                "message": MESSAGE,
+                "notification_id": i,
+                "recipient": f"user-{i}@example.com",
+            },
+            {},
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def id_messages(count):
+    return [
+        ("bench.after", message["kwargs"], compression_options(message["kwargs"]))
+        for message in batch_messages(
+            TASK_NAME,
+            [(i, "bench.after", SEND_AT) for i in range(1, count + 1)],
+            settings.task_max_ids,
+        )
+    ]
+
+
+def make_app(broker_url, serializer):
+    # Celery prefers CELERY_BROKER_URL and CELERY_RESULT_BACKEND, which
+    # .env.example sets, over its arguments. Only the broker is measured.
+    os.environ.pop("CELERY_BROKER_URL", None)
+    os.environ.pop("CELERY_RESULT_BACKEND", None)
+    app = Celery("bench_broker", broker=broker_url, backend="disabled://")
+    app.conf.task_serializer = serializer
+    app.conf.accept_content = ["msgpack", "json"]
+    return app
+
+
+def redis_used_memory(app):
+    with app.connection_for_write() as conn:
+        return conn.default_channel.client.info("memory")["used_memory"]
+
+
+def publish(app, messages):
+    started = time.perf_counter()
+    with app.producer_or_acquire() as producer:
+        for queue, kwargs, options in messages:
+            app.send_task(
+                TASK_NAME, kwargs=kwargs, queue=queue, producer=producer, **options
+            )
+    return time.perf_counter() - started
+
+
+def stored_bytes(app, queue, expected):
+    """Envelope bytes of every message in an in-memory queue, as Redis stores them."""
+    with app.connection_for_read() as conn:
+        channel = conn.default_channel
+        # pylint: disable=protected-access
+        payloads = [channel._get(queue) for _ in range(expected)]
+        total = sum(len(json.dumps(payload)) for payload in payloads)
+        for payload in payloads:
+            channel._put(queue, payload)
+    return total
+
+
+def consume(app, queue, expected):
+    """Drain `expected` messages, decoding them; return (seconds, notifications)."""
+    notifications = 0
+    started = time.perf_counter()
+    with app.connection_for_read() as conn:
+        channel = conn.default_channel
+        for _ in range(expected):
+            message = channel.basic_get(queue, no_ack=True)
+            message.accept = ACCEPT
+            _, kwargs, _ = message.decode()
+            if "ids" in kwargs:
+                notifications += len(expand_id_ranges(kwargs["ids"]))
+            else:
+                notifications += 1
+    return time.perf_counter() - started, notifications
+
+
+def run(name, broker_url, serializer, messages, count):
+    app = make_app(broker_url, serializer)
+    queue = messages[0][0]
+    is_redis = broker_url.startswith("redis")
+    memory_before = redis_used_memory(app) if is_redis else 0
+
+    publish_seconds = publish(app, messages)
+    if is_redis:
+        size = redis_used_memory(app) - memory_before
+    else:
+        size = stored_bytes(app, queue, len(messages))
+    consume_seconds, consumed = consume(app, queue, len(messages))
+    assert consumed == count
+
+    results = {
+        f"{name}_messages": metric(len(messages), "messages"),
+        f"{name}_bytes_per_notification": metric(size / count, "bytes"),
+        f"{name}_publish_throughput": metric(
+            count / publish_seconds, "notifications/s", better="higher"
+        ),
+        f"{name}_consume_throughput": metric(
+            count / consume_seconds, "notifications/s", better="higher"
+        ),
+    }
+    print(
+        f"{name:6}: {len(messages):6} messages, {size / count:8.1f} bytes/notification,"
+        f" publish {count / publish_seconds:10.0f}/s,"
+        f" consume {count / consume_seconds:10.0f}/s"
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notifications", type=int, default=10_000)
+    parser.add_argument("--broker-url", default="memory://")
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    results = {}
+    results.update(
+        run(
+            "before",
+            args.broker_url,
+            "json",
+            legacy_messages(args.notifications),
+            args.notifications,
+        )
+    )
+    results.update(
+        run(
+            "after",
+            args.broker_url,
+            settings.task_serializer,
+            id_messages(args.notifications),
+            args.notifications,
+        )
+    )
+
+    if args.output:
+        write_results(args.output, "broker", results)
+
+
+if __name__ == "__main__":
+    main()
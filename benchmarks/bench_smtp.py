@@ -0,0 +1,97 @@
+"""Messages per second through one SMTP connection vs. the connection pool.
+
+Usage:
+    poetry run python -m benchmarks.bench_smtp [--messages N] [--pool-size K]
+
+Both modes deliver to a local in-process aiosmtpd server. The handler adds a
+small artificial delay per message to stand in for a real relay's latency.
+"""
+
+import argparse
+import asyncio
+import socket
+import time
+from email.message import EmailMessage
+
+from aiosmtpd.controller import Controller
+
+from app.notifiers.smtp_pool import SMTPConnectionPool
+from benchmarks.results import metric, write_results
+
+
+class DelayedHandler:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def handle_DATA(  # pylint: disable=invalid-name,unused-argument
+        self, server, session, envelope
+    ):
+        await asyncio.sleep(self.delay)
+        return "250 Message accepted for delivery"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _message(index):
+    message = EmailMessage()
+    message["From"] = "alerts@example.com"
+    message["To"] = f"user{index}@example.com"
+    message["Subject"] = "New listings"
+    message.set_content("Here are some new listings that match your preferences")
+    return message
+
+
+async def _bench(host, port, messages, pool_size):
+    pool = SMTPConnectionPool(host, port, size=pool_size)
+    start = time.perf_counter()
+    await asyncio.gather(*(pool.send_message(_message(i)) for i in range(messages)))
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--delay-ms", type=float, default=2.0)
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    controller = Controller(
+        DelayedHandler(args.delay_ms / 1000), hostname="127.0.0.1", port=_free_port()
+    )
+    controller.start()
+    try:
+        single = asyncio.run(
+            _bench(controller.hostname, controller.port, args.messages, 1)
+        )
+        pooled = asyncio.run(
+            _bench(controller.hostname, controller.port, args.messages, args.pool_size)
+        )
+    finally:
+        controller.stop()
+
+    print(f"single connection    : {single:10.1f} msg/s")
+    print(f"pool of {args.pool_size:<3} connections: {pooled:10.1f} msg/s")
+    print(f"speedup              : {pooled / single:10.1f}x")
+
+    if args.output:
+        write_results(
+            args.output,
+            "smtp",
+            {
+                "single_connection_throughput": metric(
+                    single, "msg/s", better="higher"
+                ),
+                "pooled_throughput": metric(pooled, "msg/s", better="higher"),
+            },
+        )
+
+
+if __name__ == "__main__":
+    main()
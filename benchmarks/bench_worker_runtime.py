@@ -0,0 +1,90 @@
+"""Tasks-per-second for the per-task event loop vs. the persistent worker runtime.
+
+Usage:
+    poetry run python -m benchmarks.bench_worker_runtime [--tasks N] [--db]
+
+Without --db each task body is a bare coroutine, which isolates event loop
+setup cost. With --db each task opens a session and runs a query against the
+docker-compose database, which adds connection setup for the per-task mode.
+"""
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.db import DATABASE_URL
+from app.tasks.runtime import WorkerRuntime
+from benchmarks.results import metric, write_results
+
+
+async def _task_body(session_factory):
+    if session_factory is None:
+        await asyncio.sleep(0)
+        return
+    async with session_factory() as session:
+        await session.execute(text("SELECT 1"))
+
+
+async def _per_task_loop_body(use_db):
+    # What each task did before: a fresh engine bound to a throwaway loop
+    if not use_db:
+        await _task_body(None)
+        return
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        await _task_body(async_sessionmaker(bind=engine))
+    finally:
+        await engine.dispose()
+
+
+def bench_per_task_loop(tasks, use_db):
+    start = time.perf_counter()
+    for _ in range(tasks):
+        asyncio.run(_per_task_loop_body(use_db))
+    return tasks / (time.perf_counter() - start)
+
+
+def bench_persistent_runtime(tasks, use_db):
+    runtime = WorkerRuntime()
+    runtime.start()
+    session_factory = runtime.session_factory if use_db else None
+    try:
+        start = time.perf_counter()
+        for _ in range(tasks):
+            runtime.run(_task_body(session_factory))
+        return tasks / (time.perf_counter() - start)
+    finally:
+        runtime.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--db", action="store_true", help="query the database")
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    before = bench_per_task_loop(args.tasks, args.db)
+    after = bench_persistent_runtime(args.tasks, args.db)
+    print(f"asyncio.run per task : {before:10.1f} tasks/s")
+    print(f"persistent runtime   : {after:10.1f} tasks/s")
+    print(f"speedup              : {after / before:10.1f}x")
+
+    if args.output:
+        write_results(
+            args.output,
+            "worker_runtime",
+            {
+                "per_task_loop_throughput": metric(before, "tasks/s", better="higher"),
+                "persistent_runtime_throughput": metric(
+                    after, "tasks/s", better="higher"
+                ),
+            },
+        )
+
+
+if __name__ == "__main__":
+    main()
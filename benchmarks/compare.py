@@ -0,0 +1,53 @@
+"""Compare two benchmark results files and flag regressions.
+
+Usage:
+    poetry run python -m benchmarks.compare BASE.json HEAD.json [--threshold 0.1]
+
+Exits with status 1 if any metric got worse by more than the threshold
+(a fraction of the base value).
+"""
+
+import argparse
+import sys
+
+from benchmarks.results import load_metrics
+
+
+def compare(base, head, threshold):
+    """Return (rows, regressed) for metrics present in both result sets."""
+    rows = []
+    regressed = False
+    for name in sorted(base.keys() & head.keys()):
+        before = base[name]["value"]
+        after = head[name]["value"]
+        change = (after - before) / before if before else 0.0
+        worse = (
+            change > threshold
+            if base[name]["better"] == "lower"
+            else (-change > threshold)
+        )
+        regressed = regressed or worse
+        rows.append((name, before, after, change, base[name]["unit"], worse))
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    rows, regressed = compare(
+        load_metrics(args.base), load_metrics(args.head), args.threshold
+    )
+    for name, before, after, change, unit, worse in rows:
+        flag = "  REGRESSION" if worse else ""
+        print(
+            f"{name:50} {before:12.6g} -> {after:12.6g} {unit:6} {change:+8.1%}{flag}"
+        )
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
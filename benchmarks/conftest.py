@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from app import resilience, rules
+from app.cache import preferences_cache
+from app.config import settings
+
+
+@pytest.fixture(autouse=True)
+def local_state(monkeypatch):
+    """Keep caches, breakers and frequency windows in the process.
+
+    Benchmarks measure the code, not round trips to a Redis that may not
+    be running.
+    """
+    monkeypatch.setattr(preferences_cache, "_redis", None)
+    preferences_cache.clear()
+    monkeypatch.setattr(settings, "circuit_breaker_redis_url", None)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "_limiters", {})
+    monkeypatch.setattr(settings, "rules_redis_url", None)
+    monkeypatch.setattr(rules, "_windows", None)
+
+
+@pytest.fixture
+def event_loop_runner():
+    """Run coroutines to completion on one loop shared by a benchmark."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
@@ -0,0 +1,80 @@
+"""Common results format for benchmarks, comparable across commits.
+
+A results file is JSON:
+
+    {
+      "schema": 1,
+      "suite": "loadgen",
+      "commit": "4d1592d",
+      "created_at": "2025-01-01T00:00:00+00:00",
+      "metrics": {
+        "enqueue_latency_p95": {"value": 0.012, "unit": "s", "better": "lower"},
+        "throughput": {"value": 950.0, "unit": "req/s", "better": "higher"}
+      }
+    }
+
+pytest-benchmark's --benchmark-json output is also accepted by `load_metrics`
+and mapped onto the same shape (mean and median per benchmark).
+"""
+
+import json
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+SCHEMA_VERSION = 1
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def metric(value, unit, better="lower"):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def percentiles(samples, prefix, unit="s"):
+    """Return p50/p95/p99 metrics for a list of samples."""
+    if len(samples) < 2:
+        return {}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        f"{prefix}_p50": metric(cuts[49], unit),
+        f"{prefix}_p95": metric(cuts[94], unit),
+        f"{prefix}_p99": metric(cuts[98], unit),
+    }
+
+
+def write_results(path, suite, metrics):
+    document = {
+        "schema": SCHEMA_VERSION,
+        "suite": suite,
+        "commit": current_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "metrics": metrics,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def load_metrics(path) -> dict:
+    """Load a results file, or pytest-benchmark JSON, as {name: metric}."""
+    with open(path, encoding="utf-8") as f:
+        document = json.load(f)
+    if "benchmarks" in document:  # pytest-benchmark output
+        metrics = {}
+        for bench in document["benchmarks"]:
+            for stat in ("mean", "median"):
+                metrics[f"{bench['name']}_{stat}"] = metric(bench["stats"][stat], "s")
+        return metrics
+    if document.get("schema") != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported results schema in {path}")
+    return document["metrics"]
@@ -0,0 +1,170 @@
+"""Initial schema
+
+Also adopts databases whose tables were created by `create_all` before
+migrations existed, converting their unpartitioned notifications table.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-04-20 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+notification_status = postgresql.ENUM(
+    "pending", "queued", "sent", "failed", name="notificationstatus", create_type=False
+)
+
+LEGACY_COLUMNS = "id, user_id, subject, message, sent_at, status, channel, recipient"
+
+
+def is_partitioned(table: str) -> bool:
+    return bool(
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT 1 FROM pg_partitioned_table"
+                " WHERE partrelid = to_regclass(:table)"
+            ),
+            {"table": table},
+        )
+        .scalar()
+    )
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if inspector.has_table("notifications"):
+        if is_partitioned("notifications"):
+            # Created by create_all with this schema already: only the outbox
+            # may be missing
+            if not inspector.has_table("outbox"):
+                create_outbox()
+            return
+        convert_legacy_schema(inspector)
+        return
+
+    notification_status.create(op.get_bind())
+    create_user_preferences()
+    create_notifications()
+    create_outbox()
+
+
+def convert_legacy_schema(inspector):
+    """Move the rows of a create_all notifications table into a partitioned one.
+
+    The old table is renamed out of the way, with the sequence and indexes
+    whose names the new table needs, then copied and dropped, in this
+    migration's transaction. Writers must be stopped while it runs.
+    """
+    # The type may predate the 'queued' status
+    with op.get_context().autocommit_block():
+        op.execute(
+            "ALTER TYPE notificationstatus ADD VALUE IF NOT EXISTS 'queued'"
+            " BEFORE 'sent'"
+        )
+    op.rename_table("notifications", "notifications_legacy")
+    op.execute(
+        "ALTER TABLE notifications_legacy"
+        " RENAME CONSTRAINT notifications_pkey TO notifications_legacy_pkey"
+    )
+    op.execute(
+        "ALTER SEQUENCE notifications_id_seq RENAME TO notifications_legacy_id_seq"
+    )
+    for index in inspector.get_indexes("notifications_legacy"):
+        op.execute(f'ALTER INDEX "{index["name"]}" RENAME TO "{index["name"]}_legacy"')
+
+    create_notifications()
+    # Rows that were never scheduled are filed under the time they were sent,
+    # or the migration's
+    op.execute(
+        f"INSERT INTO notifications ({LEGACY_COLUMNS}, send_at)"
+        f" SELECT {LEGACY_COLUMNS}, coalesce(send_at, sent_at, now())"
+        " FROM notifications_legacy"
+    )
+    op.execute(
+        "SELECT setval('notifications_id_seq',"
+        " (SELECT coalesce(max(id), 0) + 1 FROM notifications), false)"
+    )
+    op.drop_table("notifications_legacy")
+    if not inspector.has_table("outbox"):
+        create_outbox()
+
+
+def create_user_preferences():
+    op.create_table(
+        "user_preferences",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.String(), nullable=False),
+        sa.Column("email_enabled", sa.Boolean()),
+        sa.Column("sms_enabled", sa.Boolean()),
+        sa.Column("email", sa.String()),
+        sa.Column("phone_number", sa.String()),
+    )
+    op.create_index("ix_user_preferences_id", "user_preferences", ["id"])
+    op.create_index(
+        "ix_user_preferences_user_id", "user_preferences", ["user_id"], unique=True
+    )
+
+
+def create_notifications():
+    op.create_table(
+        "notifications",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.String()),
+        sa.Column("subject", sa.String(), nullable=False),
+        sa.Column("message", sa.Text(), nullable=False),
+        sa.Column("send_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("sent_at", sa.DateTime(timezone=True)),
+        sa.Column("status", notification_status),
+        sa.Column("channel", sa.String()),
+        sa.Column("recipient", sa.String()),
+        sa.PrimaryKeyConstraint("id", "send_at"),
+        sa.ForeignKeyConstraint(["user_id"], ["user_preferences.user_id"]),
+        postgresql_partition_by="RANGE (send_at)",
+    )
+    # Monthly partitions are created by app.partitions
+    op.execute("CREATE TABLE notifications_default PARTITION OF notifications DEFAULT")
+    op.create_index("ix_notifications_id", "notifications", ["id"])
+    op.create_index(
+        "ix_notifications_pending_send_at",
+        "notifications",
+        ["send_at"],
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+    op.create_index(
+        "ix_notifications_user_id_send_at_id",
+        "notifications",
+        ["user_id", "send_at", "id"],
+    )
+    op.create_index(
+        "ix_notifications_status_send_at_id",
+        "notifications",
+        ["status", "send_at", "id"],
+    )
+
+
+def create_outbox():
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("task_name", sa.String(), nullable=False),
+        sa.Column("kwargs", postgresql.JSONB(), nullable=False),
+        sa.Column(
+            "created_at", sa.DateTime(timezone=True), server_default=sa.func.now()
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("outbox")
+    op.drop_table("notifications")
+    notification_status.drop(op.get_bind())
+    op.drop_table("user_preferences")
@@ -0,0 +1,28 @@
+"""Add notification priority and outbox queue
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-04-27 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "notifications",
+        sa.Column("priority", sa.String(), nullable=False, server_default="high"),
+    )
+    op.add_column("outbox", sa.Column("queue", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("outbox", "queue")
+    op.drop_column("notifications", "priority")
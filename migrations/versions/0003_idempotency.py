@@ -0,0 +1,36 @@
+"""Add idempotency keys and the sending status
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-05-04 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "ALTER TYPE notificationstatus ADD VALUE IF NOT EXISTS 'sending' BEFORE 'sent'"
+    )
+    op.create_table(
+        "idempotency_keys",
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("request_hash", sa.String(), nullable=False),
+        sa.Column("response", postgresql.JSONB(), nullable=True),
+        sa.Column(
+            "created_at", sa.DateTime(timezone=True), server_default=sa.func.now()
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("idempotency_keys")
+    # Postgres cannot drop an enum value; 'sending' stays in the type
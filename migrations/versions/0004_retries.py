@@ -0,0 +1,49 @@
+"""Add retry tracking and the dead letter statuses
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-05-11 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # New enum values must be committed before the partial index can use them
+    with op.get_context().autocommit_block():
+        op.execute(
+            "ALTER TYPE notificationstatus ADD VALUE IF NOT EXISTS 'retrying'"
+            " BEFORE 'sent'"
+        )
+        op.execute("ALTER TYPE notificationstatus ADD VALUE IF NOT EXISTS 'dead'")
+
+    op.add_column(
+        "notifications",
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.add_column(
+        "notifications",
+        sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.add_column("notifications", sa.Column("last_error", sa.String(), nullable=True))
+    op.create_index(
+        "ix_notifications_retrying_next_attempt_at",
+        "notifications",
+        ["next_attempt_at"],
+        postgresql_where=sa.text("status = 'retrying'"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_notifications_retrying_next_attempt_at", "notifications")
+    op.drop_column("notifications", "last_error")
+    op.drop_column("notifications", "next_attempt_at")
+    op.drop_column("notifications", "attempts")
+    # Postgres cannot drop enum values; 'retrying' and 'dead' stay in the type
@@ -0,0 +1,69 @@
+"""Add message templates
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-05-18 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "message_templates",
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("subject", sa.Text(), nullable=False),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+        ),
+        sa.PrimaryKeyConstraint("id", "version"),
+    )
+
+    op.alter_column("notifications", "subject", nullable=True)
+    op.alter_column("notifications", "message", nullable=True)
+    op.add_column("notifications", sa.Column("template_id", sa.String(), nullable=True))
+    op.add_column(
+        "notifications", sa.Column("template_version", sa.Integer(), nullable=True)
+    )
+    op.add_column(
+        "notifications",
+        sa.Column("variables", postgresql.JSONB(), nullable=True),
+    )
+    op.create_foreign_key(
+        "notifications_template_id_template_version_fkey",
+        "notifications",
+        "message_templates",
+        ["template_id", "template_version"],
+        ["id", "version"],
+    )
+    op.create_check_constraint(
+        "ck_notifications_content",
+        "notifications",
+        "message IS NOT NULL OR template_id IS NOT NULL",
+    )
+
+
+def downgrade():
+    op.drop_constraint("ck_notifications_content", "notifications")
+    op.drop_constraint(
+        "notifications_template_id_template_version_fkey", "notifications"
+    )
+    op.drop_column("notifications", "variables")
+    op.drop_column("notifications", "template_version")
+    op.drop_column("notifications", "template_id")
+    # Fails while templated notifications exist, as their text was never stored
+    op.alter_column("notifications", "message", nullable=False)
+    op.alter_column("notifications", "subject", nullable=False)
+    op.drop_table("message_templates")
@@ -0,0 +1,66 @@
+"""Add quiet hours and frequency caps to user preferences
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-05-25 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # New enum values must be committed before the partial index can use them
+    with op.get_context().autocommit_block():
+        op.execute(
+            "ALTER TYPE notificationstatus ADD VALUE IF NOT EXISTS 'held'"
+            " BEFORE 'sent'"
+        )
+        op.execute("ALTER TYPE notificationstatus ADD VALUE IF NOT EXISTS 'suppressed'")
+
+    op.add_column("user_preferences", sa.Column("timezone", sa.String(), nullable=True))
+    op.add_column(
+        "user_preferences", sa.Column("quiet_hours_start", sa.Time(), nullable=True)
+    )
+    op.add_column(
+        "user_preferences", sa.Column("quiet_hours_end", sa.Time(), nullable=True)
+    )
+    op.add_column(
+        "user_preferences", sa.Column("max_per_window", sa.Integer(), nullable=True)
+    )
+    op.add_column(
+        "user_preferences",
+        sa.Column("frequency_window_seconds", sa.Integer(), nullable=True),
+    )
+    op.add_column(
+        "user_preferences",
+        sa.Column(
+            "digest_on_overflow",
+            sa.Boolean(),
+            nullable=False,
+            server_default=sa.false(),
+        ),
+    )
+    op.create_index(
+        "ix_notifications_held_next_attempt_at",
+        "notifications",
+        ["next_attempt_at"],
+        postgresql_where=sa.text("status = 'held'"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_notifications_held_next_attempt_at", "notifications")
+    op.drop_column("user_preferences", "digest_on_overflow")
+    op.drop_column("user_preferences", "frequency_window_seconds")
+    op.drop_column("user_preferences", "max_per_window")
+    op.drop_column("user_preferences", "quiet_hours_end")
+    op.drop_column("user_preferences", "quiet_hours_start")
+    op.drop_column("user_preferences", "timezone")
+    # Postgres cannot drop enum values; 'held' and 'suppressed' stay in the type
@@ -0,0 +1,43 @@
+"""Flag notifications whose recipient failed validation
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-06-01 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "notifications",
+        sa.Column(
+            "recipient_valid", sa.Boolean(), nullable=False, server_default=sa.true()
+        ),
+    )
+    # Fail the undelivered rows that the worker would reject, using the same
+    # patterns as app.recipients, so they are not queued again
+    op.execute("""
+        UPDATE notifications
+        SET recipient_valid = false,
+            status = 'failed',
+            last_error = 'Invalid recipient for ' || upper(channel)
+        WHERE status IN ('pending', 'queued', 'retrying', 'held')
+          AND (
+            recipient IS NULL
+            OR (channel = 'email'
+                AND recipient !~ '^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9.-]+$')
+            OR (channel = 'sms' AND recipient !~ '^\\+[0-9]{10,15}$')
+          )
+        """)
+
+
+def downgrade():
+    op.drop_column("notifications", "recipient_valid")
@@ -0,0 +1,34 @@
+"""Lease queued and claimed notifications so stranded rows are queued again
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-06-08 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows queued or claimed before leases existed get one now. Any still in
+    # flight have this long to finish before they are queued again.
+    op.execute(
+        "UPDATE notifications SET next_attempt_at = now() + interval '1 hour'"
+        " WHERE status IN ('queued', 'sending') AND next_attempt_at IS NULL"
+    )
+    op.create_index(
+        "ix_notifications_leased_next_attempt_at",
+        "notifications",
+        ["next_attempt_at"],
+        postgresql_where=sa.text("status IN ('queued', 'sending')"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_notifications_leased_next_attempt_at", "notifications")
@@ -0,0 +1,42 @@
+"""Store user phone numbers in E.164 form where they can be converted
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-06-08 00:00:00
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The same rules as app.recipients.normalize_phone. Numbers that cannot
+    # be converted are kept: they are returned as stored, and notifications
+    # for them are failed with recipient_valid false at ingest.
+    op.execute(r"""
+        UPDATE user_preferences
+        SET phone_number = normalized.phone_number
+        FROM (
+            SELECT id,
+                   regexp_replace(
+                       regexp_replace(phone_number, '[ \t().\-/]', '', 'g'),
+                       '^00',
+                       '+'
+                   ) AS phone_number
+            FROM user_preferences
+            WHERE phone_number IS NOT NULL
+        ) AS normalized
+        WHERE user_preferences.id = normalized.id
+          AND normalized.phone_number ~ '^\+[0-9]{10,15}$'
+          AND normalized.phone_number <> user_preferences.phone_number
+        """)
+
+
+def downgrade():
+    # The original formatting is not kept
+    pass
@@ -4,6 +4,7 @@ from sqlalchemy.ext.asyncio import create_async_engine
 
 from app.config import settings
 from app.db import Base
+from app.partitions import ensure_partitions
 
 DATABASE_URL = "postgresql+asyncpg://alerts_user:alerts_pass@db:5432/alerts_db"
 
@@ -15,6 +16,7 @@ async def setup_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_partitions(conn)
     yield
 
 
@@ -1,5 +1,18 @@
+import asyncio
+import json
+
 import pytest
 
+# Delivery rules a response carries when a write leaves them unset
+NO_RULES = {
+    "timezone": None,
+    "quiet_hours_start": None,
+    "quiet_hours_end": None,
+    "max_per_window": None,
+    "frequency_window_seconds": None,
+    "digest_on_overflow": False,
+}
+
 
 @pytest.mark.asyncio
 async def test_create_and_get_preferences(async_client):
@@ -14,7 +27,7 @@ async def test_create_and_get_preferences(async_client):
     # Create
     response = await async_client.post(f"/preferences/{user_id}", json=payload)
     assert response.status_code == 200
-    assert response.json() == payload
+    assert response.json() == {**payload, **NO_RULES}
 
     # Get
     response = await async_client.get(f"/preferences/{user_id}")
@@ -49,7 +62,7 @@ async def test_update_preferences(async_client):
     # Update preferences
     response = await async_client.post(f"/preferences/{user_id}", json=updated_payload)
     assert response.status_code == 200
-    assert response.json() == updated_payload
+    assert response.json() == {**updated_payload, **NO_RULES}
 
     # Get updated preferences
     response = await async_client.get(f"/preferences/{user_id}")
@@ -59,3 +72,130 @@ async def test_update_preferences(async_client):
     assert data["sms_enabled"] is True
     assert data["email"] == updated_payload["email"]
     assert data["phone_number"] == updated_payload["phone_number"]
+
+
+@pytest.mark.asyncio
+async def test_import_and_export_preferences(async_client):
+    await async_client.post(
+        "/preferences/import-existing",
+        json={
+            "email_enabled": True,
+            "sms_enabled": True,
+            "email": "kept@example.com",
+            "phone_number": "+1111111111",
+        },
+    )
+    body = (
+        "user_id,email_enabled,sms_enabled,email,phone_number\n"
+        "import-new,true,false,new@example.com,\n"
+        "import-existing,false,true,,\n"
+        "import-invalid,maybe,true,,\n"
+    )
+
+    response = await async_client.post(
+        "/preferences/import", content=body, headers={"content-type": "text/csv"}
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["imported"] == 2
+    assert result["invalid"] == 1
+    assert result["errors"][0]["line"] == 4
+
+    # Omitted contact details are kept, as with POST /preferences/{user_id}
+    response = await async_client.get("/preferences/import-existing")
+    assert response.json() == {
+        "email_enabled": False,
+        "sms_enabled": True,
+        "email": "kept@example.com",
+        "phone_number": "+1111111111",
+        **NO_RULES,
+    }
+
+    response = await async_client.get("/preferences/export?format=ndjson")
+    assert response.status_code == 200
+    exported = {
+        row["user_id"]: row for row in map(json.loads, response.text.splitlines())
+    }
+    assert exported["import-new"]["email"] == "new@example.com"
+    assert exported["import-existing"]["email_enabled"] is False
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_for_new_user(async_client):
+    user_id = "concurrent-user"
+    payloads = [
+        {
+            "email_enabled": i % 2 == 0,
+            "sms_enabled": True,
+            "email": f"writer{i}@example.com",
+        }
+        for i in range(20)
+    ]
+
+    # Used to race into a unique violation on user_id when both writers
+    # found no row and inserted
+    responses = await asyncio.gather(
+        *(
+            async_client.post(f"/preferences/{user_id}", json=payload)
+            for payload in payloads
+        )
+    )
+
+    assert [response.status_code for response in responses] == [200] * 20
+    response = await async_client.get(f"/preferences/{user_id}")
+    assert response.json()["email"] in {payload["email"] for payload in payloads}
+
+
+@pytest.mark.asyncio
+async def test_partial_update_retains_contact_details(async_client):
+    user_id = "partial-user"
+    await async_client.post(
+        f"/preferences/{user_id}",
+        json={
+            "email_enabled": True,
+            "sms_enabled": True,
+            "email": "kept@example.com",
+            "phone_number": "+2222222222",
+        },
+    )
+
+    response = await async_client.post(
+        f"/preferences/{user_id}", json={"email_enabled": False, "sms_enabled": True}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "email_enabled": False,
+        "sms_enabled": True,
+        "email": "kept@example.com",
+        "phone_number": "+2222222222",
+        **NO_RULES,
+    }
+
+
+@pytest.mark.asyncio
+async def test_delivery_rules_round_trip(async_client):
+    user_id = "rules-user"
+    rules = {
+        "timezone": "Europe/Madrid",
+        "quiet_hours_start": "22:00:00",
+        "quiet_hours_end": "07:00:00",
+        "max_per_window": 5,
+        "frequency_window_seconds": 3600,
+        "digest_on_overflow": True,
+    }
+    payload = {"email_enabled": True, "sms_enabled": False, **rules}
+
+    response = await async_client.post(f"/preferences/{user_id}", json=payload)
+    assert response.status_code == 200
+    assert response.json() == {**payload, "email": None, "phone_number": None}
+
+    response = await async_client.get(f"/preferences/{user_id}")
+    assert response.status_code == 200
+    assert {name: response.json()[name] for name in rules} == rules
+
+    # Rules are replaced on every write, so omitting them clears them
+    response = await async_client.post(
+        f"/preferences/{user_id}", json={"email_enabled": True, "sms_enabled": False}
+    )
+    assert {name: response.json()[name] for name in rules} == NO_RULES
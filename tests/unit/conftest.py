@@ -2,9 +2,34 @@ from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 
+from app import resilience, rules
+from app.cache import preferences_cache
+from app.config import settings
 from app.models import UserPreference
 
 
+@pytest.fixture(autouse=True)
+def clear_preferences_cache(monkeypatch):
+    """Start every test with an empty, local-only preferences cache."""
+    monkeypatch.setattr(preferences_cache, "_redis", None)
+    preferences_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def local_circuit_breakers(monkeypatch):
+    """Give every test fresh, process-local breakers and limiters."""
+    monkeypatch.setattr(settings, "circuit_breaker_redis_url", None)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "_limiters", {})
+
+
+@pytest.fixture(autouse=True)
+def local_frequency_windows(monkeypatch):
+    """Give every test fresh, process-local frequency windows."""
+    monkeypatch.setattr(settings, "rules_redis_url", None)
+    monkeypatch.setattr(rules, "_windows", None)
+
+
 @pytest.fixture
 def mock_db():
     """Fixture for a mock async database session."""
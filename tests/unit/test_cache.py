@@ -0,0 +1,131 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.cache import PreferencesCache
+from app.models import UserPreference
+
+
+def make_preference(user_id):
+    return UserPreference(
+        user_id=user_id,
+        email=f"{user_id}@example.com",
+        phone_number=None,
+        email_enabled=True,
+        sms_enabled=False,
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_reads_through_once(mock_db, mock_user_preferences):
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+    cache = PreferencesCache()
+
+    first = await cache.get(mock_db, "user123")
+    second = await cache.get(mock_db, "user123")
+
+    assert first == second
+    assert first.email == "user@example.com"
+    mock_db.execute.assert_called_once()
+    assert cache.stats() == {"size": 1, "hits": 1, "redis_hits": 0, "misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_get_expires_after_ttl(mock_db, mock_user_preferences):
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+    cache = PreferencesCache(ttl=10)
+
+    with patch("app.cache.time.monotonic", return_value=100):
+        await cache.get(mock_db, "user123")
+    with patch("app.cache.time.monotonic", return_value=111):
+        await cache.get(mock_db, "user123")
+
+    assert mock_db.execute.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate(mock_db, mock_user_preferences):
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+    cache = PreferencesCache()
+
+    await cache.get(mock_db, "user123")
+    await cache.invalidate("user123")
+    await cache.get(mock_db, "user123")
+
+    assert mock_db.execute.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_read_is_not_undone(mock_db, mock_user_preferences):
+    cache = PreferencesCache()
+
+    async def read_then_write(*args, **kwargs):
+        # A write commits and invalidates while the old row is being read
+        await cache.invalidate("user123")
+        result = MagicMock()
+        result.scalar_one_or_none.return_value = mock_user_preferences
+        return result
+
+    mock_db.execute.side_effect = read_then_write
+    await cache.get(mock_db, "user123")
+
+    # The row read before the write is not cached
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_only_caches_current_version(mock_db, mock_user_preferences):
+    # pylint: disable=protected-access
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+    shared = MagicMock()
+    # Not cached in Redis, invalidated three times so far
+    shared.mget = AsyncMock(return_value=[None, b"3"])
+    pipe = AsyncMock()
+    shared.pipeline.return_value.__aenter__.return_value = pipe
+    cache = PreferencesCache()
+    cache._redis = shared
+    cache._set_if_current = AsyncMock()
+
+    await cache.get(mock_db, "user123")
+
+    # Written only if no invalidation bumped the version since it was read
+    kwargs = cache._set_if_current.call_args.kwargs
+    assert kwargs["keys"] == ["preferences:user123", "preferences:user123:version"]
+    assert kwargs["args"][0] == "3"
+    assert kwargs["client"] is pipe
+    pipe.execute.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_many_queries_only_misses(mock_db):
+    mock_db.execute.return_value.scalar_one_or_none.return_value = make_preference("a")
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        make_preference("b")
+    ]
+    cache = PreferencesCache(max_size=2)
+    await cache.get(mock_db, "a")
+
+    found = await cache.get_many(mock_db, ["a", "b", "missing"])
+
+    assert set(found) == {"a", "b"}
+    assert cache.hits == 1
+    assert cache.misses == 3  # "a" on the first get, then "b" and "missing"
+    statement_params = mock_db.execute.call_args[0][0].compile().params
+    assert ["b", "missing"] in statement_params.values()
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction(mock_db):
+    mock_db.execute.return_value.scalar_one_or_none.side_effect = [
+        make_preference("a"),
+        make_preference("b"),
+        make_preference("c"),
+    ]
+    cache = PreferencesCache(max_size=2)
+
+    for user_id in ("a", "b", "c"):
+        await cache.get(mock_db, user_id)
+
+    assert cache.stats()["size"] == 2
+    assert cache._get_local("a") is None  # pylint: disable=protected-access
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql
+
+from app.digest import claim_companions, coalesce, digest_content
+from app.models import Notification
+from app.templates import TemplateError
+
+
+def make_notification(notification_id, user_id="user123", channel="email"):
+    return Notification(
+        id=notification_id,
+        user_id=user_id,
+        channel=channel,
+        recipient=f"{user_id}@example.com" if channel == "email" else "+1234567890",
+    )
+
+
+def test_digest_content():
+    contents = [("New listing", "Flat in Madrid"), ("Price drop", "House in Bilbao")]
+
+    assert digest_content("email", contents) == (
+        "New listing (+1 more)",
+        "New listing\n\nFlat in Madrid\n\n---\n\nPrice drop\n\nHouse in Bilbao",
+    )
+    assert digest_content("sms", contents)[1] == (
+        "Flat in Madrid\n\n---\n\nHouse in Bilbao"
+    )
+
+
+def test_coalesce_groups_per_user_channel_and_recipient():
+    notifications = [
+        make_notification(3),
+        make_notification(1),
+        make_notification(2, channel="sms"),
+        make_notification(4, channel="sms"),
+        make_notification(5, user_id="other"),
+        make_notification(6),
+    ]
+    contents = {n.id: (f"Subject {n.id}", f"Body {n.id}") for n in notifications}
+    contents[6] = TemplateError("Missing template variable 'city'")
+
+    leads, members = coalesce(notifications, contents, max_items=10)
+
+    assert sorted(lead.id for lead in leads) == [1, 2, 5, 6]
+    assert [m.id for m in members[1]] == [1, 3]  # earliest id leads
+    assert [m.id for m in members[2]] == [2, 4]
+    assert [m.id for m in members[5]] == [5]
+    assert contents[1][0] == "Subject 1 (+1 more)"
+    assert contents[5] == ("Subject 5", "Body 5")  # a single one is unchanged
+    # A notification that failed to render is not merged
+    assert [m.id for m in members[6]] == [6]
+
+
+def test_coalesce_caps_digest_size():
+    notifications = [make_notification(i) for i in range(1, 6)]
+    contents = {n.id: ("Subject", "Body") for n in notifications}
+
+    leads, members = coalesce(notifications, contents, max_items=2)
+
+    assert [lead.id for lead in leads] == [1, 3, 5]
+    assert [len(members[lead.id]) for lead in leads] == [2, 2, 1]
+
+
+def test_claim_companions():
+    now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    statement = claim_companions(
+        [make_notification(1), make_notification(2, channel="sms")], now, 60, 3600
+    )
+
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    params = statement.compile().params
+    assert "(notifications.user_id, notifications.channel) IN" in sql
+    assert "RETURNING" in sql
+    # Only recent partitions are scanned
+    assert "notifications.send_at BETWEEN" in sql
+    assert params["send_at_1"] == datetime(2024, 12, 31, 23, tzinfo=timezone.utc)
+    assert params["send_at_2"] == datetime(2025, 1, 1, 0, 1, tzinfo=timezone.utc)
+    assert {status.name for status in params["status_1"]} == {
+        "pending",
+        "queued",
+        "held",
+    }
@@ -0,0 +1,47 @@
+import json
+import logging
+
+from app.utils.logger import JsonFormatter, SamplingFilter
+
+
+def make_record(name, level=logging.INFO, msg="sent %s", args=("x",)):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_sampling_filter_rate_limits_per_logger():
+    now = [0.0]
+    sampler = SamplingFilter({}, {"app.notifiers": 2}, clock=lambda: now[0])
+    name = "app.notifiers.email_notifier"
+
+    kept = [sampler.filter(make_record(name)) for _ in range(5)]
+    assert kept == [True, True, False, False, False]
+
+    # Warnings always pass, other loggers are not limited
+    assert sampler.filter(make_record(name, level=logging.ERROR))
+    assert sampler.filter(make_record("app.relay"))
+
+    # Tokens refill over time and the next record reports what was dropped
+    now[0] = 1.0
+    record = make_record(name)
+    assert sampler.filter(record)
+    assert record.suppressed == 3
+
+
+def test_sampling_filter_sample_rate_longest_prefix_wins():
+    sampler = SamplingFilter({"app": 1.0, "app.tasks": 0.0}, {})
+
+    assert sampler.filter(make_record("app.routes.notifications"))
+    assert not sampler.filter(make_record("app.tasks.notification_tasks"))
+    assert sampler.filter(make_record("app.tasks.runtime", level=logging.WARNING))
+
+
+def test_json_formatter():
+    record = make_record("app.relay")
+    record.suppressed = 4
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "app.relay"
+    assert entry["message"] == "sent x"
+    assert entry["suppressed"] == 4
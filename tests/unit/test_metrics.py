@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app.main import app
+from app.metrics import record_notification
+from app.models import NotificationStatus
+
+
+def test_metrics_endpoint_reports_route_latency():
+    client = TestClient(app)
+
+    client.get("/health")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/health",status="200"}'
+        in response.text
+    )
+    assert "preferences_cache_requests_total" in response.text
+
+
+def test_record_notification():
+    labels = {"channel": "sms", "status": "sent"}
+    before = REGISTRY.get_sample_value("notifications_processed_total", labels) or 0
+    send_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    record_notification(
+        "sms", NotificationStatus.sent, send_at, send_at + timedelta(seconds=3)
+    )
+
+    assert REGISTRY.get_sample_value("notifications_processed_total", labels) == (
+        before + 1
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            "notification_queue_lag_seconds_bucket", {"channel": "sms", "le": "5.0"}
+        )
+        >= 1
+    )
@@ -0,0 +1,331 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.config import settings
+from app.models import MessageTemplate, Notification, NotificationStatus
+from app.rules import compile_rules
+from app.tasks.notification_tasks import (
+    process_notification,
+    process_notification_batch,
+    send_notification_batch,
+)
+from app.templates import CompiledTemplate, template_cache
+
+SEND_AT = datetime(2025, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def mock_session(monkeypatch):
+    """Fixture for a mock worker session returned by the runtime.
+
+    Users have no quiet hours or frequency caps, and notifications are not
+    coalesced into digests, unless a test sets them.
+    """
+    monkeypatch.setattr(settings, "digest_max_items", 1)
+    session = AsyncMock()
+    session.execute.return_value.scalars = MagicMock()
+    factory = MagicMock()
+    factory.return_value.__aenter__.return_value = session
+    with (
+        patch("app.tasks.notification_tasks.runtime") as mock_runtime,
+        patch("app.tasks.notification_tasks.load_rules", AsyncMock(return_value={})),
+    ):
+        mock_runtime.session_factory = factory
+        yield session
+
+
+def make_notification(notification_id, channel, recipient):
+    return Notification(
+        id=notification_id,
+        user_id="user123",
+        subject="Subject",
+        message="Body",
+        channel=channel,
+        recipient=recipient,
+        send_at=SEND_AT + timedelta(minutes=notification_id),
+        status=NotificationStatus.pending,
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_notification_batch(
+    mock_session,
+):  # pylint: disable=redefined-outer-name
+    notifications = [
+        make_notification(1, "email", "user@example.com"),
+        make_notification(2, "sms", "+1234567890"),
+        make_notification(3, "sms", "not-a-phone"),
+    ]
+    mock_session.execute.return_value.scalars.return_value.all.return_value = (
+        notifications
+    )
+
+    await process_notification_batch(
+        [1, 2, 3], (SEND_AT, SEND_AT + timedelta(minutes=3))
+    )
+
+    # One claim for the batch, committed before sending, and one UPDATE for
+    # every status change
+    assert mock_session.execute.call_count == 2
+    assert mock_session.commit.call_count == 2
+
+    claim = str(mock_session.execute.call_args_list[0][0][0])
+    assert "SET status=:status" in claim
+    assert "notifications.status = :status_1" in claim
+    # The claim is a lease the scheduler takes back if this worker dies
+    assert "next_attempt_at=(now() + :now_1)" in claim
+    # Both statements are bounded by send_at, so only the rows' partitions
+    # are scanned
+    assert "notifications.send_at BETWEEN" in claim
+
+    update = mock_session.execute.call_args_list[1][0][0]
+    assert "notifications.send_at BETWEEN" in str(update)
+    update_params = list(update.compile().params.values())
+    assert [1, 2, 3] in update_params  # every claimed id
+    assert SEND_AT + timedelta(minutes=1) in update_params
+    assert SEND_AT + timedelta(minutes=3) in update_params
+    # The invalid phone number is a permanent error, so it is not retried
+    statuses = [p for p in update_params if isinstance(p, NotificationStatus)]
+    assert statuses == [
+        NotificationStatus.sent,
+        NotificationStatus.sent,
+        NotificationStatus.failed,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_process_notification_batch_error_after_claim_retries(
+    mock_session,
+):  # pylint: disable=redefined-outer-name
+    notifications = [
+        make_notification(1, "email", "user@example.com"),
+        make_notification(2, "sms", "+1234567890"),
+    ]
+    notifications[1].attempts = 4  # its last attempt
+    mock_session.execute.return_value.scalars.return_value.all.return_value = (
+        notifications
+    )
+    # Sending works, but recording the outcome fails
+    mock_session.execute.side_effect = [
+        mock_session.execute.return_value,
+        ConnectionError("connection lost"),
+        None,
+    ]
+
+    with patch("app.tasks.notification_tasks.build_notifier") as mock_build_notifier:
+        mock_build_notifier.return_value.asend = AsyncMock()
+        await process_notification_batch([1, 2])
+
+    mock_session.rollback.assert_called_once()
+    release = mock_session.execute.call_args_list[2][0][0]
+    params = list(release.compile().params.values())
+    statuses = [p for p in params if isinstance(p, NotificationStatus)]
+    assert statuses == [NotificationStatus.retrying, NotificationStatus.dead]
+    assert "ConnectionError: connection lost" in params
+    assert mock_session.commit.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_process_notification_batch_nothing_found(
+    mock_session,
+):  # pylint: disable=redefined-outer-name
+    mock_session.execute.return_value.scalars.return_value.all.return_value = []
+
+    # Already sent or claimed by another worker: nothing is sent
+    await process_notification_batch([1])
+
+    mock_session.execute.assert_called_once()
+    mock_session.commit.assert_called_once()  # releases the claim transaction
+
+
+@pytest.mark.asyncio
+async def test_process_notification_redelivered_is_a_no_op(
+    mock_session,
+):  # pylint: disable=redefined-outer-name
+    mock_session.execute.return_value.scalar_one_or_none = MagicMock(return_value=None)
+
+    with patch("app.tasks.notification_tasks.build_notifier") as mock_build_notifier:
+        await process_notification(
+            1, "user123", "Subject", "Body", "email", "user@example.com"
+        )
+
+    mock_build_notifier.assert_not_called()
+    mock_session.execute.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_process_notification_batch_skips_open_circuit(
+    mock_session,
+):  # pylint: disable=redefined-outer-name
+    notification = make_notification(1, "sms", "+1234567890")
+    notification.attempts = 2
+    mock_session.execute.return_value.scalars.return_value.all.return_value = [
+        notification
+    ]
+    breaker = MagicMock(open_seconds=30)
+    breaker.allow = AsyncMock(return_value=False)
+
+    with (
+        patch("app.tasks.notification_tasks.get_breaker", return_value=breaker),
+        patch("app.tasks.notification_tasks.build_notifier") as mock_build_notifier,
+    ):
+        await process_notification_batch([1])
+
+    mock_build_notifier.assert_not_called()
+    update = mock_session.execute.call_args_list[1][0][0]
+    update_params = list(update.compile().params.values())
+    assert NotificationStatus.retrying in update_params
+    assert 2 in update_params  # attempts unchanged
+
+
+@pytest.mark.asyncio
+async def test_process_notification_batch_renders_templates(
+    mock_session,
+):  # pylint: disable=redefined-outer-name
+    template_cache.clear()
+    template_cache._set(  # pylint: disable=protected-access
+        CompiledTemplate.from_model(
+            MessageTemplate(id="welcome", version=1, subject="Hi $name", body="Hello")
+        )
+    )
+    notification = make_notification(1, "email", "user@example.com")
+    notification.subject = notification.message = None
+    notification.template_id, notification.template_version = "welcome", 1
+    notification.variables = {"name": "Ana"}
+    mock_session.execute.return_value.scalars.return_value.all.return_value = [
+        notification
+    ]
+
+    with patch("app.tasks.notification_tasks.build_notifier") as mock_build_notifier:
+        mock_build_notifier.return_value.asend = AsyncMock()
+        await process_notification_batch([1])
+
+    # Rendered from the cached version, without querying for it
+    mock_build_notifier.assert_called_once_with(
+        "email", "user123", "user@example.com", "Hi Ana", "Hello"
+    )
+    assert mock_session.execute.call_count == 2
+    template_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_process_notification_batch_applies_delivery_rules(
+    mock_session,
+):  # pylint: disable=redefined-outer-name
+    notifications = [
+        make_notification(1, "email", "user@example.com"),
+        make_notification(2, "email", "user@example.com"),
+        make_notification(3, "email", "user@example.com"),
+    ]
+    notifications[2].user_id = "night-owl"
+    mock_session.execute.return_value.scalars.return_value.all.return_value = (
+        notifications
+    )
+    rules = {
+        # One email per hour, extra ones kept for a digest
+        "user123": compile_rules(None, None, None, 1, 3600, True),
+        # Quiet around the clock
+        "night-owl": compile_rules(
+            "Europe/Madrid", "00:00:00", "23:59:59", None, None, False
+        ),
+    }
+
+    with (
+        patch("app.tasks.notification_tasks.load_rules", AsyncMock(return_value=rules)),
+        patch("app.tasks.notification_tasks.build_notifier") as mock_build_notifier,
+    ):
+        mock_build_notifier.return_value.asend = AsyncMock()
+        await process_notification_batch([1, 2, 3])
+
+    mock_build_notifier.assert_called_once()  # only the first email is sent
+    update = mock_session.execute.call_args_list[1][0][0]
+    update_params = list(update.compile().params.values())
+    statuses = [p for p in update_params if isinstance(p, NotificationStatus)]
+    assert statuses == [
+        NotificationStatus.sent,
+        NotificationStatus.held,
+        NotificationStatus.retrying,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_process_notification_batch_sends_digests(
+    mock_session, monkeypatch
+):  # pylint: disable=redefined-outer-name
+    monkeypatch.setattr(settings, "digest_max_items", 2)
+    queued = [
+        make_notification(1, "email", "user@example.com"),
+        make_notification(2, "sms", "+1234567890"),
+    ]
+    # Due or held notifications of the same users and channels
+    companions = [
+        make_notification(5, "email", "user@example.com"),
+        make_notification(6, "email", "user@example.com"),
+    ]
+    companions[1].subject = "Second"
+    mock_session.execute.return_value.scalars.return_value.all.side_effect = [
+        queued,
+        companions,
+    ]
+
+    with patch("app.tasks.notification_tasks.build_notifier") as mock_build_notifier:
+        mock_build_notifier.return_value.asend = AsyncMock()
+        await process_notification_batch([1, 2])
+
+    # Emails 1 and 5 go out as one digest, email 6 overflows into its own send
+    assert mock_build_notifier.call_count == 3
+    mock_build_notifier.assert_any_call(
+        "email",
+        "user123",
+        "user@example.com",
+        "Subject (+1 more)",
+        "Subject\n\nBody\n\n---\n\nSubject\n\nBody",
+    )
+    mock_build_notifier.assert_any_call(
+        "email", "user123", "user@example.com", "Second", "Body"
+    )
+
+    companion_claim = mock_session.execute.call_args_list[1][0][0]
+    claim_sql = str(companion_claim.compile(dialect=postgresql.dialect()))
+    assert "(notifications.user_id, notifications.channel) IN" in claim_sql
+    assert "notifications.send_at BETWEEN" in claim_sql
+
+    # Every row of every digest is marked in the one UPDATE
+    update = mock_session.execute.call_args_list[2][0][0]
+    update_params = list(update.compile().params.values())
+    ids = next(p for p in update_params if isinstance(p, list))
+    assert sorted(ids) == [1, 2, 5, 6]
+    statuses = [p for p in update_params if isinstance(p, NotificationStatus)]
+    assert statuses == [NotificationStatus.sent] * 4
+    assert mock_session.execute.call_count == 3
+
+
+def test_send_notification_batch_expands_id_ranges():
+    requests = [
+        MagicMock(
+            kwargs={
+                "ids": [[1, 150], [200, 200]],
+                "send_at": [SEND_AT.isoformat(), SEND_AT.isoformat()],
+            }
+        ),
+        MagicMock(kwargs={"notification_id": 300}),  # queued by an older release
+    ]
+
+    with (
+        patch("app.tasks.notification_tasks.runtime") as mock_runtime,
+        patch(
+            "app.tasks.notification_tasks.process_notification_batch"
+        ) as mock_process,
+    ):
+        send_notification_batch.run(requests)
+
+    # Processed in chunks of batch_flush_every
+    chunks = [call.args[0] for call in mock_process.call_args_list]
+    assert [len(chunk) for chunk in chunks] == [100, 52]
+    assert chunks[1][-2:] == [200, 300]
+    # The older message has no send_at, so the claims are not bounded by it
+    assert [call.args[1] for call in mock_process.call_args_list] == [None, None]
+    assert mock_runtime.run.call_count == 2
@@ -1,20 +1,37 @@
 from datetime import datetime, timezone
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from fastapi import HTTPException
 from pydantic import ValidationError
-
-from app.routes.notifications import NotificationPayload, create_notification
+from sqlalchemy.dialects import postgresql
+
+from app.idempotency import request_hash
+from app.models import (
+    IdempotencyKey,
+    MessageTemplate,
+    Notification,
+    NotificationStatus,
+    OutboxMessage,
+)
+from app.routes.notifications import (
+    BatchNotificationPayload,
+    NotificationPayload,
+    RedrivePayload,
+    create_notification,
+    create_notifications_batch,
+    decode_cursor,
+    list_notifications,
+    redrive_dead_letters,
+)
+from app.tasks.notification_tasks import send_notification_batch
+from app.templates import CompiledTemplate
 
 
 @pytest.fixture
 def mock_celery_tasks():
     """Fixture for mocking Celery tasks."""
-    return {
-        "send_email_task": MagicMock(),
-        "send_sms_task": MagicMock(),
-    }
+    return {"send_notification_batch": MagicMock()}
 
 
 @pytest.mark.asyncio
@@ -26,11 +43,8 @@ async def test_create_notification(
 
     with (
         patch(
-            "app.routes.notifications.send_email_task",
-            mock_celery_tasks["send_email_task"],
-        ),
-        patch(
-            "app.routes.notifications.send_sms_task", mock_celery_tasks["send_sms_task"]
+            "app.routes.notifications.send_notification_batch",
+            mock_celery_tasks["send_notification_batch"],
         ),
     ):
         # Mock datetime
@@ -53,13 +67,31 @@ async def test_create_notification(
             assert response["status"] == "queued"
             assert response["send_at"] == mock_now.isoformat()
 
-            # Assert DB interactions
-            mock_db.add.assert_called()  # Ensure notifications were added
+            # Assert DB interactions: two notifications, then their outbox
+            # messages in the same transaction
+            added = [call[0][0] for call in mock_db.add.call_args_list]
+            assert [type(row) for row in added] == [
+                Notification,
+                Notification,
+                OutboxMessage,
+                OutboxMessage,
+            ]
+            mock_db.flush.assert_called_once()
             mock_db.commit.assert_called_once()
 
-            # Assert Celery tasks were triggered
-            mock_celery_tasks["send_email_task"].apply_async.assert_called_once()
-            mock_celery_tasks["send_sms_task"].apply_async.assert_called_once()
+            # Assert tasks were queued in the outbox, not published directly.
+            # Messages carry only the ids, and the send_at range that picks
+            # their partitions: the worker loads the rows.
+            task = mock_celery_tasks["send_notification_batch"]
+            assert [row.task_name for row in added[2:]] == [task.name] * 2
+            send_at = added[0].send_at.isoformat()
+            assert [row.kwargs for row in added[2:]] == [
+                {"ids": [[added[0].id, added[0].id]], "send_at": [send_at, send_at]},
+                {"ids": [[added[1].id, added[1].id]], "send_at": [send_at, send_at]},
+            ]
+            # Urgent by default: each channel's high priority lane
+            assert [added[2].queue, added[3].queue] == ["email.high", "sms.high"]
+            task.apply_async.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -77,11 +109,8 @@ async def test_create_scheduled_notification(
 
     with (
         patch(
-            "app.routes.notifications.send_email_task",
-            mock_celery_tasks["send_email_task"],
-        ),
-        patch(
-            "app.routes.notifications.send_sms_task", mock_celery_tasks["send_sms_task"]
+            "app.routes.notifications.send_notification_batch",
+            mock_celery_tasks["send_notification_batch"],
         ),
         patch("app.routes.notifications.datetime") as mock_datetime,
     ):
@@ -106,27 +135,15 @@ async def test_create_scheduled_notification(
         mock_db.add.assert_called()  # Ensure notifications were added
         mock_db.commit.assert_called_once()
 
-        # Assert Celery tasks were triggered with ETA
-        mock_celery_tasks["send_email_task"].apply_async.assert_called_once_with(
-            kwargs={
-                "user_id": "user123",
-                "subject": "Scheduled Notification",
-                "message": "This is a scheduled test message",
-                "notification_id": mock_db.add.call_args[0][0].id,
-                "recipient": "user@example.com",
-            },
-            eta=mock_future_time,
-        )
-        mock_celery_tasks["send_sms_task"].apply_async.assert_called_once_with(
-            kwargs={
-                "user_id": "user123",
-                "subject": "Scheduled Notification",
-                "message": "This is a scheduled test message",
-                "notification_id": mock_db.add.call_args[0][0].id,
-                "recipient": "+1234567890",
-            },
-            eta=mock_future_time,
-        )
+        # Assert rows were stored pending for the scheduler, without outbox
+        # messages
+        for call in mock_db.add.call_args_list:
+            assert isinstance(call[0][0], Notification)
+            assert call[0][0].status == NotificationStatus.pending
+            assert call[0][0].send_at == mock_future_time
+
+        # Assert no Celery tasks were published
+        mock_celery_tasks["send_notification_batch"].apply_async.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -168,11 +185,8 @@ async def test_create_notification_disabled_channels(
 
     with (
         patch(
-            "app.routes.notifications.send_email_task",
-            mock_celery_tasks["send_email_task"],
-        ),
-        patch(
-            "app.routes.notifications.send_sms_task", mock_celery_tasks["send_sms_task"]
+            "app.routes.notifications.send_notification_batch",
+            mock_celery_tasks["send_notification_batch"],
         ),
     ):
         # Prepare payload
@@ -195,8 +209,7 @@ async def test_create_notification_disabled_channels(
         mock_db.commit.assert_called_once()  # Commit is still called, but no records added
 
         # Ensure no Celery tasks were triggered
-        mock_celery_tasks["send_email_task"].apply_async.assert_not_called()
-        mock_celery_tasks["send_sms_task"].apply_async.assert_not_called()
+        mock_celery_tasks["send_notification_batch"].apply_async.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -213,3 +226,468 @@ async def test_create_notification_invalid_payload(mock_db):
     # Ensure no DB interactions or Celery tasks were triggered
     mock_db.add.assert_not_called()
     mock_db.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_create_notifications_batch_fan_out(mock_db, mock_user_preferences):
+    # One known user (email + sms) and one unknown user
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        mock_user_preferences
+    ]
+    mock_db.scalars.return_value = MagicMock(all=MagicMock(return_value=[10, 11]))
+
+    payload = BatchNotificationPayload(
+        user_ids=["user123", "unknown-user"],
+        subject="New listings",
+        message="Here are some new listings",
+    )
+
+    response = await create_notifications_batch(payload, db=mock_db)
+
+    # Assert per-item results
+    assert response["status"] == "partial"
+    assert response["queued"] == 1
+    assert response["failed"] == 1
+    assert response["results"][0]["status"] == "queued"
+    assert response["results"][0]["notification_ids"] == [10, 11]
+    assert response["results"][1]["status"] == "failed"
+    assert response["results"][1]["detail"] == "User preferences not found"
+
+    # Assert a single bulk insert for the notifications
+    mock_db.scalars.assert_called_once()
+    assert len(mock_db.scalars.call_args[0][1]) == 2
+
+    # Assert one outbox message per queue, in the same transaction
+    outbox_rows = mock_db.execute.call_args[0][1]
+    assert [row["kwargs"]["ids"] for row in outbox_rows] == [[[10, 10]], [[11, 11]]]
+    send_ats = [row["send_at"].isoformat() for row in mock_db.scalars.call_args[0][1]]
+    assert [row["kwargs"]["send_at"] for row in outbox_rows] == [
+        [send_at, send_at] for send_at in send_ats
+    ]
+    # Batches default to each channel's low priority lane
+    assert [row["queue"] for row in outbox_rows] == ["email.low", "sms.low"]
+    mock_db.commit.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_create_notifications_batch_scheduled(mock_db, mock_user_preferences):
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        mock_user_preferences
+    ]
+    mock_db.scalars.return_value = MagicMock(all=MagicMock(return_value=[10, 11]))
+    future = datetime(2999, 1, 1, tzinfo=timezone.utc)
+
+    payload = BatchNotificationPayload(
+        items=[
+            {
+                "user_id": "user123",
+                "subject": "Hi",
+                "message": "Listing A",
+                "send_at": future.isoformat(),
+            },
+        ]
+    )
+
+    response = await create_notifications_batch(payload, db=mock_db)
+
+    # Rows are stored pending and left for the scheduler
+    assert response["status"] == "queued"
+    rows = mock_db.scalars.call_args[0][1]
+    assert {row["status"] for row in rows} == {NotificationStatus.pending}
+    mock_db.execute.assert_called_once()  # preferences lookup only
+    mock_db.commit.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_create_notifications_batch_invalid_recipient(
+    mock_db, mock_user_preferences
+):
+    # Stored before phone numbers were validated on write
+    mock_user_preferences.phone_number = "12345"
+    mock_user_preferences.email = " user@example.com "
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        mock_user_preferences
+    ]
+    mock_db.scalars.return_value = MagicMock(all=MagicMock(return_value=[10, 11]))
+
+    payload = BatchNotificationPayload(
+        user_ids=["user123"], subject="New listings", message="Listing A"
+    )
+
+    response = await create_notifications_batch(payload, db=mock_db)
+
+    # The email can still be sent, so the item is queued
+    assert response["status"] == "queued"
+    assert response["results"][0]["status"] == "queued"
+    assert response["results"][0]["detail"] == "Invalid recipient for SMS"
+    email, sms = mock_db.scalars.call_args[0][1]
+    assert email["recipient"] == "user@example.com"
+    assert email["recipient_valid"] is True
+    assert email["status"] == NotificationStatus.queued
+    # The SMS is stored as failed and never queued for a worker
+    assert sms["recipient_valid"] is False
+    assert sms["status"] == NotificationStatus.failed
+    assert sms["last_error"] == "Invalid recipient for SMS"
+    outbox_rows = mock_db.execute.call_args[0][1]
+    assert [row["kwargs"]["ids"] for row in outbox_rows] == [[[10, 10]]]
+
+
+@pytest.mark.asyncio
+async def test_create_notifications_batch_no_valid_recipient(
+    mock_db, mock_user_preferences
+):
+    mock_user_preferences.phone_number = "12345"
+    mock_user_preferences.email = "not-an-email"
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        mock_user_preferences
+    ]
+    mock_db.scalars.return_value = MagicMock(all=MagicMock(return_value=[10, 11]))
+
+    payload = BatchNotificationPayload(
+        user_ids=["user123"], subject="New listings", message="Listing A"
+    )
+
+    response = await create_notifications_batch(payload, db=mock_db)
+
+    assert response["status"] == "partial"
+    assert response["failed"] == 1
+    assert response["results"][0]["status"] == "failed"
+    assert response["results"][0]["detail"] == "Invalid recipient for EMAIL, SMS"
+    # Both rows are stored as failed, and nothing is queued
+    rows = mock_db.scalars.call_args[0][1]
+    assert {row["status"] for row in rows} == {NotificationStatus.failed}
+    mock_db.execute.assert_called_once()  # preferences lookup only
+
+
+@pytest.mark.asyncio
+async def test_create_notification_no_valid_recipient(mock_db, mock_user_preferences):
+    mock_user_preferences.email_enabled = False
+    mock_user_preferences.phone_number = "12345"
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+
+    response = await create_notification(
+        NotificationPayload(user_id="user123", subject="Hi", message="Listing A"),
+        db=mock_db,
+    )
+
+    assert response["status"] == "failed"
+    assert response["detail"] == "Invalid recipient for SMS"
+    (added,) = [call[0][0] for call in mock_db.add.call_args_list]
+    assert added.status == NotificationStatus.failed
+    assert added.recipient_valid is False
+    mock_db.flush.assert_not_called()  # nothing to queue
+
+
+def test_batch_payload_requires_items_or_user_ids():
+    with pytest.raises(ValidationError):
+        BatchNotificationPayload()
+
+    with pytest.raises(ValidationError):
+        BatchNotificationPayload(user_ids=["user123"])  # Missing subject and message
+
+
+def make_compiled_template():
+    return CompiledTemplate.from_model(
+        MessageTemplate(
+            id="new-listings",
+            version=3,
+            subject="New listings in $city",
+            body="Hi $name, $count new listings match your search.",
+        )
+    )
+
+
+def test_payload_requires_text_or_template():
+    with pytest.raises(ValidationError):
+        NotificationPayload(user_id="user123")
+    with pytest.raises(ValidationError):
+        NotificationPayload(
+            user_id="user123", subject="Hi", message="Text", template_id="welcome"
+        )
+
+
+@pytest.mark.asyncio
+async def test_create_notification_from_template(mock_db, mock_user_preferences):
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+    variables = {"city": "Lisbon", "name": "Ana", "count": 3}
+
+    with patch("app.routes.notifications.template_cache") as mock_cache:
+        mock_cache.get = AsyncMock(return_value=make_compiled_template())
+        payload = NotificationPayload(
+            user_id="user123", template_id="new-listings", variables=variables
+        )
+        await create_notification(payload, db=mock_db)
+
+    # The latest version is resolved once and stored, the text is not
+    mock_cache.get.assert_called_once_with(mock_db, "new-listings", None)
+    added = [call[0][0] for call in mock_db.add.call_args_list]
+    notifications = [row for row in added if isinstance(row, Notification)]
+    assert len(notifications) == 2
+    for notification in notifications:
+        assert notification.message is None
+        assert (notification.template_id, notification.template_version) == (
+            "new-listings",
+            3,
+        )
+        assert notification.variables == variables
+
+    # Workers load templated rows by id
+    outbox = [row for row in added if isinstance(row, OutboxMessage)]
+    assert [row.task_name for row in outbox] == [send_notification_batch.name] * 2
+    assert all(set(row.kwargs) == {"ids", "send_at"} for row in outbox)
+
+
+@pytest.mark.asyncio
+async def test_create_notification_template_missing_variables(
+    mock_db, mock_user_preferences
+):
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+
+    with patch("app.routes.notifications.template_cache") as mock_cache:
+        mock_cache.get = AsyncMock(return_value=make_compiled_template())
+        payload = NotificationPayload(
+            user_id="user123", template_id="new-listings", variables={"city": "Faro"}
+        )
+        with pytest.raises(HTTPException) as exc:
+            await create_notification(payload, db=mock_db)
+
+    assert exc.value.status_code == 422
+    assert exc.value.detail == "Missing template variables: count, name"
+    mock_db.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_create_notifications_batch_from_template(mock_db, mock_user_preferences):
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        mock_user_preferences
+    ]
+    mock_db.scalars.return_value = MagicMock(all=MagicMock(return_value=[10, 11]))
+
+    # One template for the batch, shared and per-user variables
+    payload = BatchNotificationPayload(
+        template_id="new-listings",
+        template_version=3,
+        variables={"city": "Porto"},
+        items=[
+            {"user_id": "user123", "variables": {"name": "Ana", "count": 2}},
+            {"user_id": "user123", "variables": {"name": "Rui"}},
+        ],
+    )
+    with patch("app.routes.notifications.template_cache") as mock_cache:
+        mock_cache.get = AsyncMock(return_value=make_compiled_template())
+        response = await create_notifications_batch(payload, db=mock_db)
+
+    mock_cache.get.assert_called_once_with(mock_db, "new-listings", 3)
+    assert [result["status"] for result in response["results"]] == [
+        "queued",
+        "failed",
+    ]
+    assert response["results"][1]["detail"] == "Missing template variables: count"
+
+    rows = mock_db.scalars.call_args[0][1]
+    assert {row["message"] for row in rows} == {None}
+    assert rows[0]["variables"] == {"city": "Porto", "name": "Ana", "count": 2}
+    assert rows[0]["template_version"] == 3
+
+
+def make_summary_row(notification_id, send_at):
+    row = MagicMock()
+    row._asdict.return_value = {
+        "id": notification_id,
+        "user_id": "user123",
+        "channel": "email",
+        "status": NotificationStatus.sent,
+        "send_at": send_at,
+        "sent_at": send_at,
+    }
+    return row
+
+
+@pytest.mark.asyncio
+async def test_list_notifications_paginates_with_cursor(mock_db):
+    send_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    mock_db.execute.return_value.all = MagicMock(
+        return_value=[make_summary_row(i, send_at) for i in (3, 2, 1)]
+    )
+
+    page = await list_notifications(
+        user_id="user123",
+        status=None,
+        channel=None,
+        send_at_from=None,
+        send_at_to=None,
+        limit=2,
+        cursor=None,
+        db=mock_db,
+    )
+
+    # One extra row was fetched, so there is a next page starting after id 2
+    assert [item.id for item in page.items] == [3, 2]
+    assert decode_cursor(page.next_cursor) == (send_at, 2)
+
+    await list_notifications(
+        user_id="user123",
+        status=NotificationStatus.sent,
+        channel="email",
+        send_at_from=None,
+        send_at_to=None,
+        limit=2,
+        cursor=page.next_cursor,
+        db=mock_db,
+    )
+
+    # The next page uses a keyset predicate and never OFFSET
+    statement = str(mock_db.execute.call_args[0][0].compile())
+    assert "(notifications.send_at, notifications.id) <" in statement
+    assert "OFFSET" not in statement
+    assert "notifications.message" not in statement
+
+
+@pytest.mark.asyncio
+async def test_list_notifications_last_page(mock_db):
+    send_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    mock_db.execute.return_value.all = MagicMock(
+        return_value=[make_summary_row(1, send_at)]
+    )
+
+    page = await list_notifications(
+        user_id=None,
+        status=NotificationStatus.failed,
+        channel=None,
+        send_at_from=None,
+        send_at_to=None,
+        limit=2,
+        cursor=None,
+        db=mock_db,
+    )
+
+    assert len(page.items) == 1
+    assert page.next_cursor is None
+
+
+@pytest.mark.asyncio
+async def test_list_notifications_requires_indexed_filter(mock_db):
+    with pytest.raises(HTTPException) as exc:
+        await list_notifications(
+            user_id=None,
+            status=None,
+            channel="sms",
+            send_at_from=None,
+            send_at_to=None,
+            limit=10,
+            cursor=None,
+            db=mock_db,
+        )
+    assert exc.value.status_code == 400
+    mock_db.execute.assert_not_called()
+
+
+def test_decode_cursor_rejects_garbage():
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor("not-a-cursor")
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_create_notification_idempotency_key_first_request(
+    mock_db, mock_user_preferences
+):
+    # The key is claimed, then the user's preferences are loaded
+    mock_db.execute.return_value.scalar_one_or_none.side_effect = [
+        "retry-1",
+        mock_user_preferences,
+    ]
+    payload = NotificationPayload(user_id="user123", subject="Hi", message="Body")
+
+    response = await create_notification(payload, db=mock_db, idempotency_key="retry-1")
+
+    assert response["status"] == "queued"
+    # The response is stored in the same transaction as the notifications
+    save = mock_db.execute.call_args_list[-1][0][0]
+    assert save.compile().params["response"] == response
+    mock_db.commit.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_create_notification_idempotency_key_replay(mock_db):
+    payload = NotificationPayload(user_id="user123", subject="Hi", message="Body")
+    stored = IdempotencyKey(
+        key="retry-1",
+        request_hash=request_hash(payload),
+        response={"status": "queued", "send_at": "2025-01-01T00:00:00+00:00"},
+    )
+    # The key is already live, so the stored response is returned
+    mock_db.execute.return_value.scalar_one_or_none.side_effect = [None, stored]
+
+    response = await create_notification(payload, db=mock_db, idempotency_key="retry-1")
+
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert response.body == (
+        b'{"status":"queued","send_at":"2025-01-01T00:00:00+00:00"}'
+    )
+    mock_db.add.assert_not_called()
+    mock_db.rollback.assert_called_once()
+    mock_db.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_create_notification_idempotency_key_payload_mismatch(mock_db):
+    stored = IdempotencyKey(key="retry-1", request_hash="other", response={})
+    mock_db.execute.return_value.scalar_one_or_none.side_effect = [None, stored]
+    payload = NotificationPayload(user_id="user123", subject="Hi", message="Body")
+
+    with pytest.raises(HTTPException) as exc:
+        await create_notification(payload, db=mock_db, idempotency_key="retry-1")
+
+    assert exc.value.status_code == 422
+    mock_db.add.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_redrive_dead_letters(mock_db):
+    first = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    last = datetime(2025, 3, 1, tzinfo=timezone.utc)
+    mock_db.execute.return_value.all = MagicMock(return_value=[(4, first), (7, last)])
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [4, 7]
+
+    response = await redrive_dead_letters(
+        RedrivePayload(channel="sms", spread_seconds=60), db=mock_db
+    )
+
+    assert response == {"redriven": 2, "notification_ids": [4, 7]}
+    mock_db.commit.assert_called_once()
+
+    # Only dead notifications are locked
+    locked, redriven = [call[0][0] for call in mock_db.execute.call_args_list]
+    assert "FOR UPDATE SKIP LOCKED" in str(locked.compile(dialect=postgresql.dialect()))
+    params = locked.compile().params
+    assert params["status_1"] == NotificationStatus.dead
+    assert params["channel_1"] == "sms"
+
+    # They are reset as retries spread over the window, by id and within
+    # their send_at range so only their partitions are scanned
+    sql = str(redriven.compile(dialect=postgresql.dialect()))
+    assert "now() + random() * CAST" in sql
+    assert "notifications.send_at BETWEEN" in sql
+    params = redriven.compile().params
+    assert params["status"] == NotificationStatus.retrying
+    assert params["attempts"] == 0
+    assert [4, 7] in params.values()
+    assert first in params.values() and last in params.values()
+
+
+@pytest.mark.asyncio
+async def test_redrive_dead_letters_nothing_dead(mock_db):
+    mock_db.execute.return_value.all = MagicMock(return_value=[])
+
+    response = await redrive_dead_letters(RedrivePayload(), db=mock_db)
+
+    assert response == {"redriven": 0, "notification_ids": []}
+    mock_db.execute.assert_called_once()
+    mock_db.commit.assert_called_once()
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+from app.outbox import batch_messages, expand_id_ranges, id_ranges, send_at_range
+
+NOW = datetime(2025, 3, 1, tzinfo=timezone.utc)
+
+
+def test_id_ranges_round_trip():
+    ids = [7, 3, 4, 5, 10, 11, 4]
+
+    ranges = id_ranges(ids)
+
+    assert ranges == [[3, 5], [7, 7], [10, 11]]
+    assert expand_id_ranges(ranges) == [3, 4, 5, 7, 10, 11]
+
+
+def test_batch_messages_one_per_queue_and_chunk():
+    queued = [(i, "email.low", NOW + timedelta(days=i)) for i in range(1, 6)]
+    queued.append((9, "sms.low", NOW))
+
+    messages = batch_messages("app.tasks.send_notification_batch", queued, max_ids=3)
+
+    assert messages == [
+        {
+            "task_name": "app.tasks.send_notification_batch",
+            "queue": "email.low",
+            "kwargs": {
+                "ids": [[1, 3]],
+                "send_at": ["2025-03-02T00:00:00+00:00", "2025-03-04T00:00:00+00:00"],
+            },
+        },
+        {
+            "task_name": "app.tasks.send_notification_batch",
+            "queue": "email.low",
+            "kwargs": {
+                "ids": [[4, 5]],
+                "send_at": ["2025-03-05T00:00:00+00:00", "2025-03-06T00:00:00+00:00"],
+            },
+        },
+        {
+            "task_name": "app.tasks.send_notification_batch",
+            "queue": "sms.low",
+            "kwargs": {
+                "ids": [[9, 9]],
+                "send_at": ["2025-03-01T00:00:00+00:00", "2025-03-01T00:00:00+00:00"],
+            },
+        },
+    ]
+
+
+def test_send_at_range():
+    messages = batch_messages(
+        "app.tasks.send_notification_batch",
+        [(1, "email.low", NOW), (2, "sms.low", NOW + timedelta(days=40))],
+        max_ids=10,
+    )
+
+    assert send_at_range(message["kwargs"] for message in messages) == (
+        NOW,
+        NOW + timedelta(days=40),
+    )
+    # A message queued by an earlier release leaves the range unbounded
+    kwargs = [messages[0]["kwargs"], {"notification_id": 3}]
+    assert send_at_range(kwargs) is None
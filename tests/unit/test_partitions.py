@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.partitions import (
+    add_months,
+    create_partition,
+    ensure_partitions,
+    month_start,
+    partition_month,
+    partition_name,
+)
+
+
+def make_conn(attached=(), overflow=False):
+    """A connection whose queries answer from the given catalog state."""
+    executed = []
+
+    async def execute(statement, params=None):
+        sql = str(statement)
+        executed.append(sql)
+        result = MagicMock()
+        if "pg_inherits" in sql:
+            result.scalars.return_value = list(attached)
+        elif "SELECT EXISTS" in sql:
+            result.scalar.return_value = overflow
+        return result
+
+    conn = AsyncMock()
+    conn.execute.side_effect = execute
+    return conn, executed
+
+
+def test_month_helpers():
+    month = month_start(datetime(2025, 11, 17, 13, 5, tzinfo=timezone.utc))
+
+    assert month == datetime(2025, 11, 1, tzinfo=timezone.utc)
+    assert add_months(month, 2) == datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert add_months(month, -11) == datetime(2024, 12, 1, tzinfo=timezone.utc)
+    assert partition_name(month) == "notifications_y2025m11"
+    assert partition_month("notifications_y2025m11") == month
+    assert partition_month("notifications_default") is None
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions_creates_missing_months():
+    conn, executed = make_conn(attached=["notifications_y2025m11"])
+
+    created = await ensure_partitions(
+        conn, months_ahead=2, now=datetime(2025, 11, 17, tzinfo=timezone.utc)
+    )
+
+    assert created == ["notifications_y2025m12", "notifications_y2026m01"]
+    assert "PARTITION OF notifications DEFAULT" in executed[0]
+    assert any(
+        "CREATE TABLE IF NOT EXISTS notifications_y2026m01 PARTITION OF notifications"
+        " FOR VALUES FROM ('2026-01-01T00:00:00+00:00') TO ('2026-02-01T00:00:00+00:00')"
+        in sql
+        for sql in executed
+    )
+
+
+@pytest.mark.asyncio
+async def test_create_partition_moves_rows_out_of_default():
+    conn, executed = make_conn(overflow=True)
+
+    await create_partition(conn, datetime(2026, 6, 1, tzinfo=timezone.utc))
+
+    # The default partition is detached while the new range is split off
+    assert "DETACH PARTITION notifications_default" in executed[1]
+    assert "CREATE TABLE notifications_y2026m06 PARTITION OF" in executed[2]
+    assert "DELETE FROM notifications_default" in executed[3]
+    assert "ATTACH PARTITION notifications_default DEFAULT" in executed[4]
@@ -1,13 +1,18 @@
+from datetime import time
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
 import pytest
 from fastapi import HTTPException
 from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
 
+from app.config import settings
 from app.routes.preferences import (
     PreferencesPayload,
     create_or_replace_preferences,
     get_preferences,
+    import_preferences,
 )
 
 
@@ -42,11 +47,13 @@ async def test_get_preferences_not_found(mock_db):
     assert exc.value.detail == "User preferences not found"
 
 
+def stored_row(**values):
+    """Mock the row returned by the upsert's RETURNING clause."""
+    return MagicMock(return_value=SimpleNamespace(**values))
+
+
 @pytest.mark.asyncio
 async def test_create_or_replace_preferences_create_new(mock_db):
-    # Use shared and module-specific fixtures
-    mock_db.execute.return_value.scalar_one_or_none = MagicMock(return_value=None)
-
     # Mock payload
     payload = {
         "email_enabled": True,
@@ -54,6 +61,7 @@ async def test_create_or_replace_preferences_create_new(mock_db):
         "email": "user@example.com",
         "phone_number": None,
     }
+    mock_db.execute.return_value.one = stored_row(**payload)
 
     # Convert payload dict to PreferencesPayload object
     payload_obj = PreferencesPayload(**payload)
@@ -70,24 +78,27 @@ async def test_create_or_replace_preferences_create_new(mock_db):
     assert response.email == payload["email"]
     assert response.phone_number == payload["phone_number"]
 
+    # One round trip: no SELECT before the write
+    mock_db.execute.assert_called_once()
+    sql = str(mock_db.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+    assert sql.startswith("INSERT INTO user_preferences")
+    assert "ON CONFLICT (user_id) DO UPDATE" in sql
+    assert "RETURNING" in sql
+
     # Ensure DB commit was called
     mock_db.commit.assert_called_once()
 
 
 @pytest.mark.asyncio
-async def test_create_or_replace_preferences_update_existing(
-    mock_db, mock_user_preferences
-):
-    # Use shared and module-specific fixtures
-    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
-
+async def test_create_or_replace_preferences_update_existing(mock_db):
     # Mock payload
     payload = {
         "email_enabled": True,
         "sms_enabled": False,
         "email": "new_email@example.com",
-        "phone_number": "1234567890",
+        "phone_number": "+1234567890",
     }
+    mock_db.execute.return_value.one = stored_row(**payload)
 
     # Convert payload dict to PreferencesPayload object
     payload_obj = PreferencesPayload(**payload)
@@ -108,6 +119,41 @@ async def test_create_or_replace_preferences_update_existing(
     mock_db.commit.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_create_or_replace_preferences_retains_omitted_contact(
+    mock_db, mock_user_preferences
+):
+    # The database keeps the stored email and phone number, and returns them
+    mock_db.execute.return_value.one = stored_row(
+        email_enabled=False,
+        sms_enabled=True,
+        email=mock_user_preferences.email,
+        phone_number=mock_user_preferences.phone_number,
+    )
+
+    response = await create_or_replace_preferences(
+        user_id="user123",
+        payload=PreferencesPayload(email_enabled=False, sms_enabled=True),
+        db=mock_db,
+    )
+
+    statement = mock_db.execute.call_args[0][0]
+    params = statement.compile().params
+    assert params["email"] is None
+    assert params["phone_number"] is None
+    # One upsert, so concurrent writers for a new user cannot race into a
+    # unique violation. Omitted contact details keep the stored ones.
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (user_id) DO UPDATE" in sql
+    assert "email = coalesce(excluded.email, user_preferences.email)" in sql
+    assert (
+        "phone_number = coalesce(excluded.phone_number, user_preferences.phone_number)"
+        in sql
+    )
+    assert response.email == mock_user_preferences.email
+    assert response.phone_number == mock_user_preferences.phone_number
+
+
 @pytest.mark.asyncio
 async def test_create_or_replace_preferences_invalid_payload():
     # Mock invalid payload (missing required fields)
@@ -122,3 +168,157 @@ async def test_create_or_replace_preferences_invalid_payload():
 
     # Assert the validation error contains the missing field
     assert "sms_enabled" in str(exc.value)
+
+
+def import_request(content_type, *chunks):
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    request = MagicMock()
+    request.headers = {"content-type": content_type}
+    request.stream = body
+    return request
+
+
+@pytest.mark.asyncio
+async def test_import_preferences_reports_invalid_rows(mock_db):
+    copied = []
+
+    async def load_preferences(db, records):  # pylint: disable=unused-argument
+        copied.extend([record async for record in records])
+        return len(copied)
+
+    request = import_request(
+        "application/x-ndjson; charset=utf-8",
+        b'{"user_id": "a", "email_enabled": true, "sms_enabled": false}\n',
+        b'{"user_id": "b", "email_enabled": "maybe", "sms_enabled": true}\n'
+        b'{"user_id": "c", "email_enabled": true, "sms_enabled": true,'
+        b' "email": "c@example.com"}\n',
+    )
+    with patch("app.routes.preferences.load_preferences", load_preferences):
+        result = await import_preferences(request=request, db=mock_db)
+
+    assert [record[:6] for record in copied] == [
+        (1, "a", True, False, None, None),
+        (3, "c", True, True, "c@example.com", None),
+    ]
+    assert result.imported == 2
+    assert result.invalid == 1
+    assert result.errors[0].line == 2
+    assert result.errors[0].error.startswith("email_enabled:")
+
+
+@pytest.mark.asyncio
+async def test_import_preferences_normalizes_recipients_per_chunk(mock_db, monkeypatch):
+    monkeypatch.setattr(settings, "preferences_import_chunk_size", 2)
+    copied = []
+
+    async def load_preferences(db, records):  # pylint: disable=unused-argument
+        copied.extend([record async for record in records])
+        return len(copied)
+
+    request = import_request(
+        "text/csv",
+        b"user_id,email_enabled,sms_enabled,email,phone_number\n"
+        b"a,true,true, a@example.com ,0034 600 12 34 56\n"
+        b"b,true,true,b@,\n"
+        b"c,true,true,,600123456\n"
+        b"d,true,true,,+34600123456\n",
+    )
+    with patch("app.routes.preferences.load_preferences", load_preferences):
+        result = await import_preferences(request=request, db=mock_db)
+
+    # Recipients are stored normalized, in line order across chunks
+    assert [record[:6] for record in copied] == [
+        (2, "a", True, True, "a@example.com", "+34600123456"),
+        (5, "d", True, True, None, "+34600123456"),
+    ]
+    assert [(error.line, error.error) for error in result.errors] == [
+        (3, "email: Unsupported email address 'b@'"),
+        (
+            4,
+            "phone_number: Invalid phone number '600123456', expected E.164"
+            " with a country code, e.g. +34600123456",
+        ),
+    ]
+    assert result.invalid == 2
+
+
+@pytest.mark.asyncio
+async def test_import_preferences_unsupported_content_type(mock_db):
+    with pytest.raises(HTTPException) as exc:
+        await import_preferences(
+            request=import_request("application/json", b"[]"), db=mock_db
+        )
+
+    assert exc.value.status_code == 415
+
+
+@pytest.mark.parametrize(
+    "rules, message",
+    [
+        ({"timezone": "Mars/Olympus_Mons"}, "Unknown timezone"),
+        ({"quiet_hours_start": "22:00"}, "must be provided together"),
+        ({"max_per_window": 5}, "must be provided together"),
+        ({"max_per_window": 0, "frequency_window_seconds": 60}, "greater than"),
+    ],
+)
+def test_preferences_payload_invalid_rules(rules, message):
+    with pytest.raises(ValidationError) as exc:
+        PreferencesPayload(email_enabled=True, sms_enabled=True, **rules)
+
+    assert message in str(exc.value)
+
+
+@pytest.mark.asyncio
+async def test_get_preferences_includes_rules(mock_db, mock_user_preferences):
+    mock_user_preferences.timezone = "Europe/Madrid"
+    mock_user_preferences.quiet_hours_start = time(22)
+    mock_user_preferences.quiet_hours_end = time(7)
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+
+    response = await get_preferences(user_id="user123", db=mock_db)
+
+    assert response.timezone == "Europe/Madrid"
+    assert response.quiet_hours_start == time(22)
+    assert response.quiet_hours_end == time(7)
+    assert response.max_per_window is None
+    assert response.digest_on_overflow is False
+
+
+def test_preferences_payload_normalizes_phone_number():
+    payload = PreferencesPayload(
+        email_enabled=True, sms_enabled=True, phone_number="0034 600-12 34 56"
+    )
+
+    assert payload.phone_number == "+34600123456"
+
+
+@pytest.mark.parametrize(
+    "contact, message",
+    [
+        ({"phone_number": "600123456"}, "expected E.164"),
+        ({"phone_number": "+12 34"}, "expected E.164"),
+        # A valid address, but not one the email notifier can send to
+        ({"email": "josé@example.com"}, "Unsupported email address"),
+    ],
+)
+def test_preferences_payload_invalid_contact(contact, message):
+    with pytest.raises(ValidationError) as exc:
+        PreferencesPayload(email_enabled=True, sms_enabled=True, **contact)
+
+    assert message in str(exc.value)
+
+
+@pytest.mark.asyncio
+async def test_get_preferences_stored_before_validation(mock_db, mock_user_preferences):
+    # Written before phone numbers and addresses were validated on write
+    mock_user_preferences.phone_number = "555-1234"
+    mock_user_preferences.email = "José@example.com"
+    mock_db.execute.return_value.scalar_one_or_none.return_value = mock_user_preferences
+
+    response = await get_preferences(user_id="user123", db=mock_db)
+
+    assert response.phone_number == "555-1234"
+    assert response.email == "José@example.com"
@@ -0,0 +1,186 @@
+from datetime import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+
+from app.cache import preferences_cache
+from app.models import UserPreference
+from app.preferences_bulk import (
+    dump_preferences,
+    load_preferences,
+    read_rows,
+    upsert,
+)
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(rows):
+    return [row async for row in rows]
+
+
+class Partitions:
+    """Stands in for a streamed result, yielding the given chunks."""
+
+    def __init__(self, *chunks):
+        self.chunks = chunks
+
+    async def partitions(self, size=None):  # pylint: disable=unused-argument
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_read_rows_ndjson_across_chunks():
+    rows = await collect(
+        read_rows(
+            stream(
+                b'{"user_id": "a", "email_enabled": true}\n{"user_',
+                b'id": "b"}\r\n\nnot json\n[1]\n{"user_id": "c"}',
+            ),
+            "ndjson",
+        )
+    )
+
+    assert rows[0] == (1, {"user_id": "a", "email_enabled": True})
+    assert rows[1] == (2, {"user_id": "b"})
+    # Blank lines are skipped but still counted
+    assert rows[2][0] == 4 and "Invalid JSON" in str(rows[2][1])
+    assert rows[3][0] == 5 and str(rows[3][1]) == "Expected a JSON object"
+    assert rows[4] == (6, {"user_id": "c"})
+
+
+@pytest.mark.asyncio
+async def test_read_rows_csv():
+    rows = await collect(
+        read_rows(
+            stream(
+                b"\xef\xbb\xbfuser_id,email_enabled,sms_enabled,email,phone_number\n"
+                b'a,true,false,"a@example.com",\n'
+                b"b,true\n"
+            ),
+            "csv",
+        )
+    )
+
+    assert rows[0] == (
+        2,
+        {
+            "user_id": "a",
+            "email_enabled": "true",
+            "sms_enabled": "false",
+            "email": "a@example.com",
+        },
+    )
+    assert rows[1][0] == 3
+    assert str(rows[1][1]) == "Expected 5 fields, got 2"
+
+
+def test_upsert_keeps_contact_details_when_omitted():
+    statement = upsert(
+        insert(UserPreference).values(
+            user_id="user123", email_enabled=True, sms_enabled=False
+        )
+    )
+
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (user_id) DO UPDATE" in sql
+    assert "email = coalesce(excluded.email, user_preferences.email)" in sql
+    assert (
+        "phone_number = coalesce(excluded.phone_number, user_preferences.phone_number)"
+        in sql
+    )
+
+
+@pytest.mark.asyncio
+async def test_load_preferences(mock_db):
+    copied = []
+
+    async def copy_records_to_table(table, records, columns):
+        copied.extend([record async for record in records])
+
+    raw = MagicMock()
+    raw.driver_connection.copy_records_to_table = copy_records_to_table
+    mock_db.connection.return_value.get_raw_connection = AsyncMock(return_value=raw)
+    mock_db.execute.return_value.rowcount = 2
+    mock_db.stream_scalars = AsyncMock(return_value=Partitions(["a", "b"]))
+    records = [
+        (1, "a", True, False, None, None, None, None, None, None, None, False),
+        (2, "b", True, True, None, None, "UTC", None, None, 5, 3600, True),
+    ]
+
+    with patch.object(
+        preferences_cache, "invalidate_many", AsyncMock()
+    ) as invalidate_many:
+        imported = await load_preferences(mock_db, stream(*records))
+
+    assert imported == 2
+    assert copied == records
+    statements = [
+        str(call[0][0].compile(dialect=postgresql.dialect()))
+        for call in mock_db.execute.call_args_list
+    ]
+    assert "CREATE TEMPORARY TABLE preferences_import" in statements[1]
+    # The last line of each user wins, merged in one statement
+    assert "DISTINCT ON (preferences_import.user_id)" in statements[2]
+    assert "preferences_import.line DESC" in statements[2]
+    assert "ON CONFLICT (user_id) DO UPDATE" in statements[2]
+    assert statements[3] == "DROP TABLE IF EXISTS preferences_import"
+    invalidate_many.assert_called_once_with(["a", "b"])
+    assert mock_db.commit.call_count == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "fmt, expected",
+    [
+        (
+            "ndjson",
+            '{"user_id": "a", "email_enabled": true, "sms_enabled": false,'
+            ' "email": "a@example.com", "phone_number": null,'
+            ' "timezone": "Europe/Madrid", "quiet_hours_start": "22:00:00",'
+            ' "quiet_hours_end": "07:00:00", "max_per_window": null,'
+            ' "frequency_window_seconds": null, "digest_on_overflow": false}\n',
+        ),
+        (
+            "csv",
+            "user_id,email_enabled,sms_enabled,email,phone_number,timezone,"
+            "quiet_hours_start,quiet_hours_end,max_per_window,"
+            "frequency_window_seconds,digest_on_overflow\n"
+            "a,true,false,a@example.com,,Europe/Madrid,22:00:00,07:00:00,,,false\n",
+        ),
+    ],
+)
+async def test_dump_preferences(fmt, expected):
+    session = AsyncMock()
+    session.stream.return_value = Partitions(
+        [
+            (
+                "a",
+                True,
+                False,
+                "a@example.com",
+                None,
+                "Europe/Madrid",
+                time(22),
+                time(7),
+                None,
+                None,
+                False,
+            )
+        ]
+    )
+    session_factory = MagicMock()
+    session_factory.return_value.__aenter__.return_value = session
+
+    with patch("app.preferences_bulk.AsyncSessionLocal", session_factory):
+        output = "".join(await collect(dump_preferences(fmt)))
+
+    assert output == expected
+    statement = session.stream.call_args[0][0]
+    assert statement.get_execution_options()["yield_per"] == 1_000
@@ -0,0 +1,47 @@
+import pytest
+
+from app.recipients import normalize_email, normalize_phone, normalize_recipients
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("+34600123456", "+34600123456"),
+        ("+1 (234) 567-8901", "+12345678901"),
+        ("0044 20 7946 0958", "+442079460958"),
+        ("+33.6.12.34.56.78", "+33612345678"),
+        ("600123456", None),  # no country code
+        ("+123", None),
+        ("+1234567890123456", None),
+        ("+1234567890x", None),
+    ],
+)
+def test_normalize_phone(value, expected):
+    assert normalize_phone(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (" user@example.com\n", "user@example.com"),
+        ("first.last+tag@mail.example.co.uk", "first.last+tag@mail.example.co.uk"),
+        ("user@localhost", None),
+        ("user example@example.com", None),
+        ("user@example.com\nBcc: other@example.com", None),
+    ],
+)
+def test_normalize_email(value, expected):
+    assert normalize_email(value) == expected
+
+
+def test_normalize_recipients_column():
+    channels = ["email", "sms", "sms", "email", "sms"]
+    recipients = ["a@example.com", "+1 234 567 8901", "123", None, "+1 234 567 8901"]
+
+    assert normalize_recipients(channels, recipients) == [
+        "a@example.com",
+        "+12345678901",
+        None,
+        None,
+        "+12345678901",
+    ]
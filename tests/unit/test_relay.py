@@ -0,0 +1,76 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.models import OutboxMessage
+from app.relay import compression_options, relay_outbox
+
+
+@pytest.mark.asyncio
+async def test_relay_outbox(mock_db):
+    messages = [
+        OutboxMessage(
+            id=1,
+            task_name="app.tasks.a",
+            queue="sms.low",
+            kwargs={"notification_id": 1},
+        ),
+        OutboxMessage(id=2, task_name="app.tasks.b", kwargs={"notification_id": 2}),
+    ]
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = messages
+
+    with patch("app.relay.celery_app") as mock_celery_app:
+        count = await relay_outbox(mock_db, limit=100)
+
+    assert count == 2
+
+    # Messages are locked with SKIP LOCKED so relays can run side by side
+    claim = mock_db.execute.call_args_list[0][0][0]
+    assert "FOR UPDATE SKIP LOCKED" in str(claim.compile(dialect=postgresql.dialect()))
+
+    # Published in order over one producer, then deleted in one statement
+    producer = mock_celery_app.producer_or_acquire.return_value.__enter__()
+    assert [
+        (
+            call.args[0],
+            call.kwargs["kwargs"],
+            call.kwargs["queue"],
+            call.kwargs["producer"],
+        )
+        for call in mock_celery_app.send_task.call_args_list
+    ] == [
+        ("app.tasks.a", {"notification_id": 1}, "sms.low", producer),
+        ("app.tasks.b", {"notification_id": 2}, None, producer),
+    ]
+    delete_params = mock_db.execute.call_args_list[1][0][0].compile().params
+    assert [1, 2] in delete_params.values()
+    mock_db.commit.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_relay_outbox_broker_down(mock_db):
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        OutboxMessage(id=1, task_name="app.tasks.a", kwargs={})
+    ]
+
+    with patch("app.relay.celery_app") as mock_celery_app:
+        mock_celery_app.send_task.side_effect = ConnectionError()
+        with pytest.raises(ConnectionError):
+            await relay_outbox(mock_db, limit=100)
+
+    # Nothing is deleted, so the messages are retried on the next round
+    mock_db.execute.assert_called_once()
+    mock_db.commit.assert_not_called()
+
+
+def test_compression_only_for_large_messages():
+    assert compression_options({"ids": [[1, 100]]}) == {}
+
+    # Scattered ids do not collapse into ranges
+    options = compression_options({"ids": [[i, i] for i in range(0, 2000, 2)]})
+
+    assert options["compression"] == "zlib"
+    assert options["kwargsrepr"].endswith("bytes>")
@@ -0,0 +1,112 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from app.resilience import AdaptiveLimiter, CircuitBreaker
+
+
+async def trip(breaker):
+    assert await breaker.allow()
+    await breaker.record(successes=5, failures=5)
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_on_failure_spike():
+    breaker = CircuitBreaker("sms", failure_threshold=0.5, min_calls=10)
+
+    await breaker.record(successes=5, failures=4)
+    assert await breaker.allow()  # below min_calls
+
+    await breaker.record(successes=0, failures=1)
+    assert not await breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_breaker_ignores_failures_below_threshold():
+    breaker = CircuitBreaker("sms", failure_threshold=0.5, min_calls=10)
+
+    await breaker.record(successes=90, failures=10)
+
+    assert await breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_breaker_half_open_probe_closes_on_success():
+    breaker = CircuitBreaker("email", min_calls=10, open_seconds=30)
+    with patch("app.resilience.time.monotonic", return_value=100):
+        await trip(breaker)
+    with patch("app.resilience.time.monotonic", return_value=131):
+        assert await breaker.allow()  # the trial batch
+        assert not await breaker.allow()  # everyone else waits for it
+        await breaker.record(successes=3, failures=0)
+        assert await breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_breaker_half_open_probe_reopens_on_failure():
+    breaker = CircuitBreaker("email", min_calls=10, open_seconds=30)
+    with patch("app.resilience.time.monotonic", return_value=100):
+        await trip(breaker)
+    with patch("app.resilience.time.monotonic", return_value=131):
+        assert await breaker.allow()
+        await breaker.record(successes=2, failures=1)
+        assert not await breaker.allow()
+    with patch("app.resilience.time.monotonic", return_value=162):
+        assert await breaker.allow()
+
+
+def test_limiter_backs_off_once_per_round():
+    limiter = AdaptiveLimiter("sms", min_limit=1, max_limit=40, latency_target=1.0)
+
+    # A round of slow sends that all started together halves the limit once
+    with patch("app.resilience.time.perf_counter", return_value=12.0):
+        for _ in range(10):
+            limiter.record(started=10.0)
+    assert limiter.limit == 20
+
+    # A slow send started after the cut cuts it again
+    with patch("app.resilience.time.perf_counter", return_value=14.0):
+        limiter.record(started=12.5)
+    assert limiter.limit == 10
+
+
+def test_limiter_grows_additively_up_to_max():
+    limiter = AdaptiveLimiter("email", max_limit=4, latency_target=1.0)
+    limiter.limit = 2
+
+    with patch("app.resilience.time.perf_counter", return_value=10.1):
+        # About one more slot per round of `limit` fast sends
+        for _ in range(2):
+            limiter.record(started=10.0)
+        assert limiter.limit == pytest.approx(2.9)
+        for _ in range(100):
+            limiter.record(started=10.0)
+    assert limiter.limit == 4
+
+
+def test_limiter_backs_off_on_overload_errors():
+    limiter = AdaptiveLimiter("sms", min_limit=2, max_limit=8)
+
+    for _ in range(5):
+        limiter.record(started=0.0, overloaded=True)
+        limiter._decreased_at = 0.0  # pylint: disable=protected-access
+
+    assert limiter.limit == 2
+
+
+@pytest.mark.asyncio
+async def test_limiter_caps_in_flight_sends():
+    limiter = AdaptiveLimiter("email", max_limit=2)
+    peak = 0
+
+    async def send():
+        nonlocal peak
+        async with limiter:
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(send() for _ in range(10)))
+
+    assert peak == 2
+    assert limiter.in_flight == 0
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta, timezone
+
+import aiosmtplib
+
+from app.models import Notification, NotificationStatus
+from app.notifiers.sms_client import SMSProviderError
+from app.resilience import CircuitOpenError
+from app.retry import MAX_ERROR_LENGTH, RETRY_POLICIES, RetryPolicy, next_state
+from app.rules import FrequencyCapError, QuietHoursError
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def make_notification(channel="email", attempts=0):
+    return Notification(id=1, channel=channel, attempts=attempts)
+
+
+def test_next_state_sent():
+    state = next_state(make_notification(attempts=1), None, NOW)
+
+    assert state["status"] == NotificationStatus.sent
+    assert state["sent_at"] == NOW
+    assert state["attempts"] == 2
+
+
+def test_next_state_transient_error_is_retried_with_backoff():
+    error = aiosmtplib.SMTPResponseException(451, "Try again later")
+
+    state = next_state(make_notification(), error, NOW)
+
+    assert state["status"] == NotificationStatus.retrying
+    assert state["attempts"] == 1
+    policy = RETRY_POLICIES["email"]
+    assert NOW <= state["next_attempt_at"] <= NOW + timedelta(seconds=policy.base_delay)
+    assert state["last_error"] == "SMTPResponseException: (451, 'Try again later')"
+
+
+def test_next_state_exhausted_retries_are_dead_lettered():
+    policy = RETRY_POLICIES["sms"]
+    error = SMSProviderError("SMS provider returned 503", status_code=503)
+
+    state = next_state(
+        make_notification("sms", attempts=policy.max_attempts - 1), error, NOW
+    )
+
+    assert state["status"] == NotificationStatus.dead
+    assert state["next_attempt_at"] is None
+
+
+def test_next_state_permanent_errors_fail():
+    rejected = SMSProviderError("SMS provider returned 400", status_code=400)
+    bounced = aiosmtplib.SMTPResponseException(550, "No such user")
+
+    assert next_state(make_notification("sms"), rejected, NOW)["status"] == (
+        NotificationStatus.failed
+    )
+    assert next_state(make_notification(), bounced, NOW)["status"] == (
+        NotificationStatus.failed
+    )
+    assert next_state(make_notification(), ValueError(), NOW)["status"] == (
+        NotificationStatus.failed
+    )
+
+
+def test_retry_policy_backoff_is_capped_and_jittered():
+    policy = RetryPolicy(
+        max_attempts=10, base_delay=1, max_delay=8, retryable=(ConnectionError,)
+    )
+
+    delays = [policy.next_delay(attempts) for attempts in range(1, 10)]
+
+    assert all(0 <= delay <= min(8, 2 ** (i)) for i, delay in enumerate(delays))
+    assert len(set(delays)) > 1
+
+
+def test_next_state_open_circuit_does_not_count_an_attempt():
+    error = CircuitOpenError("sms", retry_after=30)
+
+    state = next_state(make_notification(channel="sms", attempts=4), error, NOW)
+
+    assert state["status"] == NotificationStatus.retrying
+    assert state["attempts"] == 4
+    assert state["next_attempt_at"] >= NOW + timedelta(seconds=30)
+
+
+def test_next_state_quiet_hours_do_not_count_an_attempt():
+    state = next_state(make_notification(attempts=2), QuietHoursError(3600), NOW)
+
+    assert state["status"] == NotificationStatus.retrying
+    assert state["attempts"] == 2
+    assert state["next_attempt_at"] >= NOW + timedelta(seconds=3600)
+
+
+def test_next_state_rescheduled_errors_are_truncated():
+    quiet_hours = QuietHoursError(3600)
+    quiet_hours.args = ("x" * 1000,)
+
+    for error in (CircuitOpenError("x" * 1000, retry_after=30), quiet_hours):
+        state = next_state(make_notification(), error, NOW)
+
+        assert len(state["last_error"]) == MAX_ERROR_LENGTH
+
+
+def test_next_state_frequency_cap_holds_for_digest_or_suppresses():
+    held = next_state(
+        make_notification(),
+        FrequencyCapError(5, 3600, retry_after=600, digest=True),
+        NOW,
+    )
+    suppressed = next_state(
+        make_notification(),
+        FrequencyCapError(5, 3600, retry_after=600, digest=False),
+        NOW,
+    )
+
+    assert held["status"] == NotificationStatus.held
+    assert held["next_attempt_at"] == NOW + timedelta(seconds=600)
+    assert held["attempts"] == 0
+    assert suppressed["status"] == NotificationStatus.suppressed
+    assert suppressed["next_attempt_at"] is None
+    assert suppressed["last_error"].startswith("FrequencyCapError: Frequency cap")
+
+
+def test_next_state_frequency_cap_error_is_truncated():
+    error = FrequencyCapError(5, 3600, retry_after=600, digest=True)
+    error.args = ("x" * 1000,)
+
+    state = next_state(make_notification(), error, NOW)
+
+    assert len(state["last_error"]) == MAX_ERROR_LENGTH
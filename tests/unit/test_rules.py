@@ -0,0 +1,116 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+
+from app.cache import CachedPreference
+from app.models import Notification
+from app.rules import (
+    FrequencyCapError,
+    FrequencyWindows,
+    QuietHoursError,
+    check_rules,
+    compile_rules,
+    rules_for,
+)
+
+
+def make_notification(notification_id, user_id="user123", channel="email"):
+    return Notification(id=notification_id, user_id=user_id, channel=channel)
+
+
+def test_compile_rules_without_restrictions_is_none():
+    assert compile_rules(None, None, None, None, None, False) is None
+    assert compile_rules("Europe/Madrid", None, None, None, None, True) is None
+
+
+def test_compiled_rules_are_shared_by_value():
+    preference = CachedPreference(
+        user_id="a",
+        email_enabled=True,
+        sms_enabled=True,
+        email=None,
+        phone_number=None,
+        quiet_hours_start="22:00:00",
+        quiet_hours_end="07:00:00",
+    )
+    other = CachedPreference(**{**preference.__dict__, "user_id": "b"})
+
+    assert rules_for(preference) is rules_for(other)
+
+
+@pytest.mark.parametrize(
+    "utc_time, expected",
+    [
+        # Europe/Madrid is UTC+1 in January: 22:30 local, 8.5 hours left
+        (datetime(2025, 1, 1, 21, 30, tzinfo=timezone.utc), 8.5 * 3600),
+        # 06:00 local, one hour left
+        (datetime(2025, 1, 1, 5, 0, tzinfo=timezone.utc), 3600),
+        # 12:00 local, outside quiet hours
+        (datetime(2025, 1, 1, 11, 0, tzinfo=timezone.utc), 0),
+    ],
+)
+def test_quiet_hours_across_midnight(utc_time, expected):
+    rules = compile_rules("Europe/Madrid", "22:00:00", "07:00:00", None, None, False)
+
+    assert rules.quiet_for(utc_time) == expected
+
+
+def test_quiet_hours_within_a_day():
+    rules = compile_rules(None, "13:00:00", "15:00:00", None, None, False)
+
+    assert rules.quiet_for(datetime(2025, 1, 1, 14, tzinfo=timezone.utc)) == 3600
+    assert rules.quiet_for(datetime(2025, 1, 1, 15, tzinfo=timezone.utc)) == 0
+
+
+@pytest.mark.asyncio
+async def test_local_windows_slide():
+    windows = FrequencyWindows()
+    requests = [("frequency:a:email", 2, 60, ["1", "2", "3"])]
+
+    with patch("app.rules.time.time", return_value=1000):
+        assert await windows.admit_many(requests) == [(2, 60)]
+    # Still full 30s later; the oldest sends leave the window after 60s
+    with patch("app.rules.time.time", return_value=1030):
+        assert await windows.admit_many(requests) == [(0, 30)]
+    with patch("app.rules.time.time", return_value=1060):
+        assert await windows.admit_many(requests) == [(2, 60)]
+
+
+@pytest.mark.asyncio
+async def test_redis_errors_let_sends_through():
+    windows = FrequencyWindows(redis_url="redis://localhost:1/0")
+
+    results = await windows.admit_many([("frequency:a:email", 1, 60, ["1", "2"])])
+
+    assert results == [(2, 0.0)]
+
+
+@pytest.mark.asyncio
+async def test_check_rules():
+    now = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+    rules = {
+        "capped": compile_rules(None, None, None, 2, 3600, False),
+        "digest": compile_rules(None, None, None, 1, 3600, True),
+        "asleep": compile_rules(None, "11:00:00", "13:00:00", 10, 3600, False),
+    }
+    notifications = [
+        make_notification(1, "capped"),
+        make_notification(2, "capped", "sms"),
+        make_notification(3, "capped"),
+        make_notification(4, "capped"),
+        make_notification(5, "digest"),
+        make_notification(6, "digest"),
+        make_notification(7, "asleep"),
+        make_notification(8, "no-rules"),
+    ]
+
+    held = await check_rules(notifications, rules, now)
+
+    assert set(held) == {4, 6, 7}
+    # Caps count per channel, earliest ids first
+    assert isinstance(held[4], FrequencyCapError) and not held[4].digest
+    assert isinstance(held[6], FrequencyCapError) and held[6].digest
+    assert held[6].retry_after == pytest.approx(3600, abs=1)
+    assert isinstance(held[7], QuietHoursError)
+    assert held[7].retry_after == 3600
@@ -0,0 +1,22 @@
+import asyncio
+
+from app.tasks.runtime import WorkerRuntime
+
+
+def test_runtime_reuses_event_loop():
+    runtime = WorkerRuntime()
+
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    try:
+        # Tasks run on the same loop instead of a new one per call
+        first = runtime.run(current_loop())
+        second = runtime.run(current_loop())
+        assert first is second
+        assert runtime.session_factory is not None
+    finally:
+        runtime.stop()
+
+    assert not runtime.started
+    assert runtime.engine is None
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.models import NotificationStatus
+from app.scheduler import enqueue_due_notifications
+from app.tasks.notification_tasks import send_notification_batch
+
+SEND_AT = datetime(2025, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_due_notifications(mock_db):
+    # Two scheduled notifications are due, then one retry, then one held
+    # notification whose frequency window has room again, then one whose
+    # worker died while sending it
+    mock_db.execute.return_value.all = MagicMock(
+        side_effect=[
+            [(1, "email", "high", SEND_AT), (2, "sms", "high", SEND_AT)],
+            [(3, "sms", "low", SEND_AT)],
+            [(4, "sms", "low", SEND_AT)],
+            [(5, "sms", "low", SEND_AT)],
+        ]
+    )
+    mock_db.execute.return_value.rowcount = 0
+
+    count = await enqueue_due_notifications(mock_db, limit=100)
+
+    assert count == 5
+
+    # Rows are claimed with SKIP LOCKED so concurrent schedulers don't collide
+    scheduled, retries, held = [
+        str(call[0][0].compile(dialect=postgresql.dialect()))
+        for call in mock_db.execute.call_args_list[:3]
+    ]
+    assert "FOR UPDATE SKIP LOCKED" in scheduled
+    assert "notifications.send_at <= now()" in scheduled
+    assert "notifications.next_attempt_at <= now()" in retries
+    assert "notifications.next_attempt_at <= now()" in held
+    claimed_statuses = [
+        call[0][0].compile().params["status_1"]
+        for call in mock_db.execute.call_args_list[1:3]
+    ]
+    assert claimed_statuses == [NotificationStatus.retrying, NotificationStatus.held]
+
+    # Every queued row gets a lease
+    assert "next_attempt_at=(now() + %(now_1)s)" in scheduled
+    # Leases that expired on the last attempt are dead-lettered, the other
+    # expired ones are queued again, counting an attempt if they were claimed
+    dead_letters, expired = [call[0][0] for call in mock_db.execute.call_args_list[3:5]]
+    assert dead_letters.compile().params["status"] == NotificationStatus.dead
+    expired_sql = str(expired.compile(dialect=postgresql.dialect()))
+    assert "notifications.status IN (__[POSTCOMPILE_status_2])" in expired_sql
+    assert "attempts=CASE WHEN" in expired_sql
+
+    # Claimed ids are queued in the outbox as one message per queue,
+    # committed with the claim
+    outbox_rows = mock_db.execute.call_args_list[5][0][1]
+    assert outbox_rows == [
+        {
+            "task_name": send_notification_batch.name,
+            "queue": queue,
+            "kwargs": {"ids": ids, "send_at": [SEND_AT.isoformat()] * 2},
+        }
+        for queue, ids in (
+            ("email.high", [[1, 1]]),
+            ("sms.high", [[2, 2]]),
+            ("sms.low", [[3, 5]]),
+        )
+    ]
+    mock_db.commit.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_enqueue_due_notifications_nothing_due(mock_db):
+    mock_db.execute.return_value.all = MagicMock(return_value=[])
+    mock_db.execute.return_value.rowcount = 0
+
+    count = await enqueue_due_notifications(mock_db, limit=100)
+
+    assert count == 0
+    # Claims and dead-lettering only, no outbox insert
+    assert mock_db.execute.call_count == 5
+
+
+@pytest.mark.asyncio
+async def test_enqueue_due_notifications_full_batch_skips_retries(mock_db):
+    mock_db.execute.return_value.all = MagicMock(
+        return_value=[(1, "email", "high", SEND_AT), (2, "sms", "high", SEND_AT)]
+    )
+
+    count = await enqueue_due_notifications(mock_db, limit=2)
+
+    assert count == 2
+    assert mock_db.execute.call_count == 2  # scheduled claim and outbox insert
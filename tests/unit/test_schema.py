@@ -0,0 +1,44 @@
+from unittest.mock import MagicMock
+
+import pytest
+from alembic.script import ScriptDirectory
+from sqlalchemy.exc import ProgrammingError
+
+from app.schema import (
+    SchemaVersionError,
+    alembic_config,
+    check_schema_version,
+    head_revision,
+)
+
+
+def test_migrations_have_a_single_head():
+    heads = ScriptDirectory.from_config(alembic_config()).get_heads()
+    assert heads == [head_revision()]
+
+
+@pytest.mark.asyncio
+async def test_check_schema_version_up_to_date(mock_db):
+    mock_db.execute.return_value = MagicMock()
+    mock_db.execute.return_value.scalar_one_or_none.return_value = head_revision()
+
+    await check_schema_version(mock_db)
+
+    mock_db.execute.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_check_schema_version_behind(mock_db):
+    mock_db.execute.return_value = MagicMock()
+    mock_db.execute.return_value.scalar_one_or_none.return_value = "0000"
+
+    with pytest.raises(SchemaVersionError, match="expected"):
+        await check_schema_version(mock_db)
+
+
+@pytest.mark.asyncio
+async def test_check_schema_version_never_migrated(mock_db):
+    mock_db.execute.side_effect = ProgrammingError("SELECT", {}, Exception())
+
+    with pytest.raises(SchemaVersionError, match="revision None"):
+        await check_schema_version(mock_db)
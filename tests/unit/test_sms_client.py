@@ -0,0 +1,86 @@
+import time
+
+import httpx
+import pytest
+
+from app.notifiers.sms_client import SMSProviderError, TokenBucket, TwilioClient
+
+
+def make_client(handler, **kwargs):
+    return TwilioClient(
+        account_sid="AC123",
+        auth_token="token",
+        from_number="+1234567890",
+        base_url="http://sms.test",
+        transport=httpx.MockTransport(handler),
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_send_sms():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(201, json={"sid": "SM1"})
+
+    client = make_client(handler, rate_limit=100)
+    sid = await client.send_sms("+1987654321", "New listings")
+    await client.aclose()
+
+    assert sid == "SM1"
+    assert requests[0].url.path == "/2010-04-01/Accounts/AC123/Messages.json"
+    assert b"To=%2B1987654321" in requests[0].content
+
+
+@pytest.mark.asyncio
+async def test_send_sms_throttled_pauses_bucket():
+    responses = iter(
+        [
+            httpx.Response(429, headers={"Retry-After": "0.2"}),
+            httpx.Response(201, json={"sid": "SM2"}),
+        ]
+    )
+
+    client = make_client(lambda request: next(responses), rate_limit=100)
+    with pytest.raises(SMSProviderError) as exc_info:
+        await client.send_sms("+1987654321", "New listings")
+    assert exc_info.value.retryable
+
+    # The next send waits for the Retry-After period
+    start = time.monotonic()
+    sid = await client.send_sms("+1987654321", "New listings")
+    await client.aclose()
+
+    assert sid == "SM2"
+    assert time.monotonic() - start >= 0.15
+
+
+@pytest.mark.asyncio
+async def test_send_sms_server_error_is_not_retried_by_client():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503)
+
+    client = make_client(handler, rate_limit=100)
+    with pytest.raises(SMSProviderError) as exc_info:
+        await client.send_sms("+1987654321", "New listings")
+    await client.aclose()
+
+    assert exc_info.value.retryable
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    start = time.monotonic()
+    for _ in range(5):
+        await bucket.acquire()
+
+    # The first token is available immediately, the next four take 1/20s each
+    assert time.monotonic() - start >= 0.18
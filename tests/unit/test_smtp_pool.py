@@ -0,0 +1,78 @@
+import socket
+from email.message import EmailMessage
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.notifiers.smtp_pool import SMTPConnectionPool
+
+
+class RecordingHandler:
+    """aiosmtpd handler that keeps every delivered message."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(  # pylint: disable=invalid-name,unused-argument
+        self, server, session, envelope
+    ):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    """Fixture for a local in-process SMTP server."""
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def make_message(index):
+    message = EmailMessage()
+    message["From"] = "alerts@example.com"
+    message["To"] = f"user{index}@example.com"
+    message["Subject"] = f"Alert {index}"
+    message.set_content("New listings")
+    return message
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections(  # pylint: disable=redefined-outer-name
+    smtp_server,
+):
+    controller, handler = smtp_server
+    pool = SMTPConnectionPool(controller.hostname, controller.port, size=2)
+
+    for index in range(10):
+        await pool.send_message(make_message(index))
+    await pool.close()
+
+    assert len(handler.messages) == 10
+    assert pool.connections_opened == 1  # sequential sends share one connection
+
+
+@pytest.mark.asyncio
+async def test_pool_reconnects_after_disconnect(
+    smtp_server,
+):  # pylint: disable=redefined-outer-name
+    controller, handler = smtp_server
+    pool = SMTPConnectionPool(controller.hostname, controller.port, size=1)
+
+    await pool.send_message(make_message(0))
+    # Drop the pooled connection behind the pool's back
+    client, _ = pool._idle[-1]  # pylint: disable=protected-access
+    client.close()
+    await pool.send_message(make_message(1))
+    await pool.close()
+
+    assert len(handler.messages) == 2
+    assert pool.connections_opened == 2
@@ -0,0 +1,113 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pydantic import ValidationError
+
+from app.models import MessageTemplate, Notification
+from app.routes.templates import TemplatePayload, create_template_version
+from app.templates import (
+    CompiledTemplate,
+    TemplateCache,
+    TemplateError,
+    compile_text,
+    render_notifications,
+    template_cache,
+)
+
+
+def make_template(version=1):
+    return MessageTemplate(
+        id="new-listings",
+        version=version,
+        subject="$count new listings in ${city}",
+        body="Hi $name, prices start at $$${price}.",
+    )
+
+
+def test_compile_and_render():
+    template = CompiledTemplate.from_model(make_template())
+
+    assert template.variables == {"count", "city", "name", "price"}
+    assert template.render(
+        {"count": 3, "city": "Lisbon", "name": "Ana", "price": 1200}
+    ) == ("3 new listings in Lisbon", "Hi Ana, prices start at $1200.")
+
+
+def test_compile_rejects_invalid_placeholders():
+    with pytest.raises(TemplateError):
+        compile_text("Price: $ 100")
+
+
+def test_render_reports_missing_variables():
+    template = CompiledTemplate.from_model(make_template())
+
+    assert template.missing({"count": 1, "city": "Porto"}) == {"name", "price"}
+    with pytest.raises(TemplateError):
+        template.render({"count": 1, "city": "Porto"})
+
+
+@pytest.mark.asyncio
+async def test_cache_loads_each_version_once(mock_db):
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        make_template(1),
+        make_template(2),
+    ]
+    cache = TemplateCache()
+
+    keys = [("new-listings", 1), ("new-listings", 2), ("new-listings", 1)]
+    first = await cache.get_many(mock_db, keys)
+    second = await cache.get_many(mock_db, keys)
+
+    assert first == second
+    assert set(first) == {("new-listings", 1), ("new-listings", 2)}
+    mock_db.execute.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_render_notifications(mock_db):
+    template_cache.clear()
+    mock_db.execute.return_value.scalars = MagicMock()
+    mock_db.execute.return_value.scalars.return_value.all.return_value = [
+        make_template()
+    ]
+    variables = {"count": 2, "city": "Faro", "name": "Rui", "price": 900}
+    notifications = [
+        Notification(id=1, subject="Plain", message="Text"),
+        Notification(
+            id=2, template_id="new-listings", template_version=1, variables=variables
+        ),
+        Notification(id=3, template_id="new-listings", template_version=1),
+        Notification(id=4, template_id="gone", template_version=1),
+    ]
+
+    contents = await render_notifications(mock_db, notifications)
+
+    assert contents[1] == ("Plain", "Text")
+    assert contents[2] == ("2 new listings in Faro", "Hi Rui, prices start at $900.")
+    assert isinstance(contents[3], TemplateError)  # missing variables
+    assert isinstance(contents[4], TemplateError)  # unknown version
+    mock_db.execute.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_create_template_version(mock_db):
+    mock_db.execute.return_value.scalar_one = MagicMock(return_value=make_template(2))
+
+    response = await create_template_version(
+        "new-listings",
+        TemplatePayload(subject="$count new listings", body="Hi $name"),
+        db=mock_db,
+    )
+
+    # The next version number is computed in the INSERT itself
+    statement = str(mock_db.execute.call_args[0][0].compile())
+    assert "max(message_templates.version)" in statement
+    assert response.version == 2
+    assert response.variables == ["city", "count", "name", "price"]
+    mock_db.commit.assert_called_once()
+
+
+def test_template_payload_rejects_invalid_placeholders():
+    with pytest.raises(ValidationError):
+        TemplatePayload(subject="Save $ 100", body="Body")